@@ -18,6 +18,7 @@ Containers:
     purge                           purge unused containers and images
 Tests:
     tests                            run tests
+    benchmark [options]              run benchmark suite on synthetic data (see manage.py benchmark --help)
 
 EOF
 )
@@ -40,12 +41,15 @@ case "$1" in
     tests)
         docker-compose run --rm simulation pytest -s
         ;;
+    benchmark) #--scales 1e3,1e4 --output results.json --baseline previous.json
+        docker-compose run --rm simulation python simulation/manage.py benchmark ${@:2}
+        ;;
     migrate)
         docker-compose run --rm simulation python simulation/manage.py makemigrations
         docker-compose run --rm simulation python simulation/manage.py migrate
         ;;
     elastic)
-        docker-compose run --rm simulation python simulation/manage.py search_index --rebuild
+        docker-compose run --rm simulation python simulation/manage.py rebuild_search_index
         ;; 
     populate-db) #--weather
         docker-compose run --rm simulation python simulation/populate_db_from_file.py ${@:2}
@@ -0,0 +1,3 @@
+from .cases import CASES
+from .dataset import BenchmarkDataset
+from .runner import BenchmarkRunner, compare, measure
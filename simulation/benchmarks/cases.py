@@ -0,0 +1,213 @@
+from datetime import timedelta
+from typing import Callable, Dict
+
+import numpy as np
+from django.urls import reverse
+from rest_framework.test import APIClient
+from smarthome.balance import BuildingBalanceCalculator
+from smarthome.costs import (BuildingCostCalculator, PriceSeries, to_seconds,
+                             window_integrals)
+from smarthome.models import Device, EnergyGenerator, EnergyReceiver
+from smarthome.models_calculators import (EnergyGeneratorCalculator,
+                                          EnergyReceiverCalculator)
+from smarthome.peaks import PeakDemandCalculator
+from smarthome.soc import clamped_cumsum
+from smarthome.storage_optimizer import Battery, optimize_dispatch
+from smarthome.whatif import BaseBuilding, parameter_grid, run_variants
+from synthetic.engine import Fleet, TickSimulator
+
+from .dataset import BenchmarkDataset
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+CASES: Dict[str, Callable] = {}
+
+
+def benchmark_case(name: str):
+    """Register a case factory. A factory prepares its inputs and returns the callable to time.
+
+    A callable with an `items` attribute is also reported as throughput (items per second).
+    """
+    def register(factory):
+        CASES[name] = factory
+        return factory
+    return register
+
+
+@benchmark_case("receiver_calculator")
+def receiver_calculator(dataset: BenchmarkDataset) -> Callable:
+    device = EnergyReceiver.objects.filter(building=dataset.buildings[0]).first()
+    start_date, end_date = dataset.start, dataset.end
+    return lambda: EnergyReceiverCalculator().get_device_energy_calculation(device, start_date, end_date)
+
+
+@benchmark_case("generator_calculator")
+def generator_calculator(dataset: BenchmarkDataset) -> Callable:
+    device = EnergyGenerator.objects.filter(building=dataset.buildings[0]).first()
+    start_date, end_date = dataset.window(days=7)
+    return lambda: EnergyGeneratorCalculator().get_device_energy_calculation(device, start_date, end_date)
+
+
+@benchmark_case("building_energy_view")
+def building_energy_view(dataset: BenchmarkDataset) -> Callable:
+    client = APIClient()
+    url = reverse("smarthome:energy", kwargs={"pk": dataset.buildings[0].pk})
+    start_date, end_date = dataset.window(days=7)
+    params = {"start_date": start_date.strftime(DATE_FORMAT), "end_date": end_date.strftime(DATE_FORMAT)}
+
+    def run():
+        response = client.get(url, data=params)
+        assert response.status_code == 200, response.content
+    return run
+
+
+@benchmark_case("building_cost")
+def building_cost(dataset: BenchmarkDataset) -> Callable:
+    # hourly prices over the whole dataset, priced in one pass like the cost endpoint does
+    hours = np.arange(to_seconds([dataset.start])[0], to_seconds([dataset.end])[0] + 3600, 3600)
+    prices = 0.4 + 0.3 * np.sin(np.arange(len(hours)) * 2 * np.pi / 24) ** 2
+    calculator = BuildingCostCalculator(PriceSeries(hours, prices, prices * 0.6))
+    building = dataset.buildings[0]
+    return lambda: calculator.calculate(building, dataset.start, dataset.end, step=timedelta(days=1))
+
+
+@benchmark_case("building_balance")
+def building_balance(dataset: BenchmarkDataset) -> Callable:
+    building = dataset.buildings[0]
+    return lambda: BuildingBalanceCalculator().calculate(building, dataset.start, dataset.end)
+
+
+@benchmark_case("building_peaks")
+def building_peaks(dataset: BenchmarkDataset) -> Callable:
+    building = dataset.buildings[0]
+    return lambda: PeakDemandCalculator().calculate(building, dataset.start, dataset.end)
+
+
+@benchmark_case("storage_dispatch_year")
+def storage_dispatch_year(dataset: BenchmarkDataset, step_hours: float = 0.25) -> Callable:
+    # a year at 15-minute steps of one building, independent of the dataset scale
+    rng = np.random.default_rng(0)
+    steps = np.arange(int(365 * 24 / step_hours))
+    day = steps % int(24 / step_hours) / (24 / step_hours)
+    net_load = (0.3 + 0.5 * rng.random(len(steps)) - 2 * np.clip(np.sin(2 * np.pi * (day - 0.25)), 0, None)) * step_hours
+    buy = 0.4 + 0.3 * np.sin(2 * np.pi * day) ** 2
+    battery = Battery(capacity_kwh=10.0, max_power_kw=1.0, loss_factor=0.05)
+    run = lambda: optimize_dispatch(net_load, buy, buy * 0.6, battery, step_hours)
+    run.items = len(steps)
+    return run
+
+
+@benchmark_case("charge_state_quarter")
+def charge_state_quarter(dataset: BenchmarkDataset, days: int = 90) -> Callable:
+    # 1-minute state of charge of one battery over a quarter from two charging/usage jobs a day
+    rng = np.random.default_rng(0)
+    boundaries = np.arange(days * 24 * 60 + 1) * 60.0
+    starts = np.sort(rng.random(2 * days)) * boundaries[-1] * 0.99
+    ends = np.minimum(starts + rng.uniform(1800, 4 * 3600, len(starts)), boundaries[-1])
+    power = rng.choice([1.0, -1.0], len(starts)) * rng.uniform(0.2, 2.0, len(starts))
+
+    def run():
+        return clamped_cumsum(window_integrals(starts, ends, power, boundaries), 5.0, 10.0)
+    run.items = len(boundaries) - 1
+    return run
+
+
+@benchmark_case("simulate_fleet_week")
+def simulate_fleet_week(dataset: BenchmarkDataset, buildings: int = 1000, step_minutes: int = 5) -> Callable:
+    # a week of 1000 buildings like the dataset ones at 5-minute ticks, independent of the dataset scale
+    devices = [device for device in dataset.generator.devices(0) if device["type"] == "EnergyReceiver"]
+    fleet = Fleet.from_specifications([{
+        "receivers": [(device["name"], device["device_power"]) for device in devices],
+        "generation_power": 5000.0, "storage_capacity_kwh": 10.0,
+    }] * buildings)
+    ticks = 7 * 24 * 60 // step_minutes
+    pv_factors = np.clip(np.sin(2 * np.pi * (np.arange(ticks) * step_minutes / 1440 - 0.25)), 0, None) * 0.95 / 1000
+
+    def run():
+        TickSimulator(fleet, dataset.start, timedelta(minutes=step_minutes)).run(pv_factors)
+    run.items = buildings * ticks
+    return run
+
+
+@benchmark_case("whatif_grid")
+def whatif_grid(dataset: BenchmarkDataset, days: int = 30, step_minutes: int = 15, workers: int = None) -> Callable:
+    # 64 variants of a month of one building like the dataset ones, on all cores
+    devices = [device for device in dataset.generator.devices(0) if device["type"] == "EnergyReceiver"]
+    steps = days * 24 * 60 // step_minutes
+    rng = np.random.default_rng(0)
+    arrays = {
+        "on_hours": (rng.random((steps, len(devices))) < 0.1) * (step_minutes / 60),
+        "pv_kwh_per_watt": np.clip(np.sin(2 * np.pi * (np.arange(steps) * step_minutes / 1440 - 0.25)), 0, None)
+        * 0.95 / 1000 * step_minutes / 60,
+        "buy": np.full(steps, 0.3),
+        "sell": np.full(steps, 0.1),
+    }
+    base = BaseBuilding(5000.0, 100.0, 48.0, [device["name"] for device in devices],
+                        [device["device_power"] for device in devices])
+    variants = parameter_grid(base, {"generation_power": [0, 3000, 6000, 9000], "capacity": [0, 100, 200, 400],
+                                     f"device_power:{devices[0]['name']}": [500, 1000, 2000, 4000]})
+
+    def run():
+        run_variants(arrays, variants, step_minutes / 60, 0.1, 0.05, workers=workers)
+    run.items = len(variants)
+    return run
+
+
+@benchmark_case("ingest_raports_post")
+def ingest_raports_post(dataset: BenchmarkDataset, raports: int = 100) -> Callable:
+    client = APIClient()
+    device = EnergyReceiver.objects.filter(building=dataset.buildings[0]).last()
+    url = reverse("smarthome:device-raports", kwargs={"pk": device.pk})
+    runs = iter(range(1, 10 ** 6))
+
+    def run():
+        # every run posts a fresh hour-long batch after the generated history
+        offset = dataset.end + timedelta(days=next(runs))
+        payload = [
+            {
+                "turned_on": (offset + timedelta(minutes=2 * index)).strftime(DATE_FORMAT),
+                "turned_off": (offset + timedelta(minutes=2 * index + 1)).strftime(DATE_FORMAT),
+            }
+            for index in range(raports)
+        ]
+        response = client.post(url, data=payload, format="json")
+        assert response.status_code == 200, response.content
+    return run
+
+
+@benchmark_case("ingest_toggle")
+def ingest_toggle(dataset: BenchmarkDataset, toggles: int = 20) -> Callable:
+    client = APIClient()
+    device = EnergyReceiver.objects.filter(building=dataset.buildings[0]).first()
+    url = reverse("smarthome:device-detail", kwargs={"pk": device.pk})
+
+    def run():
+        for index in range(toggles):
+            response = client.patch(url, data={"resourcetype": "EnergyReceiver", "state": index % 2 == 0}, format="json")
+            assert response.status_code == 200, response.content
+    return run
+
+
+@benchmark_case("ingest_events")
+def ingest_events(dataset: BenchmarkDataset, events: int = 5000) -> Callable:
+    client = APIClient()
+    url = reverse("smarthome:device-events")
+    device_ids = list(Device.objects.filter(building__in=dataset.buildings).values_list("pk", flat=True))
+    runs = iter(range(1, 10 ** 6))
+
+    def run():
+        # every run sends shuffled on/off pairs after the generated history, with every tenth event repeated
+        offset = dataset.end + timedelta(days=next(runs))
+        payload = [
+            {
+                "device": device_ids[index % len(device_ids)],
+                "state": (index // len(device_ids)) % 2 == 0,
+                "timestamp": (offset + timedelta(seconds=index)).strftime(DATE_FORMAT),
+            }
+            for index in range(events)
+        ]
+        payload = payload[1::2] + payload[::2] + payload[::10]
+        response = client.post(url, data=payload, format="json")
+        assert response.status_code == 200, response.content
+    run.items = events + len(range(0, events, 10))
+    return run
@@ -0,0 +1,95 @@
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from smarthome.models import Building, DeviceRaport, WeatherRaport
+from smarthome.scenario import create_building, get_or_create_user
+from smarthome.search_backends import get_search_backend
+from synthetic import SyntheticDataGenerator
+
+
+class BenchmarkDataset:
+    """Loads `raports` synthetic device sessions and `weather_days` of 5-minute weather into the database.
+
+    Buildings are added until no receiver has more than `sessions_per_device` sessions,
+    so big scales grow the tables rather than the history of a single device.
+    """
+
+    def __init__(self, generator: SyntheticDataGenerator, raports: int, sessions_per_device: int = 1000,
+                 weather_days: int = 30, batch_size: int = 5000):
+        self.generator = generator
+        self.raports = raports
+        self.weather_end = generator.start + timedelta(days=weather_days)
+        self.batch_size = batch_size
+        receivers = generator.receivers_per_building
+        self.buildings_count = max(1, math.ceil(raports / (receivers * sessions_per_device)))
+        self.buildings: List[Building] = []
+        self.end = generator.start
+
+    def sessions_count(self, building_index: int, receiver_index: int) -> int:
+        receivers_total = self.buildings_count * self.generator.receivers_per_building
+        position = building_index * self.generator.receivers_per_building + receiver_index
+        base, remainder = divmod(self.raports, receivers_total)
+        return base + (1 if position < remainder else 0)
+
+    def _create_building(self, building_index: int) -> Building:
+        user_data = self.generator.user(building_index)
+        return create_building(get_or_create_user(user_data["email"], user_data["name"]),
+                               self.generator.building(building_index), self.generator.devices(building_index))
+
+    def _bulk_create(self, model, objects: List) -> List:
+        model.objects.bulk_create(objects, batch_size=self.batch_size, ignore_conflicts=True)
+        return []
+
+    def load(self) -> Dict[str, float]:
+        """Fill the database and return the time spent in each ingest phase [s]."""
+        timings = {}
+
+        started = time.perf_counter()
+        self.buildings = [self._create_building(index) for index in range(self.buildings_count)]
+        timings["devices"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pending = []
+        for building_index, building in enumerate(self.buildings):
+            devices = {device.name: device for device in building.building_devices.all()}
+            receivers = [data for data in self.generator.devices(building_index) if data["type"] == "EnergyReceiver"]
+            for receiver_index, device_data in enumerate(receivers):
+                count = self.sessions_count(building_index, receiver_index)
+                for turned_on, turned_off in self.generator.sessions(building_index, device_data, count):
+                    pending.append(DeviceRaport(device=devices[device_data["name"]], turned_on=turned_on, turned_off=turned_off))
+                    self.end = max(self.end, turned_off)
+                    if len(pending) >= self.batch_size:
+                        pending = self._bulk_create(DeviceRaport, pending)
+        self._bulk_create(DeviceRaport, pending)
+        timings["device_raports"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pending = []
+        for datetime_from, datetime_to, solar_radiation, temperature, wind_speed in self.generator.weather(self.weather_end):
+            pending.append(WeatherRaport(
+                datetime_from=datetime_from, datetime_to=datetime_to, solar_radiation=solar_radiation,
+                temperature=temperature, wind_speed=wind_speed,
+            ))
+            if len(pending) >= self.batch_size:
+                pending = self._bulk_create(WeatherRaport, pending)
+        self._bulk_create(WeatherRaport, pending)
+        timings["weather_raports"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.index()
+        timings["search_index"] = time.perf_counter() - started
+        return timings
+
+    def index(self):
+        """Bulk-created rows do not send signals, so the search index has to be filled explicitly."""
+        get_search_backend().rebuild()
+
+    @property
+    def start(self) -> datetime:
+        return self.generator.start
+
+    def window(self, days: float) -> Tuple[datetime, datetime]:
+        """Window of `days` days ending with the generated weather, where every device already has history."""
+        return max(self.start, self.weather_end - timedelta(days=days)), self.weather_end
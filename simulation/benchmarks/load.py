@@ -0,0 +1,162 @@
+import abc
+import http.client
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+
+PERCENTILES = (50, 95, 99)
+
+
+class Reply(NamedTuple):
+    status: int
+    body: bytes
+
+
+class Transport(abc.ABC):
+    """Sends requests of one client; a client (thread) owns its transport."""
+
+    @abc.abstractmethod
+    def request(self, method: str, path: str, body: Optional[object] = None, headers: Dict[str, str] = None) -> Reply:
+        """Send one request and return its reply."""
+
+    def close(self):
+        """Called by the thread of the client when it is done."""
+
+
+class InProcessTransport(Transport):
+    """Requests through Django's URL routing, middleware and views in this process, without sockets."""
+
+    def __init__(self):
+        # a host the settings accept ("testserver" is only allowed under the test runner);
+        # errors of the views become 500 replies, as from a server
+        hosts = [host.lstrip(".") for host in settings.ALLOWED_HOSTS if host and host != "*"]
+        self.client = Client(raise_request_exception=False, HTTP_HOST=hosts[0] if hosts else "localhost")
+
+    def request(self, method, path, body=None, headers=None):
+        extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in (headers or {}).items()}
+        data = json.dumps(body) if body is not None else None
+        response = self.client.generic(method, path, data or "", content_type="application/json", **extra)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return Reply(response.status_code, content)
+
+    def close(self):
+        # connections of client threads would stay open; the caller's own transaction is left alone
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+
+
+class HttpTransport(Transport):
+    """Requests to a running instance over one keep-alive connection."""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(url.netloc, timeout=timeout)
+        self.prefix = url.path.rstrip("/")
+
+    def request(self, method, path, body=None, headers=None):
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        payload = json.dumps(body).encode() if body is not None else None
+        try:
+            self.connection.request(method, self.prefix + path, payload, headers)
+            response = self.connection.getresponse()
+            return Reply(response.status, response.read())
+        except (OSError, http.client.HTTPException):
+            # reconnect with the next request
+            self.connection.close()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+def transport_factory(base_url: Optional[str]):
+    """Transports to `base_url`, or into this process without it."""
+    return (lambda: HttpTransport(base_url)) if base_url else InProcessTransport
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """Count, mean, max and percentiles of latencies, in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    milliseconds = np.asarray(seconds) * 1000
+    values = np.percentile(milliseconds, PERCENTILES)
+    return {
+        "count": len(milliseconds),
+        "mean_ms": float(milliseconds.mean()),
+        **{f"p{percentile}_ms": float(value) for percentile, value in zip(PERCENTILES, values)},
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+class LatencyRecorder:
+    """Latencies and errors per endpoint, shared by the client threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, endpoint: str, seconds: float, ok: bool = True):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def timed(self, transport: Transport, endpoint: str, method: str, path: str, body=None, headers=None,
+              since: float = None) -> Optional[Reply]:
+        """Send a request and record it; failures (status >= 400 or connection errors) count as errors.
+
+        The latency runs from `since` (perf_counter) when given, e.g. from when an open-loop request arrived.
+        """
+        started = time.perf_counter() if since is None else since
+        try:
+            reply = transport.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            reply = None
+        self.record(endpoint, time.perf_counter() - started, reply is not None and reply.status < 400)
+        return reply
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def report(self) -> Dict[str, Dict]:
+        """Per endpoint: requests, errors, error rate, throughput (requests/s) and latency summary."""
+        elapsed = self.elapsed
+        return {
+            endpoint: {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / len(latencies),
+                "throughput": len(latencies) / elapsed if elapsed else 0.0,
+                **latency_summary(latencies),
+            }
+            for endpoint, latencies in sorted(self.latencies.items())
+        }
+
+
+def format_report(report: Dict[str, Dict]) -> List[str]:
+    """One text line per endpoint."""
+    lines = []
+    for endpoint, row in report.items():
+        if not row["requests"]:
+            continue
+        lines.append(f"{endpoint:<24} {row['requests']:>8} req {row['throughput']:>9.1f}/s "
+                     f"p50 {row['p50_ms']:>8.1f} ms p95 {row['p95_ms']:>8.1f} ms p99 {row['p99_ms']:>8.1f} ms "
+                     f"errors {row['error_rate']:.2%}")
+    return lines
@@ -0,0 +1,188 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from django.urls import reverse
+
+from .load import LatencyRecorder, Transport
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+WORKLOADS = ("toggle", "bulk_raports", "energy", "buildings")
+DEFAULT_MIX = {"toggle": 50, "bulk_raports": 5, "energy": 35, "buildings": 10}
+DEFAULT_WINDOWS_HOURS = (1, 24, 168, 720)
+
+
+class Targets(NamedTuple):
+    building_ids: List[int]
+    receiver_ids: List[int]
+
+
+class Request(NamedTuple):
+    endpoint: str
+    method: str
+    path: str
+    body: Optional[object] = None
+
+
+def _results(reply) -> List[Dict]:
+    # lists are paginated only when asked to
+    if reply.status >= 400:
+        return []
+    data = json.loads(reply.body)
+    return data["results"] if isinstance(data, dict) else data
+
+
+def discover_targets(transport: Transport, buildings: int) -> Targets:
+    """The first `buildings` buildings and their receivers, found through the API like any client would."""
+    building_ids = [building["id"] for building in
+                    _results(transport.request("GET", f"{reverse('smarthome:building-list')}?page_size={buildings}"))]
+    receiver_ids = []
+    for building_id in building_ids:
+        devices = _results(transport.request("GET", reverse("smarthome:building-devices", kwargs={"pk": building_id})))
+        receiver_ids += [device["id"] for device in devices if device.get("resourcetype") == "EnergyReceiver"]
+    return Targets(building_ids, receiver_ids)
+
+
+class LoadTest:
+    """Sends a weighted mix of requests with `concurrency` clients and records them per endpoint.
+
+    Closed loop (no `rate`): every client sends its next request as soon as the last one answered.
+    Open loop: requests arrive at `rate` per second (Poisson) whatever the answers; clients take
+    them in arrival order and latency runs from the arrival, so time spent queued behind slow
+    answers is counted instead of hidden (coordinated omission). The test stops after `duration`
+    seconds or `requests` requests, whichever comes first.
+    """
+
+    def __init__(self, targets: Targets, transport_factory: Callable[[], Transport], mix: Dict[str, float] = None,
+                 concurrency: int = 8, rate: float = None, duration: float = 30.0, requests: int = None,
+                 windows_hours: Sequence[float] = DEFAULT_WINDOWS_HOURS, end_date: datetime = None,
+                 batch_size: int = 100, seed: int = 0):
+        mix = {name: weight for name, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+        if not targets.receiver_ids:
+            mix.pop("toggle", None)
+            mix.pop("bulk_raports", None)
+        if not targets.building_ids:
+            mix.pop("energy", None)
+        if not mix:
+            raise ValueError("Nothing to send: the mix is empty or has no targets.")
+        self.targets = targets
+        self.transport_factory = transport_factory
+        self.workloads, self.weights = list(mix), list(mix.values())
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.duration = duration
+        self.requests = requests
+        self.windows_hours = list(windows_hours)
+        self.end_date = end_date or datetime.now().replace(microsecond=0)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.recorder = LatencyRecorder()
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._device_states: Dict[int, bool] = {}
+        self._batches = 0
+        self._arrivals: List[float] = []
+
+    def next_request(self, rng: random.Random) -> Request:
+        workload = rng.choices(self.workloads, self.weights)[0]
+        if workload == "toggle":
+            device_id = rng.choice(self.targets.receiver_ids)
+            with self._lock:
+                state = self._device_states[device_id] = not self._device_states.get(device_id, False)
+            return Request("toggle", "PATCH", reverse("smarthome:device-detail", kwargs={"pk": device_id}), {"state": state})
+        if workload == "bulk_raports":
+            device_id = rng.choice(self.targets.receiver_ids)
+            with self._lock:
+                self._batches += 1
+                batch = self._batches
+            # every batch gets its own stretch of time after the queried windows, so posts never overlap
+            offset = self.end_date + timedelta(days=1, minutes=2 * self.batch_size * batch)
+            body = [{"turned_on": (offset + timedelta(minutes=2 * index)).strftime(DATE_FORMAT),
+                     "turned_off": (offset + timedelta(minutes=2 * index + 1)).strftime(DATE_FORMAT)}
+                    for index in range(self.batch_size)]
+            return Request("bulk_raports", "POST", reverse("smarthome:device-raports", kwargs={"pk": device_id}), body)
+        if workload == "energy":
+            hours = rng.choice(self.windows_hours)
+            query = urlencode({"start_date": (self.end_date - timedelta(hours=hours)).strftime(DATE_FORMAT),
+                               "end_date": self.end_date.strftime(DATE_FORMAT)})
+            path = reverse("smarthome:energy", kwargs={"pk": rng.choice(self.targets.building_ids)})
+            return Request(f"energy {hours:g}h", "GET", f"{path}?{query}")
+        # one page, as the clients list buildings
+        return Request("buildings", "GET", f"{reverse('smarthome:building-list')}?page_size=100")
+
+    def _take(self, deadline: float) -> Tuple[bool, Optional[float]]:
+        """Whether to send another request and, in open loop, when it arrived."""
+        with self._lock:
+            if self.requests is not None and self._sent >= self.requests:
+                return False, None
+            if self.rate is None:
+                if time.perf_counter() >= deadline:
+                    return False, None
+                self._sent += 1
+                return True, None
+            if self._sent >= len(self._arrivals):
+                return False, None
+            arrival = self._arrivals[self._sent]
+            self._sent += 1
+            return True, arrival
+
+    def _run_client(self, index: int, deadline: float):
+        rng = random.Random(f"{self.seed}:{index}")
+        transport = self.transport_factory()
+        try:
+            while True:
+                send, arrival = self._take(deadline)
+                if not send:
+                    break
+                if arrival is not None:
+                    wait = arrival - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                request = self.next_request(rng)
+                self.recorder.timed(transport, request.endpoint, request.method, request.path, request.body,
+                                    since=arrival)
+        finally:
+            transport.close()
+
+    def run(self) -> Dict:
+        started = time.perf_counter()
+        deadline = started + self.duration
+        if self.rate is not None:
+            rng, moment = random.Random(self.seed), started
+            count = self.requests if self.requests is not None else int(self.rate * self.duration * 2) + 1
+            for _ in range(count):
+                moment += rng.expovariate(self.rate)
+                if moment > deadline:
+                    break
+                self._arrivals.append(moment)
+        self.recorder.started = started
+        if self.concurrency == 1:
+            self._run_client(0, deadline)
+        else:
+            threads = [threading.Thread(target=self._run_client, args=(index, deadline), daemon=True)
+                       for index in range(self.concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.recorder.finish()
+
+        endpoints = self.recorder.report()
+        requests = sum(row["requests"] for row in endpoints.values())
+        errors = sum(row["errors"] for row in endpoints.values())
+        elapsed = self.recorder.elapsed
+        return {
+            "mode": "closed" if self.rate is None else "open",
+            "concurrency": self.concurrency,
+            "offered_rate": self.rate,
+            "seconds": elapsed,
+            "requests": requests,
+            "throughput": requests / elapsed if elapsed else 0.0,
+            "error_rate": errors / requests if requests else 0.0,
+            "targets": {"buildings": len(self.targets.building_ids), "receivers": len(self.targets.receiver_ids)},
+            "endpoints": endpoints,
+        }
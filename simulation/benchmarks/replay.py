@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple
+
+from django.urls import reverse
+from file_readers import RaportsFileReader
+from smarthome.clock import VIRTUAL_TIME_HEADER
+from smarthome.models import Building, Device
+from synthetic.scenario import MANIFEST_FILENAME
+from users.models import User
+
+from .load import LatencyRecorder, Transport, latency_summary
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+TOGGLE_ENDPOINT = "device toggle"
+
+
+class Toggle(NamedTuple):
+    time: datetime
+    state: bool  # switching off sorts before switching on at the same time
+    device_id: int
+
+
+def scenario_files(path: str) -> List[str]:
+    """Raports files of a generate_scenario directory (from its manifest) or the file itself."""
+    if not os.path.isdir(path):
+        return [path]
+    with open(os.path.join(path, MANIFEST_FILENAME)) as file:
+        manifest = json.load(file)
+    return [os.path.join(path, building["raports_file"]) for user in manifest["users"] for building in user["buildings"]]
+
+
+def read_toggles(paths: List[str]) -> List[Toggle]:
+    """Every raport of the files as a switch on and (when it ended) a switch off, in time order.
+
+    Devices are looked up by name in the building of the file header, as populate_db_from_file does.
+    """
+    toggles = []
+    for path in paths:
+        reader = RaportsFileReader(path)
+        devices = None
+        with reader:
+            for device_name, raport in reader.iter_raports():
+                if devices is None:
+                    user = User.objects.get(email=reader.header.get("user_email"))
+                    building = Building.objects.get(name=reader.header.get("building_name"), user=user)
+                    devices = dict(Device.objects.filter(building=building).values_list("name", "id"))
+                if device_name not in devices:
+                    raise Device.DoesNotExist(f"{path}: no device named {device_name!r} in the building")
+                toggles.append(Toggle(datetime.strptime(raport["turned_on"], DATE_FORMAT), True, devices[device_name]))
+                if raport.get("turned_off"):
+                    toggles.append(Toggle(datetime.strptime(raport["turned_off"], DATE_FORMAT), False, devices[device_name]))
+    toggles.sort()
+    return toggles
+
+
+class ScenarioReplay:
+    """Sends recorded toggles through the device endpoint `speedup` times faster than they happened.
+
+    Each toggle carries its recorded time in the X-Virtual-Time header, so raports get the
+    scenario's timestamps (the server needs VIRTUAL_TIME_ENABLED). Devices are split between
+    `clients` threads, which keeps the toggles of one device in order. A client that falls
+    behind sends at once; the end-to-end latency is measured from when a toggle was due.
+    """
+
+    def __init__(self, toggles: List[Toggle], transport_factory: Callable[[], Transport], speedup: float = 10000,
+                 clients: int = 8):
+        self.toggles = toggles
+        self.transport_factory = transport_factory
+        self.speedup = speedup
+        self.clients = max(1, clients)
+        self.recorder = LatencyRecorder()
+        self.end_to_end: List[float] = []
+        self._lock = threading.Lock()
+
+    def _run_client(self, toggles: List[Toggle], origin: datetime, wall_origin: float):
+        transport = self.transport_factory()
+        paths = {}
+        delays = []
+        try:
+            for toggle in toggles:
+                due = wall_origin + (toggle.time - origin).total_seconds() / self.speedup
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                if toggle.device_id not in paths:
+                    paths[toggle.device_id] = reverse("smarthome:device-detail", kwargs={"pk": toggle.device_id})
+                self.recorder.timed(transport, TOGGLE_ENDPOINT, "PATCH", paths[toggle.device_id], {"state": toggle.state},
+                                    {VIRTUAL_TIME_HEADER: toggle.time.isoformat(sep=" ")})
+                delays.append(time.perf_counter() - due)
+        finally:
+            transport.close()
+            with self._lock:
+                self.end_to_end.extend(delays)
+
+    def run(self) -> Dict:
+        if not self.toggles:
+            return {"toggles": 0}
+        shares = [[] for _ in range(self.clients)]
+        for toggle in self.toggles:
+            shares[toggle.device_id % self.clients].append(toggle)
+        origin = self.toggles[0].time
+        wall_origin = time.perf_counter()
+        self.recorder.started = wall_origin
+        if self.clients == 1:
+            self._run_client(shares[0], origin, wall_origin)
+        else:
+            threads = [threading.Thread(target=self._run_client, args=(share, origin, wall_origin), daemon=True)
+                       for share in shares if share]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.recorder.finish()
+
+        elapsed = self.recorder.elapsed
+        span = (self.toggles[-1].time - origin).total_seconds()
+        toggles = self.recorder.report().get(TOGGLE_ENDPOINT, {})
+        return {
+            "toggles": len(self.toggles),
+            "clients": self.clients,
+            "seconds": elapsed,
+            "scenario_seconds": span,
+            "requested_speedup": self.speedup,
+            "achieved_speedup": span / elapsed if elapsed else None,
+            "throughput": len(self.toggles) / elapsed if elapsed else None,
+            "errors": toggles.get("errors", 0),
+            "request_latency": latency_summary(self.recorder.latencies[TOGGLE_ENDPOINT]),
+            "end_to_end_latency": latency_summary(self.end_to_end),
+        }
@@ -0,0 +1,126 @@
+import gc
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+
+import django
+from django.core.management import call_command
+
+from synthetic import SyntheticDataGenerator
+
+from .cases import CASES
+from .dataset import BenchmarkDataset
+
+
+def measure(func: Callable, repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """Time `func` `repeat` times after `warmup` untimed calls, with the garbage collector paused."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "max_s": max(samples),
+        "repeat": repeat,
+    }
+
+
+def result_key(case: str, scale: int) -> str:
+    return f"{case}@{scale}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class BenchmarkRunner:
+    """Runs the registered cases against a freshly loaded dataset for every scale."""
+
+    def __init__(self, scales: Iterable[int], cases: Iterable[str] = None, repeat: int = 5, seed: int = 0,
+                 sessions_per_device: int = 1000, weather_days: int = 30, log: Callable[[str], None] = print):
+        self.scales = list(scales)
+        self.cases = list(cases or CASES)
+        self.repeat = repeat
+        self.seed = seed
+        self.sessions_per_device = sessions_per_device
+        self.weather_days = weather_days
+        self.log = log
+
+    def metadata(self) -> Dict:
+        return {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "machine": platform.machine(),
+            "seed": self.seed,
+            "sessions_per_device": self.sessions_per_device,
+            "weather_days": self.weather_days,
+            "repeat": self.repeat,
+        }
+
+    def run_scale(self, scale: int) -> Dict[str, Dict]:
+        call_command("flush", interactive=False, verbosity=0)
+        dataset = BenchmarkDataset(SyntheticDataGenerator(seed=self.seed), scale, self.sessions_per_device,
+                                   weather_days=self.weather_days)
+        results = {}
+        for phase, seconds in dataset.load().items():
+            results[result_key(f"load_{phase}", scale)] = {"case": f"load_{phase}", "scale": scale, "median_s": seconds,
+                                                           "min_s": seconds, "max_s": seconds, "repeat": 1}
+            self.log(f"  load {phase:<16} {seconds:10.4f} s")
+        for case in self.cases:
+            func = CASES[case](dataset)
+            timing = measure(func, repeat=self.repeat)
+            throughput = ""
+            if getattr(func, "items", None) and timing["median_s"]:
+                timing["items_per_s"] = func.items / timing["median_s"]
+                throughput = f", {timing['items_per_s']:.0f} items/s"
+            results[result_key(case, scale)] = {"case": case, "scale": scale, **timing}
+            self.log(f"  {case:<21} {timing['median_s']:10.4f} s (min {timing['min_s']:.4f}, max {timing['max_s']:.4f}{throughput})")
+        return results
+
+    def run(self) -> Dict:
+        results = {}
+        for scale in self.scales:
+            self.log(f"scale {scale} raports")
+            results.update(self.run_scale(scale))
+        return {"meta": self.metadata(), "results": results}
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.25, min_delta: float = 0.001) -> List[Dict]:
+    """Return the results that got slower than the baseline by more than `threshold` (relative).
+
+    Differences below `min_delta` seconds are treated as noise. Only keys present in both runs are compared.
+    """
+    regressions = []
+    for key, result in current["results"].items():
+        reference = baseline["results"].get(key)
+        if not reference:
+            continue
+        delta = result["median_s"] - reference["median_s"]
+        if delta > min_delta and result["median_s"] > reference["median_s"] * (1 + threshold):
+            regressions.append({
+                "key": key,
+                "baseline_s": reference["median_s"],
+                "current_s": result["median_s"],
+                "ratio": result["median_s"] / reference["median_s"] if reference["median_s"] else float("inf"),
+            })
+    return regressions
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from synthetic import SyntheticDataGenerator
+
+from .runner import compare
+
+
+class TestBenchmarks:
+
+    def test_generator_is_deterministic(self):
+        first = SyntheticDataGenerator(seed=3)
+        second = SyntheticDataGenerator(seed=3)
+        device = next(first.devices(0))
+        assert list(first.sessions(0, device, 50)) == list(second.sessions(0, device, 50))
+        assert list(first.weather(datetime(2022, 1, 2))) == list(second.weather(datetime(2022, 1, 2)))
+        assert list(first.sessions(0, device, 50)) != list(SyntheticDataGenerator(seed=4).sessions(0, device, 50))
+
+    def test_generated_sessions_do_not_overlap(self):
+        generator = SyntheticDataGenerator()
+        for device in generator.devices(0):
+            if device["type"] != "EnergyReceiver":
+                continue
+            sessions = list(generator.sessions(0, device, 200))
+            for (_, turned_off), (next_turned_on, _) in zip(sessions, sessions[1:]):
+                assert turned_off < next_turned_on
+
+    def test_compare_reports_only_slowdowns_above_threshold(self):
+        baseline = {"results": {
+            "a@1000": {"median_s": 0.100},
+            "b@1000": {"median_s": 0.100},
+            "c@1000": {"median_s": 0.0001},
+        }}
+        current = {"results": {
+            "a@1000": {"median_s": 0.120},
+            "b@1000": {"median_s": 0.200},
+            "c@1000": {"median_s": 0.0005},
+            "d@1000": {"median_s": 1.0},
+        }}
+        regressions = compare(current, baseline, threshold=0.25)
+        assert [regression["key"] for regression in regressions] == ["b@1000"]
+        assert regressions[0]["ratio"] == 2.0
@@ -0,0 +1,134 @@
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+REPLICA_DB_ALIAS = "replica"
+PIN_COOKIE = "primary_pin"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# streaming replication replay delay; a standby having replayed all it received is not behind
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_read_alias: ContextVar[Optional[str]] = ContextVar("read_alias", default=None)
+
+
+class ReplicaRouter:
+    """Sends the reads of views decorated with `read_from_replica` to the `replica` database.
+
+    Everything else (writes, migrations, reads of other views and reads inside a
+    transaction on the primary) stays on `default`.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB_ALIAS
+
+
+class ReplicaHealth:
+    """Replication lag of the replica, queried at most every `REPLICA_LAG_CHECK_SECONDS`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._healthy = False
+
+    @staticmethod
+    def lag() -> Optional[float]:
+        """Seconds the replica is behind the primary, None when it cannot be reached."""
+        connection = connections[REPLICA_DB_ALIAS]
+        if connection.vendor != "postgresql":
+            return 0.0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+        return 0.0 if lag is None else float(lag)
+
+    def is_healthy(self) -> bool:
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= settings.REPLICA_LAG_CHECK_SECONDS:
+                lag = self.lag()
+                self._healthy = lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+                self._checked_at = now
+            return self._healthy
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+
+
+replica_health = ReplicaHealth()
+
+
+def is_pinned_to_primary(request) -> bool:
+    return PIN_COOKIE in request.COOKIES
+
+
+def _streamed_from(alias: str, content):
+    # streamed exports run their queries after the view returned, possibly in another context
+    previous = _read_alias.get()
+    _read_alias.set(alias)
+    try:
+        yield from content
+    finally:
+        _read_alias.set(previous)
+
+
+def read_from_replica(handler):
+    """Decorate a read-only view handler to run its queries on the replica.
+
+    The primary is used instead when the replica is missing or lagging more than
+    `REPLICA_MAX_LAG_SECONDS`, or when the client wrote recently (see `PrimaryPinningMiddleware`).
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        if is_pinned_to_primary(request) or not replica_health.is_healthy():
+            return handler(self, request, *args, **kwargs)
+        token = _read_alias.set(REPLICA_DB_ALIAS)
+        try:
+            response = handler(self, request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+        if getattr(response, "streaming", False):
+            response.streaming_content = _streamed_from(REPLICA_DB_ALIAS, response.streaming_content)
+        return response
+    return wrapper
+
+
+class PrimaryPinningMiddleware:
+    """Read-your-writes: after a successful write the client reads from the primary for `REPLICA_PIN_SECONDS`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and REPLICA_DB_ALIAS in settings.DATABASES:
+            response.set_cookie(PIN_COOKIE, "1", max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite="Lax")
+        return response
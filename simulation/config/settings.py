@@ -65,6 +65,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    "config.db_router.PrimaryPinningMiddleware",
+    "smarthome.clock.VirtualTimeMiddleware",
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,9 +87,28 @@ DATABASES = {
         "PASSWORD": env("POSTGRES_PASSWORD"),
         "HOST": env("POSTGRES_HOST"),
         "PORT": env("POSTGRES_PORT"),
+        # keep connections open between requests (per worker thread) instead of reconnecting every time
+        "CONN_MAX_AGE": env.int("CONN_MAX_AGE", default=60),
     }
 }
 
+# read-only analytics views (energy, raports, exports) read from this streaming replica when it is set,
+# see config.db_router
+if env("POSTGRES_REPLICA_HOST", default=""):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": env("POSTGRES_REPLICA_HOST"),
+        "PORT": env("POSTGRES_REPLICA_PORT", default=env("POSTGRES_PORT")),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["config.db_router.ReplicaRouter"]
+# the primary is used while the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS = env.float("REPLICA_MAX_LAG_SECONDS", default=5.0)
+REPLICA_LAG_CHECK_SECONDS = env.float("REPLICA_LAG_CHECK_SECONDS", default=1.0)
+# clients read from the primary for this long after a write of theirs
+REPLICA_PIN_SECONDS = env.int("REPLICA_PIN_SECONDS", default=15)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -157,7 +178,7 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'smarthome.pagination.KeysetPagination',
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.FormParser',
@@ -188,15 +209,38 @@ AUTHENTICATION_BACKENDS = (
     "django.contrib.auth.backends.ModelBackend",
 )
 
-ELASTICSEARCH_DSL = {
-    'default': {
-        'hosts': 'sim-elasticsearch:{}'.format(env("ELASTIC_PORT"))
-    },
+# "elasticsearch" or "memory" (in-process interval trees, no Elasticsearch needed)
+SEARCH_BACKEND = env("SEARCH_BACKEND", default="elasticsearch")
+
+ELASTICSEARCH_DSL_AUTOSYNC = SEARCH_BACKEND == "elasticsearch"
+
+# raports live in monthly Elasticsearch indices by start; closed raports longer than this go to the "-long" index
+SEARCH_INDEX_LOOKBACK_DAYS = env.int("SEARCH_INDEX_LOOKBACK_DAYS", default=31)
+# windows covering more monthly indices than this search the whole alias
+SEARCH_INDEX_MAX_MONTHS = env.int("SEARCH_INDEX_MAX_MONTHS", default=24)
+
+# off-to-on gaps shorter than this (per device type) are merged into one session, see `compact_raports`; 0 is off
+DEVICE_DEBOUNCE_SECONDS = {
+    "EnergyReceiver": env.float("RECEIVER_DEBOUNCE_SECONDS", default=0.0),
+    "EnergyGenerator": env.float("GENERATOR_DEBOUNCE_SECONDS", default=0.0),
+    "EnergyStorage": env.float("STORAGE_DEBOUNCE_SECONDS", default=0.0),
 }
 
+# hourly energy market prices used by the building cost endpoint, see file_readers.PricesFileReader
+ENERGY_MARKET_FILE = env("ENERGY_MARKET_FILE", default=str(BASE_DIR.parent / "data_json" / "energy_market.json"))
+
+# energy windows ending this long ago are answered with ETags and cached for CLOSED_WINDOW_MAX_AGE seconds
+CLOSED_WINDOW_MARGIN_SECONDS = env.int("CLOSED_WINDOW_MARGIN_SECONDS", default=3600)
+CLOSED_WINDOW_MAX_AGE = env.int("CLOSED_WINDOW_MAX_AGE", default=86400)
+
+# honour the X-Virtual-Time header of requests (replays of recorded scenarios), see smarthome.clock
+VIRTUAL_TIME_ENABLED = env.bool("VIRTUAL_TIME_ENABLED", default=False)
+
 ELASTICSEARCH_CONNECTION_DEFAULTS = {
-    'hosts': ['localhost'],
+    'hosts': ['sim-elasticsearch:{}'.format(env("ELASTIC_PORT"))],
     'timeout': 5,
+    # urllib3 keeps up to this many keep-alive connections per node for the threads of the process
+    'maxsize': env.int("ELASTIC_POOL_SIZE", default=10),
 }
 
 ELASTICSEARCH_CONNECTION = os.environ.get(
@@ -210,3 +254,8 @@ if isinstance(ELASTICSEARCH_CONNECTION, str):
     except:
         ELASTICSEARCH_CONNECTION = ELASTICSEARCH_CONNECTION_DEFAULTS
 
+# the client is only created on first use, so commands and tests start without Elasticsearch
+ELASTICSEARCH_DSL = {
+    'default': ELASTICSEARCH_CONNECTION,
+}
+
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def reset_search_backend():
+    """Test transactions are rolled back without signals, so a process-local index must not outlive a test."""
+    from smarthome.search_backends import get_search_backend
+
+    get_search_backend().reset()
+    yield
+    get_search_backend().reset()
@@ -1,2 +1,4 @@
 from .prices_file_reader import PricesFileReader
 from .json_file_reader import JsonFileReader
+from .json_stream_reader import JsonStreamReader
+from .raports_file_reader import RaportsFileReader
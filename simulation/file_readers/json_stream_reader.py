@@ -0,0 +1,137 @@
+import json
+from typing import Any, Iterator
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+
+
+class JsonStreamReader:
+    """Pull parser reading a JSON file in chunks, so only the value being read is kept in memory.
+
+    Containers are walked with `iter_object` (yields keys) and `iter_array` (yields indexes);
+    the caller reads each member with `read_value` or walks into it. Members the caller does
+    not read are skipped.
+
+        with JsonStreamReader("raports.json") as reader:
+            for key in reader.iter_object():
+                if key == "devices":
+                    for device in reader.items():
+                        ...
+    """
+    DATA_FILENAME = None
+
+    def __init__(self, filename, chunk_size: int = 1 << 16):
+        self.DATA_FILENAME = filename
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._file = None
+        self._buffer = ""
+        self._position = 0
+        self._discarded = 0
+        self._eof = False
+
+    def __enter__(self):
+        self._file = open(self.DATA_FILENAME, "r", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    @property
+    def offset(self) -> int:
+        """Number of characters consumed from the start of the file."""
+        return self._discarded + self._position
+
+    def _fill(self, size: int = None) -> bool:
+        if self._eof:
+            return False
+        chunk = self._file.read(size or self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._discarded += self._position
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def _peek(self) -> str:
+        """Next non-whitespace character without consuming it, "" at the end of the file."""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                return ""
+
+    def _error(self, message: str):
+        return json.JSONDecodeError(f"{message} (character {self.offset})", self._buffer, self._position)
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise self._error(f"Expecting '{char}'")
+        self._position += 1
+
+    def read_value(self) -> Any:
+        """Decode the next complete value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                # the value may continue in the next chunk; grow the read with the buffer to stay linear
+                if self._fill(max(self.chunk_size, len(self._buffer))):
+                    continue
+                raise
+            if not self._buffer[end:].strip(NUMBER_CHARS) and self._fill():
+                continue  # a number cut at the end of the chunk, e.g. "12." of "12.5"
+            self._position = end
+            return value
+
+    def _next_member(self, start: int, closing: str) -> bool:
+        """Skip the member value if the caller did not read it; False after the closing bracket."""
+        if self.offset == start:
+            self.read_value()
+        separator = self._peek()
+        if separator == closing:
+            self._position += 1
+            return False
+        if separator != ",":
+            raise self._error(f"Expecting ',' or '{closing}'")
+        self._position += 1
+        return True
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the next object; read or walk the member value before advancing."""
+        self._expect("{")
+        if self._peek() == "}":
+            self._position += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise self._error("Expecting property name")
+            self._expect(":")
+            start = self.offset
+            yield key
+            if not self._next_member(start, "}"):
+                return
+
+    def iter_array(self) -> Iterator[int]:
+        """Yield the indexes of the next array; read or walk each item before advancing."""
+        self._expect("[")
+        if self._peek() == "]":
+            self._position += 1
+            return
+        index = 0
+        while True:
+            start = self.offset
+            yield index
+            if not self._next_member(start, "]"):
+                return
+            index += 1
+
+    def items(self) -> Iterator[Any]:
+        """Decoded items of the next array, one at a time."""
+        for _ in self.iter_array():
+            yield self.read_value()
@@ -1,4 +1,20 @@
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+
 from .json_file_reader import JsonFileReader
 
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
 class PricesFileReader(JsonFileReader):
+    """Energy market prices: {"currency", "prices": [{"datetime_from", "price", "feed_in_price"}, ...]}.
+
+    Prices are per kWh and last until the `datetime_from` of the next entry (the last one for an hour).
+    `feed_in_price`, paid for energy sold to the grid, defaults to `price`.
+    """
     DATA_FILENAME = "energy_market.json"
+
+    def iter_prices(self) -> Iterator[Tuple[datetime, float, Optional[float]]]:
+        for entry in self.read_file().get("prices", []):
+            yield (datetime.strptime(entry["datetime_from"], DATETIME_FORMAT),
+                   float(entry["price"]), entry.get("feed_in_price"))
@@ -0,0 +1,31 @@
+from typing import Dict, Iterator, Tuple
+
+from .json_stream_reader import JsonStreamReader
+
+
+class RaportsFileReader(JsonStreamReader):
+    """Streams a scenario raports file: {"user_email", "building_name", "devices": [{"device_name", "raports": [...]}]}.
+
+    Top level fields preceding "devices" are collected in `header` before the first raport is yielded.
+    """
+
+    def __init__(self, filename, chunk_size: int = 1 << 16):
+        super().__init__(filename, chunk_size)
+        self.header: Dict = {}
+
+    def iter_raports(self) -> Iterator[Tuple[str, Dict]]:
+        """Yield (device name, raport) pairs in file order."""
+        for key in self.iter_object():
+            if key != "devices":
+                self.header[key] = self.read_value()
+                continue
+            for _ in self.iter_array():
+                device_name = None
+                for device_key in self.iter_object():
+                    if device_key == "device_name":
+                        device_name = self.read_value()
+                    elif device_key == "raports":
+                        if device_name is None:
+                            raise ValueError(f"{self.DATA_FILENAME}: device_name must precede raports (character {self.offset})")
+                        for raport in self.items():
+                            yield device_name, raport
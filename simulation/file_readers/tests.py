@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from .json_stream_reader import JsonStreamReader
+from .raports_file_reader import RaportsFileReader
+
+
+def walk(reader: JsonStreamReader):
+    if reader._peek() == "{":
+        return {key: walk(reader) for key in reader.iter_object()}
+    if reader._peek() == "[":
+        return [walk(reader) for _ in reader.iter_array()]
+    return reader.read_value()
+
+
+class TestJsonStreamReader:
+
+    @pytest.mark.parametrize("chunk_size", [1, 3, 64])
+    def test_documents_are_rebuilt_across_chunk_boundaries(self, tmp_path, chunk_size):
+        document = {"a": [1, 12.5, -3e-7, "x\"é", {}, [], {"b": [True, False, None]}], "c": {"d": 123456789}, "e": []}
+        path = tmp_path / "document.json"
+        path.write_text(json.dumps(document, indent=2))
+        with JsonStreamReader(path, chunk_size=chunk_size) as reader:
+            assert walk(reader) == document
+
+    def test_unread_members_are_skipped(self, tmp_path):
+        path = tmp_path / "document.json"
+        path.write_text(json.dumps({"skip": {"nested": [1, 2, 3]}, "items": [{"id": 1}, {"id": 2}], "tail": 1}))
+        with JsonStreamReader(path, chunk_size=4) as reader:
+            read = {key: list(reader.items()) for key in reader.iter_object() if key == "items"}
+        assert read == {"items": [{"id": 1}, {"id": 2}]}
+
+
+class TestRaportsFileReader:
+
+    def test_raports_are_yielded_with_device_names(self, tmp_path):
+        path = tmp_path / "raports.json"
+        path.write_text(json.dumps({
+            "user_email": "user@email.com",
+            "building_name": "house",
+            "devices": [
+                {"device_name": "bulb", "raports": [{"turned_on": "2022-03-30 08:00:00", "turned_off": "2022-03-30 09:00:00"}]},
+                {"device_name": "fridge", "raports": [{"turned_on": "2022-03-30 08:00:00"}, {"turned_on": "2022-03-30 10:00:00"}]},
+            ],
+        }))
+        reader = RaportsFileReader(path, chunk_size=16)
+        with reader:
+            raports = list(reader.iter_raports())
+        assert reader.header == {"user_email": "user@email.com", "building_name": "house"}
+        assert [name for name, _ in raports] == ["bulb", "fridge", "fridge"]
+        assert raports[2][1] == {"turned_on": "2022-03-30 10:00:00"}
@@ -1,5 +1,7 @@
 import argparse
+import json
 import os
+import time
 from datetime import datetime, timedelta
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -7,9 +9,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 import django
 django.setup()
 
-from file_readers import JsonFileReader
+from file_readers import JsonStreamReader, RaportsFileReader
+from smarthome.caching import bump_data_version
 from smarthome.models import Building, Device, DeviceRaport, WeatherRaport
-from smarthome.serializers import DeviceRaportListSerializer, WeatherRaportListSerializer
+from smarthome.scenario import bulk_create_stream, create_from_manifest
+from synthetic.scenario import MANIFEST_FILENAME
 from users.models import User
 
 
@@ -17,53 +21,86 @@ from users.models import User
 class DBPopulater:
     _raports_filenames = ["data_json/first_scenario_raports.json"]
     _weather_filename = ["data_json/weather.json"]
-    
-    def populate_weather_from_file(self):
-        generated_raports = []
 
-        for file in self._weather_filename:
-            weather_data = JsonFileReader(file).read_file()
-            for date, data in weather_data.items():
+    def __init__(self, batch_size=5000, log=print):
+        self.batch_size = batch_size
+        self.log = log
+
+    def _write_batches(self, model, objects, label):
+        """bulk_create `objects` in batches of `batch_size` as they are generated, logging progress."""
+        started = time.perf_counter()
+        written = bulk_create_stream(model, objects, self.batch_size, lambda written: self.log(
+            f"{label}: {written} written ({written / (time.perf_counter() - started):.0f}/s)"))
+        self.log(f"{label}: {written} written in {time.perf_counter() - started:.1f} s")
+        return written
+
+    def _weather_raports(self, file):
+        with JsonStreamReader(file) as reader:
+            for date in reader.iter_object():
+                data = reader.read_value()
                 start_date = datetime.strptime(date,"%Y-%m-%d %H:%M:%S")
                 end_date = start_date+timedelta(minutes=4,seconds=59,microseconds=59)
-                solar_radiation = data.get("real", {}).get("solar_radiation")
-                generated_raports.append(WeatherRaport(datetime_from=date, datetime_to=end_date, solar_radiation=solar_radiation))
-            
-        weather_raports = WeatherRaport.objects.bulk_create(generated_raports, ignore_conflicts=True)
-        serializer = WeatherRaportListSerializer(instance={"raports":weather_raports})
-        return serializer.data
+                real = data.get("real", {})
+                yield WeatherRaport(datetime_from=date, datetime_to=end_date, solar_radiation=real.get("solar_radiation"),
+                                    temperature=real.get("temperature"), wind_speed=real.get("wind_speed"))
+
+    def populate_weather_from_file(self):
+        written = 0
+        for file in self._weather_filename:
+            written += self._write_batches(WeatherRaport, self._weather_raports(file), file)
+        bump_data_version()
+        return {"weather_raports": written}
+
+    def _device_raports(self, file, buildings):
+        reader = RaportsFileReader(file)
+        devices = None
+        with reader:
+            for device_name, raport_data in reader.iter_raports():
+                if devices is None:
+                    # the header precedes the devices, resolve all of them with one query
+                    user = User.objects.get(email=reader.header.get("user_email"))
+                    building = Building.objects.get(name=reader.header.get("building_name"), user=user)
+                    buildings.add(building.id)
+                    devices = dict(Device.objects.filter(building=building).values_list("name", "id"))
+                if device_name not in devices:
+                    raise Device.DoesNotExist(f"{file}: no device named {device_name!r} in the building")
+                if not raport_data.get("turned_off"):
+                    raport_data.pop("turned_off", None)
+                yield DeviceRaport(device_id=devices[device_name], **raport_data)
 
     def populate_raports_from_file(self):
-        generated_raports = []
+        written, buildings = 0, set()
         for file in self._raports_filenames:
-            raports_data = JsonFileReader(file).read_file()
-            user = User.objects.get(email=raports_data.get("user_email"))
-            building = Building.objects.get(name=raports_data.get("building_name"), user=user)
-
-            devices_raports = raports_data.get("devices")
-            for device_data in devices_raports:
-                device_name = device_data.get("device_name")
-                device = Device.objects.get(name=device_name, building=building)
-                for raport_data in device_data.get("raports"):
-                    if not raport_data.get("turned_off"):
-                        raport_data.pop("turned_off")
-                    generated_raports.append(DeviceRaport(device=device, **raport_data))
-
-        devices = DeviceRaport.objects.bulk_create(generated_raports, ignore_conflicts=True)
-        serializer = DeviceRaportListSerializer(instance={"raports":devices})
-        return serializer.data
+            written += self._write_batches(DeviceRaport, self._device_raports(file, buildings), file)
+        bump_data_version(buildings)
+        return {"device_raports": written}
+
+    def populate_scenario(self, directory):
+        """Create what a generate_scenario manifest adds (users, buildings, devices) and read its files from then on."""
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as file:
+            manifest = json.load(file)
+        buildings = create_from_manifest(manifest["users"])
+        self._raports_filenames = [os.path.join(directory, building["raports_file"])
+                                   for user in manifest["users"] for building in user["buildings"]]
+        self._weather_filename = [os.path.join(directory, manifest["weather_file"])]
+        return {"buildings": len(buildings)}
 
 def get_parser_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--raports", action="store_true", default=False)
     parser.add_argument("--weather", action="store_true", default=False)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--scenario-dir", help="output of manage.py generate_scenario instead of data_json")
     return parser.parse_args()
     
 def main():
-    db_populater = DBPopulater()
-
     args = get_parser_args()
+    db_populater = DBPopulater(batch_size=args.batch_size)
+
     print(args)
+    if args.scenario_dir:
+        print("---scenario---")
+        print(db_populater.populate_scenario(args.scenario_dir))
     if args.raports:
         print("---raports---")
         print(db_populater.populate_raports_from_file())
@@ -0,0 +1,79 @@
+# NumPy helpers without Django imports: worker processes load them without settings
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+CLAMP_BLOCK_SIZE = 4096
+
+
+def clamped_cumsum(deltas: np.ndarray, initial: float, upper: float, block_size: int = CLAMP_BLOCK_SIZE) -> np.ndarray:
+    """Running sum of `deltas` from `initial` kept within [0, upper] after every step.
+
+    Each block is summed with one cumsum and summed again from the first step leaving the range.
+    A clamped level stays pinned until a step of the opposite sign, which is skipped over at
+    once, so a battery held full or empty for hours costs no more than one moving through.
+    """
+    levels = np.empty(len(deltas))
+    level, position = min(max(initial, 0.0), upper), 0
+    while position < len(deltas):
+        block = deltas[position:position + block_size]
+        sums = level + np.cumsum(block)
+        outside = np.flatnonzero((sums < 0) | (sums > upper))
+        if not len(outside):
+            levels[position:position + len(block)] = sums
+            level, position = sums[-1], position + len(block)
+            continue
+        first = outside[0]
+        levels[position:position + first] = sums[:first]
+        level = 0.0 if sums[first] < 0 else upper
+        position += first
+        following = deltas[position + 1:position + 1 + block_size]
+        leaving = np.flatnonzero(following > 0 if level == 0.0 else following < 0)
+        pinned = 1 + (leaving[0] if len(leaving) else len(following))
+        levels[position:position + pinned] = level
+        position += pinned
+    return levels
+
+
+class SharedArrays:
+    """Arrays copied once into one shared memory block, to be mapped (not copied) by other processes.
+
+    The creating process owns the block and must `close(unlink=True)` it; other processes
+    `attach(spec)` and keep the returned object alive while they use the arrays.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, layout: List[Tuple[str, str, Tuple[int, ...], int]]):
+        self.memory = memory
+        self.layout = layout
+        self.arrays: Dict[str, np.ndarray] = {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf, offset=offset)
+            for name, dtype, shape, offset in layout
+        }
+
+    @classmethod
+    def create(cls, arrays: Dict[str, np.ndarray]) -> "SharedArrays":
+        layout, offset = [], 0
+        for name, array in arrays.items():
+            layout.append((name, array.dtype.str, array.shape, offset))
+            # keep every array aligned to 64 bytes
+            offset += -(-array.nbytes // 64) * 64
+        shared = cls(shared_memory.SharedMemory(create=True, size=max(offset, 1)), layout)
+        for name, array in arrays.items():
+            shared.arrays[name][...] = array
+        return shared
+
+    @property
+    def spec(self) -> Tuple[str, List]:
+        return self.memory.name, self.layout
+
+    @classmethod
+    def attach(cls, spec: Tuple[str, List]) -> "SharedArrays":
+        name, layout = spec
+        return cls(shared_memory.SharedMemory(name=name), layout)
+
+    def close(self, unlink: bool = False):
+        self.arrays = {}
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
@@ -0,0 +1,140 @@
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from django.forms.models import model_to_dict
+
+from . import clock
+from .costs import (HOUR, Intervals, from_seconds, photovoltaic_factors,
+                    to_seconds)
+from .models import (Building, EnergyGenerator, EnergyReceiver, EnergyStorage,
+                     StorageChargingAndUsageRaport)
+from .models_calculators import EnergyCalculator, EnergyGeneratorCalculator
+from .search_backends import get_search_backend
+
+
+class Timeline(NamedTuple):
+    """Piecewise constant load and local supply: segment i lasts from times[i] to times[i + 1] (seconds)."""
+    times: np.ndarray
+    load_kw: np.ndarray
+    supply_kw: np.ndarray
+
+    @property
+    def hours(self) -> np.ndarray:
+        return np.diff(self.times) / HOUR
+
+    @property
+    def net_kw(self) -> np.ndarray:
+        return self.load_kw - self.supply_kw
+
+
+IntervalArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]  # starts, ends (seconds), power (kW)
+
+
+def _concatenate(parts: List[IntervalArrays]) -> IntervalArrays:
+    return tuple(np.concatenate([part[column] for part in parts] or [np.empty(0)]) for column in range(3))
+
+
+def sweep(load: List[IntervalArrays], supply: List[IntervalArrays], start: float, end: float) -> Timeline:
+    """Merge the edges of all load and supply intervals (within [start, end]) into one timeline.
+
+    Every interval adds +P at its start and -P at its end; after one sort of all edges the
+    running sums give both levels. Only the sum after the last edge at each distinct time is
+    used, so the order of equal times does not matter and an unstable sort is enough.
+    """
+    load_starts, load_ends, load_power = _concatenate(load)
+    supply_starts, supply_ends, supply_power = _concatenate(supply)
+    times = np.concatenate((load_starts, load_ends, supply_starts, supply_ends, [start, end]))
+    load_zeros, supply_zeros = np.zeros(2 * len(load_power)), np.zeros(2 * len(supply_power))
+    load_steps = np.concatenate((load_power, -load_power, supply_zeros, [0.0, 0.0]))
+    supply_steps = np.concatenate((load_zeros, supply_power, -supply_power, [0.0, 0.0]))
+
+    order = np.argsort(times)
+    times = times[order]
+    last = np.append(np.flatnonzero(np.diff(times)), len(times) - 1)
+    # running sums of +P/-P may leave rounding residue instead of exact zeros
+    load_kw = np.maximum(np.cumsum(load_steps[order])[last][:-1], 0.0)
+    supply_kw = np.maximum(np.cumsum(supply_steps[order])[last][:-1], 0.0)
+    return Timeline(times[last], load_kw, supply_kw)
+
+
+def ratio(numerator: float, denominator: float) -> Optional[float]:
+    return numerator / denominator if denominator else None
+
+
+class BuildingBalanceCalculator:
+    """Energy balance of a building against the grid from all its devices at once.
+
+    Load is the receivers plus storages charging, local supply is the PV output (recorded
+    weather) plus storages discharging. Storage jobs draw or give `energy_use` evenly over the
+    job; jobs and sessions still running last until the end of the window.
+    """
+
+    def __init__(self):
+        self.generator_calculator = EnergyGeneratorCalculator()
+
+    @staticmethod
+    def add_storage_jobs(storage: EnergyStorage, charging: Intervals, discharging: Intervals,
+                         start_date: datetime, end_date: datetime):
+        for raport in get_search_backend().storage_raports(storage, start_date, end_date):
+            job_end = raport.date_time_to or end_date
+            hours = (job_end - raport.date_time_from).total_seconds() / HOUR
+            clipped_start, clipped_end = max(raport.date_time_from, start_date), min(job_end, end_date)
+            if hours <= 0 or clipped_end <= clipped_start:
+                continue
+            target = charging if raport.job_type == StorageChargingAndUsageRaport.CHARGING else discharging
+            target.add(clipped_start, clipped_end, raport.energy_use / hours, storage.id)
+
+    def timeline(self, building: Building, start_date: datetime, end_date: datetime) -> Tuple[Timeline, Dict[str, float]]:
+        """Timeline of the building and the energy (kWh) of consumption, generation and storage jobs."""
+        devices = list(building.building_devices.all())
+        receivers, generation, charging, discharging = Intervals(), Intervals(), Intervals(), Intervals()
+        for device in devices:
+            if isinstance(device, EnergyReceiver):
+                for raport in EnergyCalculator.filter_raports_by_device_and_date(device, start_date, end_date):
+                    receivers.add(raport.turned_on, raport.turned_off, device.device_power / 1000, device.id)
+            elif isinstance(device, EnergyStorage):
+                self.add_storage_jobs(device, charging, discharging, start_date, end_date)
+
+        generation_power = sum(device.generation_power for device in devices if isinstance(device, EnergyGenerator))
+        if generation_power:
+            for raport in self.generator_calculator._filter_weather_raports_by_date(start_date, end_date):
+                generation.add(raport.datetime_from, raport.datetime_to, raport.solar_radiation, 0)
+        weather_starts, weather_ends, radiation, _ = generation.arrays()
+
+        parts = {
+            "consumption": receivers.arrays()[:3],
+            "storage_charging": charging.arrays()[:3],
+            "generation": (weather_starts, weather_ends, photovoltaic_factors(radiation) * generation_power),
+            "storage_discharging": discharging.arrays()[:3],
+        }
+        energies = {name: float((power * (ends - starts)).sum() / HOUR) for name, (starts, ends, power) in parts.items()}
+        bounds = to_seconds([start_date, end_date])
+        timeline = sweep([parts["consumption"], parts["storage_charging"]],
+                         [parts["generation"], parts["storage_discharging"]], bounds[0], bounds[1])
+        return timeline, energies
+
+    def calculate(self, building: Building, start_date: datetime, end_date: datetime = None) -> Dict:
+        end_date = end_date or clock.now()
+        timeline, energies = self.timeline(building, start_date, end_date)
+        hours, net = timeline.hours, timeline.net_kw
+        load = float((timeline.load_kw * hours).sum())
+        supply = float((timeline.supply_kw * hours).sum())
+        covered_locally = float((np.minimum(timeline.load_kw, timeline.supply_kw) * hours).sum())
+
+        # the curve keeps only the points where the net power changes
+        changes = np.append(0, np.flatnonzero(np.diff(net)) + 1) if len(net) else np.empty(0, dtype=int)
+        return {
+            **model_to_dict(building),
+            **energies,
+            "load": load,
+            "local_supply": supply,
+            "import": float((np.maximum(net, 0.0) * hours).sum()),
+            "export": float((np.maximum(-net, 0.0) * hours).sum()),
+            "self_consumption": ratio(covered_locally, supply),
+            "autarky": ratio(covered_locally, load),
+            "net_power": {
+                "dates": [from_seconds(time) for time in timeline.times[changes]],
+                "power_kw": net[changes].tolist(),
+            },
+        }
@@ -0,0 +1,72 @@
+import contextlib
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.http import JsonResponse
+
+VIRTUAL_TIME_HEADER = "X-Virtual-Time"
+
+
+class Clock:
+    """The wall clock; models, views and calculators ask `clock.now()` instead of `datetime.now()`."""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+
+class FixedClock(Clock):
+    """A clock standing still at `moment`, e.g. the recorded time of a replayed request."""
+
+    def __init__(self, moment: datetime):
+        self.moment = moment
+
+    def now(self) -> datetime:
+        return self.moment
+
+
+_default_clock = Clock()
+_clock: ContextVar[Optional[Clock]] = ContextVar("clock", default=None)
+
+
+def now() -> datetime:
+    return (_clock.get() or _default_clock).now()
+
+
+def set_clock(clock: Optional[Clock]):
+    """Replace the process-wide clock (the wall clock again with None)."""
+    global _default_clock
+    _default_clock = clock or Clock()
+
+
+@contextlib.contextmanager
+def use_clock(clock: Clock) -> Iterator[Clock]:
+    """Run the block (of this thread or task only) at the time of `clock`."""
+    token = _clock.set(clock)
+    try:
+        yield clock
+    finally:
+        _clock.reset(token)
+
+
+class VirtualTimeMiddleware:
+    """Runs a request at the ISO time of its `X-Virtual-Time` header when `VIRTUAL_TIME_ENABLED` is set.
+
+    Replays send the recorded time of every toggle, so a scenario runs through the real views
+    as fast as they answer. Off by default: it lets clients choose the time of their writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        value = request.headers.get(VIRTUAL_TIME_HEADER)
+        if value is None or not settings.VIRTUAL_TIME_ENABLED:
+            return self.get_response(request)
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            return JsonResponse({VIRTUAL_TIME_HEADER: ["Expected an ISO 8601 date and time."]}, status=400)
+        with use_clock(FixedClock(moment.replace(tzinfo=None))):
+            return self.get_response(request)
@@ -0,0 +1,154 @@
+import csv
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from django.db import NotSupportedError, connection, models, transaction
+from django.db.models.expressions import RawSQL
+from file_readers import JsonStreamReader
+
+from .caching import bump_data_version
+from .models import ChargeStateRaport, Device, DeviceRaport, WeatherRaport
+from .search_backends import get_search_backend
+
+# model and the fields read from every record; foreign keys may be given as "device" or "device_id"
+LOADERS = {
+    "device": (DeviceRaport, ("device", "turned_on", "turned_off")),
+    "weather": (WeatherRaport, ("datetime_from", "datetime_to", "solar_radiation", "temperature", "wind_speed")),
+    "charge-state": (ChargeStateRaport, ("device", "date", "charge_value")),
+}
+FORMATS = ("csv", "ndjson", "json")
+
+
+def detect_format(path: str) -> str:
+    extension = os.path.splitext(str(path))[1].lstrip(".").lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {path}, pass one of {', '.join(FORMATS)}")
+    return extension
+
+
+def read_records(path: str, file_format: str) -> Iterator[Dict]:
+    """Records of a CSV (with header), NDJSON or JSON array file, read one at a time.
+
+    The CSV and NDJSON raport exports of the API can be loaded back as they are.
+    """
+    if file_format == "json":
+        with JsonStreamReader(path) as reader:
+            yield from reader.items()
+        return
+    with open(path, newline="", encoding="utf-8") as source:
+        if file_format == "csv":
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def record_rows(records: Iterable[Dict], fields: Sequence[models.Field]) -> Iterator[List]:
+    for record in records:
+        row = []
+        for field in fields:
+            value = record.get(field.name, record.get(field.attname))
+            row.append(None if value == "" else value)
+        yield row
+
+
+class CSVRowsFile:
+    """Read-only file rendering rows as CSV on demand, so COPY FROM STDIN streams without a temporary file."""
+
+    def __init__(self, rows: Iterable[Sequence]):
+        self._rows = iter(rows)
+        self._writer = csv.writer(self, lineterminator="\n")
+        self._chunks: List[str] = []
+        self._pending = ""
+        self.rows = 0
+
+    def write(self, text: str):
+        self._chunks.append(text)
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            # unquoted empty fields are NULL for COPY ... CSV
+            self._writer.writerow(["" if value is None else value for value in row])
+            self.rows += 1
+            if len(self._chunks) >= 1000:
+                self._pending += "".join(self._chunks)
+                self._chunks = []
+        self._pending += "".join(self._chunks)
+        self._chunks = []
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+
+class CopyLoader:
+    """Loads raports with COPY into a temporary staging table and merges the new rows into the model table.
+
+    Rows conflicting with the unique keys (device, turned_on) and (device, date) are skipped;
+    weather, which has no unique key, skips rows whose datetime_from is already stored.
+    The inserted ids are kept in a second temporary table and indexed in one search backend call.
+    """
+
+    def __init__(self, kind: str):
+        self.model, field_names = LOADERS[kind]
+        self.fields = [self.model._meta.get_field(name) for name in field_names]
+        self.table = self.model._meta.db_table
+        self.staging = f"{self.table}_staging"
+        self.inserted = f"{self.table}_inserted"
+
+    @property
+    def columns(self) -> str:
+        return ", ".join(connection.ops.quote_name(field.column) for field in self.fields)
+
+    def load(self, records: Iterable[Dict]) -> Dict[str, int]:
+        if connection.vendor != "postgresql":
+            raise NotSupportedError(f"Loading raports needs PostgreSQL (COPY FROM STDIN), not {connection.vendor}.")
+        rows = CSVRowsFile(record_rows(records, self.fields))
+        with transaction.atomic(), connection.cursor() as cursor:
+            column_types = ", ".join(
+                f"{connection.ops.quote_name(field.column)} {field.db_type(connection)}" for field in self.fields
+            )
+            cursor.execute(f"CREATE TEMPORARY TABLE {self.staging} ({column_types}) ON COMMIT DROP")
+            cursor.execute(f"CREATE TEMPORARY TABLE {self.inserted} (id bigint) ON COMMIT DROP")
+            cursor.copy_expert(f"COPY {self.staging} ({self.columns}) FROM STDIN WITH (FORMAT csv)", rows)
+            if self.model is WeatherRaport:
+                # the NOT EXISTS check below is only safe against concurrent weather loads with the table locked
+                cursor.execute(f"LOCK TABLE {connection.ops.quote_name(self.table)} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(self.merge_sql())
+            inserted = cursor.rowcount
+            new_rows = self.model.objects.filter(pk__in=RawSQL(f"SELECT id FROM {self.inserted}", []))
+            get_search_backend().index(new_rows)
+            self.bump_data_versions(new_rows)
+        return {"read": rows.rows, "inserted": inserted, "skipped": rows.rows - inserted}
+
+    def merge_sql(self) -> str:
+        table = connection.ops.quote_name(self.table)
+        if self.model is WeatherRaport:
+            # no unique key to conflict on: keep the first row of every datetime_from not stored yet
+            insert = (
+                f"INSERT INTO {table} ({self.columns}) "
+                f"SELECT DISTINCT ON (staged.datetime_from) {self.columns} FROM {self.staging} staged "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} stored WHERE stored.datetime_from = staged.datetime_from) "
+                f"ORDER BY staged.datetime_from RETURNING id"
+            )
+        else:
+            insert = f"INSERT INTO {table} ({self.columns}) SELECT {self.columns} FROM {self.staging} ON CONFLICT DO NOTHING RETURNING id"
+        return f"WITH new_rows AS ({insert}) INSERT INTO {self.inserted} SELECT id FROM new_rows"
+
+    def bump_data_versions(self, new_rows: models.QuerySet):
+        if self.model is WeatherRaport:
+            bump_data_version()
+        else:
+            bump_data_version(Device.objects.filter(pk__in=new_rows.values("device_id")).values("building_id"))
+
+
+def load_file(kind: str, path: str, file_format: Optional[str] = None) -> Dict[str, int]:
+    return CopyLoader(kind).load(read_records(path, file_format or detect_format(path)))
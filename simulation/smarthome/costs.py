@@ -0,0 +1,213 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.forms.models import model_to_dict
+from file_readers import PricesFileReader
+
+from . import clock
+from .models import Building, EnergyGenerator, EnergyReceiver
+from .models_calculators import EnergyCalculator, EnergyGeneratorCalculator
+
+HOUR = 3600.0
+EPOCH = datetime(1970, 1, 1)
+# windows of one cost request: a leap year of hourly windows
+MAX_COST_WINDOWS = 366 * 24
+
+
+def to_seconds(values: Sequence[datetime]) -> np.ndarray:
+    # much faster than numpy's own datetime conversion of a list of objects
+    return np.fromiter(((value - EPOCH).total_seconds() for value in values), dtype=float, count=len(values))
+
+
+def from_seconds(value: float) -> datetime:
+    return EPOCH + timedelta(seconds=float(value))
+
+
+class PriceSeries:
+    """Piecewise constant prices per kWh with their running integrals.
+
+    `integral(t)` is the price integrated (in price x hours) from the first price to `t`, so a
+    constant power P between a and b costs P * (integral(b) - integral(a)) for any number of
+    price changes in between. Time outside the priced range costs nothing.
+    """
+
+    def __init__(self, starts: np.ndarray, prices: np.ndarray, feed_in_prices: np.ndarray, currency: str = None):
+        if not len(starts):
+            raise ValueError("The price series is empty.")
+        order = np.argsort(starts, kind="stable")
+        self.starts = starts[order]
+        self.ends = np.append(self.starts[1:], self.starts[-1] + HOUR)
+        self.prices = {False: prices[order], True: feed_in_prices[order]}
+        self._integrals = {
+            feed_in: np.concatenate(([0.0], np.cumsum(values * (self.ends - self.starts) / HOUR)))
+            for feed_in, values in self.prices.items()
+        }
+        self.currency = currency
+
+    @classmethod
+    def from_file(cls, path) -> "PriceSeries":
+        reader = PricesFileReader(path)
+        rows = list(reader.iter_prices())
+        starts = to_seconds([start for start, _, _ in rows])
+        prices = np.array([price for _, price, _ in rows], dtype=float)
+        feed_in = np.array([price if feed_in is None else feed_in for _, price, feed_in in rows], dtype=float)
+        return cls(starts, prices, feed_in, reader.read_file().get("currency"))
+
+    def integral(self, times: np.ndarray, feed_in: bool = False) -> np.ndarray:
+        times = np.clip(times, self.starts[0], self.ends[-1])
+        index = np.clip(np.searchsorted(self.starts, times, side="right") - 1, 0, len(self.starts) - 1)
+        return self._integrals[feed_in][index] + self.prices[feed_in][index] * (times - self.starts[index]) / HOUR
+
+    def interval_values(self, starts: np.ndarray, ends: np.ndarray, power_kw: np.ndarray,
+                        feed_in: bool = False) -> np.ndarray:
+        """Price of the energy of every interval run at constant power."""
+        return power_kw * (self.integral(ends, feed_in) - self.integral(starts, feed_in))
+
+    def window_values(self, starts: np.ndarray, ends: np.ndarray, power_kw: np.ndarray,
+                      boundaries: np.ndarray, feed_in: bool = False) -> np.ndarray:
+        """Price of the summed power of all intervals in each window between consecutive `boundaries`."""
+        return window_integrals(starts, ends, power_kw, boundaries, lambda times: self.integral(times, feed_in))
+
+    def window_prices(self, boundaries: np.ndarray, feed_in: bool = False) -> np.ndarray:
+        """Mean price in each window between consecutive `boundaries`."""
+        return np.diff(self.integral(boundaries, feed_in)) / (np.diff(boundaries) / HOUR)
+
+
+def window_integrals(starts: np.ndarray, ends: np.ndarray, power_kw: np.ndarray, boundaries: np.ndarray,
+                     integral: Callable[[np.ndarray], np.ndarray] = None) -> np.ndarray:
+    """Integral of the summed power of all intervals in each window between consecutive `boundaries`.
+
+    Interval edges and boundaries are merged into one timeline on which the total power is a
+    cumulative sum of +P/-P steps; intervals must lie within the boundaries. The power is
+    integrated over `integral` (running price integral), by default over hours (energy in kWh).
+    """
+    times = np.unique(np.concatenate((starts, ends, boundaries)))
+    steps = np.zeros(len(times))
+    np.add.at(steps, np.searchsorted(times, starts), power_kw)
+    np.add.at(steps, np.searchsorted(times, ends), -power_kw)
+    weights = np.diff(times) / HOUR if integral is None else np.diff(integral(times))
+    cumulative = np.concatenate(([0.0], np.cumsum(np.cumsum(steps)[:-1] * weights)))
+    return np.diff(cumulative[np.searchsorted(times, boundaries)])
+
+
+_price_series: Dict[str, Tuple[int, PriceSeries]] = {}
+_price_series_lock = threading.Lock()
+
+
+def load_price_series(path=None) -> PriceSeries:
+    """Price series of the energy market file, parsed again only after the file changed."""
+    path = str(path or settings.ENERGY_MARKET_FILE)
+    mtime = os.stat(path).st_mtime_ns
+    with _price_series_lock:
+        cached = _price_series.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    series = PriceSeries.from_file(path)
+    with _price_series_lock:
+        _price_series[path] = (mtime, series)
+    return series
+
+
+def photovoltaic_factors(solar_radiation: np.ndarray) -> np.ndarray:
+    """kW made per W of generation power, EnergyGeneratorCalculator's formula on arrays."""
+    calculator = EnergyGeneratorCalculator
+    coefficient = ((solar_radiation - calculator.min_solar_radiation)
+                   / (calculator.max_solar_radiation - calculator.min_solar_radiation)
+                   * (calculator.new_max_range - calculator.new_min_range) + calculator.new_min_range)
+    return np.clip(coefficient, 0.0, 1.0) * (1 - calculator.weather_loss_factor) / 1000
+
+
+class Intervals:
+    """Intervals of constant power (kW) of several devices, as arrays."""
+
+    def __init__(self):
+        self._starts: List[datetime] = []
+        self._ends: List[datetime] = []
+        self._power: List[float] = []
+        self._owner: List[int] = []
+
+    def add(self, start: datetime, end: datetime, power_kw: float, owner: int):
+        self._starts.append(start)
+        self._ends.append(end)
+        self._power.append(power_kw)
+        self._owner.append(owner)
+
+    def arrays(self):
+        return (to_seconds(self._starts), to_seconds(self._ends),
+                np.array(self._power, dtype=float), np.array(self._owner, dtype=int))
+
+
+class BuildingCostCalculator:
+    """Cost of the energy used by the receivers and revenue of the energy made by the generators of a building.
+
+    Sessions and weather raports come from the search backend clipped to the window, as for the
+    energy endpoint; storage devices are not priced.
+    """
+
+    def __init__(self, prices: PriceSeries = None):
+        self.prices = prices or load_price_series()
+        self.generator_calculator = EnergyGeneratorCalculator()
+
+    def calculate(self, building: Building, start_date: datetime, end_date: datetime = None,
+                  step: timedelta = None) -> Dict:
+        end_date = end_date or clock.now()
+        devices = [device for device in building.building_devices.all()
+                   if isinstance(device, (EnergyReceiver, EnergyGenerator))]
+
+        receivers = Intervals()
+        for position, device in enumerate(devices):
+            if isinstance(device, EnergyReceiver):
+                for raport in EnergyCalculator.filter_raports_by_device_and_date(device, start_date, end_date):
+                    receivers.add(raport.turned_on, raport.turned_off, device.device_power / 1000, position)
+        weather = Intervals()
+        generators = [device for device in devices if isinstance(device, EnergyGenerator)]
+        if generators:
+            for raport in self.generator_calculator._filter_weather_raports_by_date(start_date, end_date):
+                weather.add(raport.datetime_from, raport.datetime_to, raport.solar_radiation, 0)
+
+        starts, ends, power, owners = receivers.arrays()
+        costs = np.bincount(owners, self.prices.interval_values(starts, ends, power), minlength=len(devices))
+        energy = np.bincount(owners, power * (ends - starts) / HOUR, minlength=len(devices))
+        weather_starts, weather_ends, radiation, _ = weather.arrays()
+        factors = photovoltaic_factors(radiation)
+        revenue_per_watt = self.prices.interval_values(weather_starts, weather_ends, factors, feed_in=True).sum()
+        energy_per_watt = (factors * (weather_ends - weather_starts) / HOUR).sum()
+
+        building_devices = []
+        for position, device in enumerate(devices):
+            if isinstance(device, EnergyGenerator):
+                cost, revenue = 0.0, float(device.generation_power * revenue_per_watt)
+                device_energy = float(device.generation_power * energy_per_watt)
+            else:
+                cost, revenue, device_energy = float(costs[position]), 0.0, float(energy[position])
+            building_devices.append({
+                "id": device.id, "name": device.name, "type": device.type,
+                "energy": device_energy, "cost": cost, "revenue": revenue, "net": revenue - cost,
+            })
+
+        result = {
+            **model_to_dict(building),
+            "currency": self.prices.currency,
+            "cost": sum(device["cost"] for device in building_devices),
+            "revenue": sum(device["revenue"] for device in building_devices),
+            "building_devices": building_devices,
+        }
+        result["net"] = result["revenue"] - result["cost"]
+        if step is not None:
+            boundaries = np.append(np.arange(to_seconds([start_date])[0], to_seconds([end_date])[0],
+                                             step.total_seconds()), to_seconds([end_date]))
+            window_costs = self.prices.window_values(starts, ends, power, boundaries)
+            generation_power = sum(device.generation_power for device in generators)
+            window_revenues = self.prices.window_values(weather_starts, weather_ends, factors * generation_power,
+                                                        boundaries, feed_in=True)
+            result["windows"] = [
+                {"start_date": from_seconds(window_start), "end_date": from_seconds(window_end),
+                 "cost": float(cost), "revenue": float(revenue), "net": float(revenue - cost)}
+                for window_start, window_end, cost, revenue
+                in zip(boundaries[:-1], boundaries[1:], window_costs, window_revenues)
+            ]
+        return result
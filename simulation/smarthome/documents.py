@@ -1,18 +1,118 @@
-from config.settings import ELASTICSEARCH_CONNECTION
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from django.conf import settings
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
-from elasticsearch_dsl import connections
+from elasticsearch.helpers import BulkIndexError
 
 from .models import (ChargeStateRaport, Device, DeviceRaport,
                      StorageChargingAndUsageRaport, WeatherRaport)
 
-connections.create_connection(**ELASTICSEARCH_CONNECTION)
+MONTH_FORMAT = "%Y.%m"
+OPEN_SUFFIX = "open"
+LONG_SUFFIX = "long"
+
+
+def index_lookback() -> timedelta:
+    """Longest closed raport kept in the index of its start month; longer ones go to the `-long` index."""
+    return timedelta(days=settings.SEARCH_INDEX_LOOKBACK_DAYS)
+
+
+def months_between(start: datetime, end: datetime) -> List[str]:
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}.{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class RaportDocument(Document):
+    """Raport stored in the monthly index of its start, e.g. `device_raports-2021.03`.
+
+    Raports without an end live in `<name>-open` and raports longer than `index_lookback()` in
+    `<name>-long`, so a window query only searches the months from (start - lookback) to end
+    plus those two. All indices share the mappings of an index template and are searched
+    together through the alias `<name>`.
+    """
+    start_field = None
+    end_field = None
+    _templates_saved = set()
+
+    @classmethod
+    def index_name(cls, suffix: str) -> str:
+        return f"{cls._index._name}-{suffix}"
+
+    @classmethod
+    def save_template(cls):
+        index = cls._index.clone()
+        index.aliases(**{cls._index._name: {}})
+        index.as_template(cls._index._name, pattern=cls.index_name("*")).save()
+        RaportDocument._templates_saved.add(cls)
+
+    @classmethod
+    def window_indices(cls, start_date: Optional[datetime], end_date: datetime) -> List[str]:
+        """Indices holding every raport overlapping [start_date, end_date]."""
+        if start_date is None or cls.end_field is None:
+            return [cls.index_name("*")]
+        months = months_between(start_date - index_lookback(), end_date)
+        if len(months) > settings.SEARCH_INDEX_MAX_MONTHS:
+            return [cls.index_name("*")]
+        return [cls.index_name(month) for month in months] + [cls.index_name(OPEN_SUFFIX), cls.index_name(LONG_SUFFIX)]
+
+    @classmethod
+    def search_window(cls, start_date: Optional[datetime], end_date: datetime):
+        # months without raports have no index
+        return cls.search(index=cls.window_indices(start_date, end_date)).params(ignore_unavailable=True)
+
+    def location(self, instance) -> str:
+        start = getattr(instance, self.start_field)
+        if self.end_field is None:
+            return self.index_name(start.strftime(MONTH_FORMAT))
+        end = getattr(instance, self.end_field)
+        if end is None:
+            return self.index_name(OPEN_SUFFIX)
+        if end - start > index_lookback():
+            return self.index_name(LONG_SUFFIX)
+        return self.index_name(start.strftime(MONTH_FORMAT))
+
+    def possible_locations(self, instance) -> List[str]:
+        """Every index an earlier version of the raport may be stored in; the start never changes."""
+        locations = [self.index_name(getattr(instance, self.start_field).strftime(MONTH_FORMAT))]
+        if self.end_field is not None:
+            locations += [self.index_name(OPEN_SUFFIX), self.index_name(LONG_SUFFIX)]
+        return locations
+
+    def _get_actions(self, object_list, action):
+        for instance in object_list:
+            target = self.location(instance) if action != "delete" else None
+            for index in self.possible_locations(instance):
+                if index != target:
+                    yield dict(self._prepare_action(instance, "delete"), _index=index)
+            if target is not None:
+                yield dict(self._prepare_action(instance, action), _index=target)
+
+    def update(self, thing, refresh=None, action="index", parallel=False, **kwargs):
+        """Index or delete the raports; deletes of copies that do not exist are not errors."""
+        if type(self) not in RaportDocument._templates_saved:
+            self.save_template()
+        raise_on_error = kwargs.pop("raise_on_error", True)
+        success, errors = super().update(thing, refresh, action, parallel, raise_on_error=False, **kwargs)
+        errors = [error for error in errors if error.get("delete", {}).get("status") != 404]
+        if errors and raise_on_error:
+            raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+        return success, errors
+
 
 @registry.register_document
-class DeviceRaportDocument(Document):
+class DeviceRaportDocument(RaportDocument):
+    start_field = 'turned_on'
+    end_field = 'turned_off'
+
     id = fields.IntegerField(attr='id')
     device = fields.ObjectField(properties={
-            'name' : fields.TextField(),
+            'name' : fields.KeywordField(),
             'id' : fields.IntegerField(attr='id'),
     })
 
@@ -40,7 +140,10 @@ class DeviceRaportDocument(Document):
 
 
 @registry.register_document
-class WeatherDocument(Document):
+class WeatherDocument(RaportDocument):
+    start_field = 'datetime_from'
+    end_field = 'datetime_to'
+
     solar_radiation = fields.FloatField(attr='solar_radiation')
     class Index:
         name = 'weather_raports'
@@ -57,19 +160,24 @@ class WeatherDocument(Document):
         ]
 
 @registry.register_document
-class StorageChargingAndUsageDocument(Document):
+class StorageChargingAndUsageDocument(RaportDocument):
+    start_field = 'date_time_from'
+    end_field = 'date_time_to'
+
     id = fields.IntegerField(attr='id')
     device = fields.ObjectField(properties={
-            'name' : fields.TextField(),
+            'name' : fields.KeywordField(),
             'id' : fields.IntegerField(attr='id')
     })
 
     energy_receiver = fields.ObjectField(properties={
-            'name' : fields.TextField(),
+            'name' : fields.KeywordField(),
             'id' : fields.IntegerField(attr='id'),
             'device_power' : fields.FloatField()
             
     })
+    job_type = fields.KeywordField(attr='job_type')
+    energy_use = fields.FloatField(attr='energy_use')
 
     class Index:
         name = 'storage_charging_and_usage_raports'
@@ -81,7 +189,6 @@ class StorageChargingAndUsageDocument(Document):
         fields = [
             'date_time_from',
             'date_time_to',
-            'job_type',
         ]
     
     def get_queryset(self):
@@ -94,10 +201,12 @@ class StorageChargingAndUsageDocument(Document):
             return related_instance.storage_charging_and_usage_raports.all()
 
 @registry.register_document
-class ChargeStateDocument(Document):
+class ChargeStateDocument(RaportDocument):
+    start_field = 'date'
+
     id = fields.IntegerField(attr='id')
     device = fields.ObjectField(properties={
-            'name' : fields.TextField(),
+            'name' : fields.KeywordField(),
             'id' : fields.IntegerField(attr='id'),
     })
 
@@ -0,0 +1,63 @@
+import csv
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, Sequence
+
+from django.db.models import Q, QuerySet
+from django.http import StreamingHttpResponse
+
+from .renderers import CSVRenderer, NDJSONRenderer
+
+EXPORT_FORMATS = {
+    NDJSONRenderer.format: NDJSONRenderer.media_type,
+    CSVRenderer.format: CSVRenderer.media_type,
+}
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Line:
+    """File-like object handing back what csv.writer writes to it."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _to_json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def overlap_filter(from_field: str, to_field: str, start_date: datetime, end_date: datetime) -> Q:
+    """SQL equivalent of the search backend overlap query: raports having any common point with the window."""
+    return Q(**{f"{from_field}__lte": end_date}) & (
+        Q(**{f"{to_field}__isnull": True}) | Q(**{f"{to_field}__gte": start_date})
+    )
+
+
+def stream_rows(rows: Iterable[Sequence], fields: Sequence[str], export_format: str,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """Encode rows lazily, yielding one string per `chunk_size` rows."""
+    chunk = []
+    if export_format == CSVRenderer.format:
+        writer = csv.writer(_Line())
+        chunk.append(writer.writerow(fields))
+        encode = lambda row: writer.writerow(row)
+    else:
+        encode = lambda row: json.dumps(dict(zip(fields, map(_to_json_value, row)))) + "\n"
+
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def export_response(queryset: QuerySet, fields: Sequence[str], export_format: str, filename: str) -> StreamingHttpResponse:
+    """Stream `fields` of every row of `queryset` read through a server-side cursor."""
+    rows = queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    response = StreamingHttpResponse(
+        stream_rows(rows, fields, export_format), content_type=EXPORT_FORMATS[export_format]
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,273 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import clock
+from .caching import bump_data_version
+from .models import Device, DeviceRaport, debounce_window
+from .search_backends import get_search_backend
+
+# One batch locks the rows of all its devices until it is written.
+MAX_EVENTS_PER_REQUEST = 10000
+
+
+class StateEvent(NamedTuple):
+    device_id: int
+    state: bool
+    timestamp: datetime
+
+
+class DeviceHistory(NamedTuple):
+    """What is stored for a device before a batch is applied."""
+    state: bool
+    open_raport_id: Optional[int]
+    last_raport_id: Optional[int]
+    last_change: Optional[datetime]
+    # end of the last session when it is closed, sessions restarted soon after it are merged into it
+    last_off: Optional[datetime] = None
+    debounce: timedelta = timedelta(0)
+
+
+class DevicePlan:
+    """Writes needed to apply the events of one device."""
+
+    def __init__(self, history: DeviceHistory):
+        self.state = bool(history.state)
+        self.open_raport_id = history.open_raport_id
+        # (id, turned_off) of a stored raport to close or reopen
+        self.stored_update: Optional[Tuple[int, Optional[datetime]]] = None
+        self.sessions: List[Tuple[datetime, Optional[datetime]]] = []
+        self.applied = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.merged = 0
+
+    @property
+    def open_since(self) -> Optional[datetime]:
+        if self.sessions and self.sessions[-1][1] is None:
+            return self.sessions[-1][0]
+        return None
+
+    def last_off(self, history: DeviceHistory) -> Optional[datetime]:
+        if self.sessions:
+            return self.sessions[-1][1]
+        if self.stored_update is not None:
+            return self.stored_update[1]
+        return history.last_off
+
+    def switch_on(self, history: DeviceHistory, timestamp: datetime):
+        last_off = self.last_off(history)
+        if last_off is None or timestamp - last_off >= history.debounce:
+            self.sessions.append((timestamp, None))
+        elif self.sessions:
+            self.sessions[-1] = (self.sessions[-1][0], None)
+            self.merged += 1
+        else:
+            raport_id = self.stored_update[0] if self.stored_update else history.last_raport_id
+            self.stored_update = (raport_id, None)
+            self.open_raport_id = raport_id
+            self.merged += 1
+
+    def switch_off(self, timestamp: datetime):
+        if self.open_since is not None:
+            self.sessions[-1] = (self.open_since, timestamp)
+        elif self.open_raport_id is not None:
+            self.stored_update = (self.open_raport_id, timestamp)
+            self.open_raport_id = None
+
+
+def parse_events(data) -> List[StateEvent]:
+    """Validate `[{"device": id, "state": bool, "timestamp": iso datetime}, ...]` without per-item serializers."""
+    if not isinstance(data, list):
+        raise ValidationError({"events": "Expected a list of events."})
+    if len(data) > MAX_EVENTS_PER_REQUEST:
+        raise ValidationError({"events": f"At most {MAX_EVENTS_PER_REQUEST} events per request."})
+    events = []
+    for position, item in enumerate(data):
+        try:
+            timestamp = datetime.fromisoformat(item["timestamp"])
+            if timezone.is_aware(timestamp):
+                timestamp = timezone.make_naive(timestamp)
+            if not isinstance(item["state"], bool):
+                raise TypeError(item["state"])
+            events.append(StateEvent(int(item["device"]), item["state"], timestamp))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({position: "Expected device (int), state (bool) and timestamp (ISO 8601)."})
+    return events
+
+
+def plan_device_events(history: DeviceHistory, events: Iterable[StateEvent]) -> DevicePlan:
+    """Pair the on/off events of one device into sessions.
+
+    Events are sorted by time; exact duplicates and events repeating the current state are
+    dropped, as are events not later than the last change already stored (they arrived too
+    late to be ordered against it). An off event closes the session opened by the preceding
+    on event, or the stored open session; the last on event may stay open. An on event
+    within the debounce window after an off event continues the session the off event closed.
+    """
+    plan = DevicePlan(history)
+    seen = set()
+    for event in sorted(events, key=lambda event: event.timestamp):
+        if (event.timestamp, event.state) in seen:
+            plan.duplicates += 1
+            continue
+        seen.add((event.timestamp, event.state))
+        if history.last_change is not None and event.timestamp <= history.last_change:
+            plan.stale += 1
+            continue
+        if event.state == plan.state:
+            plan.duplicates += 1
+            continue
+        if event.state:
+            plan.switch_on(history, event.timestamp)
+        else:
+            plan.switch_off(event.timestamp)
+        plan.state = event.state
+        plan.applied += 1
+    return plan
+
+
+def coalesce_sessions(raports: Iterable[Tuple[int, datetime, Optional[datetime]]], window: timedelta):
+    """Merge stored sessions separated by less than `window`, the way ingestion does.
+
+    `raports` are (id, turned_on, turned_off) rows sorted by turned_on. Returns the new
+    turned_off of every session that absorbed others and the {removed id: surviving id} map.
+    """
+    extended: Dict[int, Optional[datetime]] = {}
+    removed: Dict[int, int] = {}
+    current = None
+    for pk, turned_on, turned_off in raports:
+        if current is not None and current[2] is not None and turned_on - current[2] < window:
+            end = None if turned_off is None else max(turned_off, current[2])
+            current = (current[0], current[1], end)
+            extended[current[0]] = end
+            removed[pk] = current[0]
+        else:
+            current = (pk, turned_on, turned_off)
+    return extended, removed
+
+
+def load_histories(device_ids: Iterable[int]) -> Dict[int, DeviceHistory]:
+    """Lock the devices (in id order, against concurrent toggles) and read their stored session state.
+
+    The last raport of every device is read with a (device, turned_on) index lookup.
+    """
+    last_raport = DeviceRaport.objects.filter(device_id=OuterRef("pk")).order_by("-turned_on")
+    devices = (
+        Device.objects.non_polymorphic().select_for_update(of=("self",)).filter(pk__in=device_ids).order_by("pk")
+        .annotate(
+            last_raport_id=Subquery(last_raport.values("pk")[:1]),
+            last_turned_on=Subquery(last_raport.values("turned_on")[:1]),
+            last_turned_off=Subquery(last_raport.values("turned_off")[:1]),
+        )
+        .values_list("pk", "state", "open_raport_id", "polymorphic_ctype__model",
+                     "last_raport_id", "last_turned_on", "last_turned_off")
+    )
+    histories = {}
+    for pk, state, open_raport_id, device_type, last_raport_id, last_turned_on, last_turned_off in devices:
+        histories[pk] = DeviceHistory(
+            state, open_raport_id, last_raport_id, last_turned_off or last_turned_on,
+            last_off=last_turned_off, debounce=debounce_window(device_type),
+        )
+    return histories
+
+
+@transaction.atomic
+def ingest_events(events: List[StateEvent]) -> Dict:
+    """Apply a batch of state events with bulk statements and report what was done with them."""
+    by_device: Dict[int, List[StateEvent]] = {}
+    for event in events:
+        by_device.setdefault(event.device_id, []).append(event)
+    histories = load_histories(by_device)
+    plans = {device_id: plan_device_events(histories[device_id], device_events)
+             for device_id, device_events in by_device.items() if device_id in histories}
+
+    updated = [DeviceRaport(pk=plan.stored_update[0], turned_off=plan.stored_update[1])
+               for plan in plans.values() if plan.stored_update is not None]
+    DeviceRaport.objects.bulk_update(updated, ["turned_off"])
+    created = [DeviceRaport(device_id=device_id, turned_on=turned_on, turned_off=turned_off)
+               for device_id, plan in plans.items() for turned_on, turned_off in plan.sessions]
+    DeviceRaport.objects.bulk_create(created)
+
+    changed = {device_id: plan for device_id, plan in plans.items() if plan.applied}
+    if changed:
+        # bulk_create does not return ids on every backend, read the new rows back
+        written = list(DeviceRaport.objects.filter(
+            device_id__in=changed, turned_on__gte=min(raport.turned_on for raport in created),
+        )) if created else []
+        open_raports = {(raport.device_id, raport.turned_on): raport.pk for raport in written if raport.turned_off is None}
+        devices = []
+        for device_id, plan in changed.items():
+            if plan.open_since is not None:
+                plan.open_raport_id = open_raports[(device_id, plan.open_since)]
+            devices.append(Device(pk=device_id, state=plan.state, open_raport_id=plan.open_raport_id))
+        Device.objects.bulk_update(devices, ["state", "open_raport"])
+
+        written += DeviceRaport.objects.filter(pk__in=[raport.pk for raport in updated])
+        get_search_backend().index(written)
+        bump_data_version(Device.objects.filter(pk__in=changed).values("building_id"))
+
+    return {
+        "events": len(events),
+        "applied": sum(plan.applied for plan in plans.values()),
+        "duplicates": sum(plan.duplicates for plan in plans.values()),
+        "stale": sum(plan.stale for plan in plans.values()),
+        "merged": sum(plan.merged for plan in plans.values()),
+        "unknown_devices": sorted(set(by_device) - set(histories)),
+        "raports_created": len(created),
+        "raports_updated": len(updated),
+    }
+
+
+@transaction.atomic
+def switch_devices(devices, state: bool, timestamp: datetime = None) -> List[int]:
+    """Set-based `Device.switch`: flip every device of the queryset not in `state` yet.
+
+    The devices are locked in id order and flipped with one UPDATE. Their sessions are opened
+    (or reopened within the debounce window) or closed with bulk statements and indexed in one
+    search backend call. Returns the ids of the switched devices.
+    """
+    timestamp = timestamp or clock.now()
+    last_raport = DeviceRaport.objects.filter(device_id=OuterRef("pk")).order_by("-turned_on")
+    rows = list(
+        Device.objects.non_polymorphic().select_for_update(of=("self",))
+        .filter(pk__in=devices.values("pk")).exclude(state=state).order_by("pk")
+        .annotate(
+            last_raport_id=Subquery(last_raport.values("pk")[:1]),
+            last_turned_off=Subquery(last_raport.values("turned_off")[:1]),
+        )
+        .values_list("pk", "building_id", "open_raport_id", "polymorphic_ctype__model",
+                     "last_raport_id", "last_turned_off")
+    )
+    if not rows:
+        return []
+    device_ids = [row[0] for row in rows]
+    if state:
+        reopened = {
+            pk: last_raport_id for pk, _, _, device_type, last_raport_id, last_turned_off in rows
+            if last_turned_off is not None and timestamp - last_turned_off < debounce_window(device_type)
+        }
+        DeviceRaport.objects.filter(pk__in=reopened.values()).update(turned_off=None)
+        DeviceRaport.objects.bulk_create([
+            DeviceRaport(device_id=pk, turned_on=timestamp) for pk in device_ids if pk not in reopened
+        ])
+        raports = list(DeviceRaport.objects.filter(
+            Q(pk__in=reopened.values()) | Q(device_id__in=device_ids, turned_on=timestamp)
+        ))
+        Device.objects.bulk_update(
+            [Device(pk=raport.device_id, state=True, open_raport_id=raport.pk) for raport in raports],
+            ["state", "open_raport"],
+        )
+    else:
+        open_ids = [row[2] for row in rows if row[2] is not None]
+        DeviceRaport.objects.filter(pk__in=open_ids).update(turned_off=timestamp)
+        Device.objects.filter(pk__in=device_ids).update(state=False, open_raport=None)
+        raports = list(DeviceRaport.objects.filter(pk__in=open_ids))
+
+    get_search_backend().index(raports)
+    bump_data_version({row[1] for row in rows})
+    return device_ids
@@ -0,0 +1,173 @@
+from datetime import datetime
+from typing import Any, Hashable, Iterable, List, Optional, Tuple
+
+OPEN_END = datetime.max
+
+
+class _Node:
+    __slots__ = ("start", "end", "key", "value", "max_end", "height", "left", "right")
+
+    def __init__(self, start, end, key, value):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.value = value
+        self.max_end = end
+        self.height = 1
+        self.left = None
+        self.right = None
+
+    @property
+    def sort_key(self):
+        return self.start, self.key
+
+
+def _height(node: Optional[_Node]) -> int:
+    return node.height if node else 0
+
+
+def _refresh(node: _Node) -> _Node:
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    node.max_end = node.end
+    if node.left and node.left.max_end > node.max_end:
+        node.max_end = node.left.max_end
+    if node.right and node.right.max_end > node.max_end:
+        node.max_end = node.right.max_end
+    return node
+
+
+def _rotate_right(node: _Node) -> _Node:
+    pivot = node.left
+    node.left = pivot.right
+    pivot.right = _refresh(node)
+    return _refresh(pivot)
+
+
+def _rotate_left(node: _Node) -> _Node:
+    pivot = node.right
+    node.right = pivot.left
+    pivot.left = _refresh(node)
+    return _refresh(pivot)
+
+
+def _balance(node: _Node) -> _Node:
+    _refresh(node)
+    skew = _height(node.left) - _height(node.right)
+    if skew > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate_left(node.left)
+        return _rotate_right(node)
+    if skew < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate_right(node.right)
+        return _rotate_left(node)
+    return node
+
+
+class IntervalTree:
+    """AVL tree of intervals ordered by (start, key) and augmented with the max end of every subtree.
+
+    Intervals are closed; `end=None` means the interval is still open. Keys must be unique
+    within the tree; adding an existing key replaces the interval.
+    """
+
+    def __init__(self, items: Iterable[Tuple[Any, Any, Hashable, Any]] = ()):
+        self._root = None
+        self._starts = {}
+        nodes = sorted(
+            (_Node(start, OPEN_END if end is None else end, key, value) for start, end, key, value in items),
+            key=lambda node: node.sort_key,
+        )
+        self._root = self._build(nodes, 0, len(nodes))
+        self._starts = {node.key: node.start for node in nodes}
+
+    def _build(self, nodes: List[_Node], low: int, high: int) -> Optional[_Node]:
+        if low >= high:
+            return None
+        middle = (low + high) // 2
+        node = nodes[middle]
+        node.left = self._build(nodes, low, middle)
+        node.right = self._build(nodes, middle + 1, high)
+        return _refresh(node)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._starts
+
+    def add(self, start, end, key: Hashable, value: Any = None):
+        if key in self._starts:
+            self.remove(key)
+        self._root = self._insert(self._root, _Node(start, OPEN_END if end is None else end, key, value))
+        self._starts[key] = start
+
+    def _insert(self, node: Optional[_Node], new: _Node) -> _Node:
+        if node is None:
+            return new
+        if new.sort_key < node.sort_key:
+            node.left = self._insert(node.left, new)
+        else:
+            node.right = self._insert(node.right, new)
+        return _balance(node)
+
+    def remove(self, key: Hashable) -> bool:
+        start = self._starts.pop(key, None)
+        if start is None:
+            return False
+        self._root = self._delete(self._root, (start, key))
+        return True
+
+    def _delete(self, node: Optional[_Node], sort_key) -> Optional[_Node]:
+        if node is None:
+            return None
+        if sort_key < node.sort_key:
+            node.left = self._delete(node.left, sort_key)
+        elif sort_key > node.sort_key:
+            node.right = self._delete(node.right, sort_key)
+        else:
+            if node.left is None:
+                return node.right
+            if node.right is None:
+                return node.left
+            successor = node.right
+            while successor.left:
+                successor = successor.left
+            node.right = self._delete(node.right, successor.sort_key)
+            successor.left, successor.right = node.left, node.right
+            node = successor
+        return _balance(node)
+
+    def overlap(self, start, end, after: Tuple = None, limit: int = None) -> List[Any]:
+        """Values of intervals having any common point with [start, end], ordered by (start, key).
+
+        `after` skips intervals up to and including that (start, key) position and `limit` stops the
+        walk early, so consecutive pages cost the same regardless of how many were read before.
+        """
+        found = []
+        self._overlap(self._root, start, end, after, limit, found)
+        return found
+
+    def _overlap(self, node: Optional[_Node], start, end, after, limit, found: List):
+        if node is None or node.max_end < start or (limit is not None and len(found) >= limit):
+            return
+        if after is None or node.sort_key > after:
+            self._overlap(node.left, start, end, after, limit, found)
+            if node.start > end or (limit is not None and len(found) >= limit):
+                return
+            if node.end >= start:
+                found.append(node.value)
+        elif node.start > end:
+            return
+        self._overlap(node.right, start, end, after, limit, found)
+
+    def last_before(self, point) -> Optional[Any]:
+        """Value of the interval with the greatest start lower than `point`."""
+        node, found = self._root, None
+        while node:
+            if node.start < point:
+                found = node.value
+                node = node.right
+            else:
+                node = node.left
+        return found
@@ -0,0 +1,77 @@
+import json
+
+from benchmarks import CASES, BenchmarkRunner, compare
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+
+def parse_scales(value: str):
+    return [int(float(scale)) for scale in value.split(",") if scale]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time energy calculators, the building energy view and ingest paths on synthetic data. "
+        "Runs on a separate test database which is destroyed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", type=parse_scales, default=parse_scales("1e3,1e4,1e5"),
+                            help="comma separated numbers of device raports, e.g. 1e3,1e5,1e7")
+        parser.add_argument("--cases", default=",".join(CASES), help="comma separated case names")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--sessions-per-device", type=int, default=1000)
+        parser.add_argument("--weather-days", type=int, default=30,
+                            help="days of 5-minute weather; calculator windows end with the weather")
+        parser.add_argument("--output", help="write JSON results to this file")
+        parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+        parser.add_argument("--threshold", type=float, default=0.25,
+                            help="relative slowdown against the baseline reported as a regression")
+        parser.add_argument("--keepdb", action="store_true", default=False)
+        parser.add_argument("--search-backend", choices=["memory", "elasticsearch"], default="memory",
+                            help="memory runs offline; elasticsearch needs a running cluster")
+
+    def handle(self, *args, **options):
+        cases = [case for case in options["cases"].split(",") if case]
+        unknown = set(cases) - set(CASES)
+        if unknown:
+            raise CommandError(f"Unknown cases: {', '.join(sorted(unknown))}")
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, keepdb=options["keepdb"])
+        search_backend = options["search_backend"]
+        try:
+            runner = BenchmarkRunner(
+                options["scales"], cases, repeat=options["repeat"], seed=options["seed"],
+                sessions_per_device=options["sessions_per_device"], weather_days=options["weather_days"],
+                log=self.stdout.write,
+            )
+            with override_settings(SEARCH_BACKEND=search_backend,
+                                   ELASTICSEARCH_DSL_AUTOSYNC=search_backend == "elasticsearch"):
+                results = runner.run()
+            results["meta"]["search_backend"] = search_backend
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        if options["baseline"]:
+            with open(options["baseline"], "r") as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, threshold=options["threshold"])
+            for regression in regressions:
+                self.stdout.write(
+                    f"REGRESSION {regression['key']}: {regression['baseline_s']:.4f} s -> "
+                    f"{regression['current_s']:.4f} s (x{regression['ratio']:.2f})"
+                )
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) slower than baseline by more than "
+                                   f"{options['threshold']:.0%}")
+            self.stdout.write("No regressions against baseline.")
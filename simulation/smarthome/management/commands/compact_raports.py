@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from smarthome.caching import bump_data_version
+from smarthome.ingest import coalesce_sessions
+from smarthome.models import (Device, DeviceRaport, EnergyGenerator,
+                              EnergyReceiver, EnergyStorage, debounce_window,
+                              delete_rows)
+from smarthome.search_backends import get_search_backend
+
+DEVICE_MODELS = {model.__name__: model for model in (EnergyReceiver, EnergyGenerator, EnergyStorage)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge device raports separated by less than the debounce window of the device type "
+        "(DEVICE_DEBOUNCE_SECONDS) into single sessions and delete the merged rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--device-type", choices=sorted(DEVICE_MODELS), action="append",
+                            help="compact only devices of this type (repeatable)")
+        parser.add_argument("--dry-run", action="store_true", default=False, help="only count the rows to remove")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        removed_total, devices_total = 0, 0
+        for device_type in options["device_type"] or sorted(DEVICE_MODELS):
+            window = debounce_window(device_type)
+            if not window:
+                self.stdout.write(f"{device_type}: no debounce window, skipped")
+                continue
+            removed_type = 0
+            for device_id in DEVICE_MODELS[device_type].objects.values_list("pk", flat=True).iterator():
+                removed = self.compact_device(device_id, window, options["dry_run"], options["batch_size"])
+                removed_type += removed
+                devices_total += bool(removed)
+            self.stdout.write(f"{device_type}: {removed_type} raports merged (window {window.total_seconds():g} s)")
+            removed_total += removed_type
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed_total} raports of {devices_total} devices."))
+
+    def compact_device(self, device_id: int, window, dry_run: bool, batch_size: int) -> int:
+        with transaction.atomic():
+            device = Device.objects.non_polymorphic().select_for_update().filter(pk=device_id)
+            open_raport_id = device.values_list("open_raport_id", flat=True).first()
+            rows = (DeviceRaport.objects.filter(device_id=device_id).order_by("turned_on")
+                    .values_list("pk", "turned_on", "turned_off").iterator(chunk_size=batch_size))
+            extended, removed = coalesce_sessions(rows, window)
+            if dry_run or not removed:
+                return len(removed)
+
+            survivors = [DeviceRaport(pk=pk, device_id=device_id, turned_off=turned_off) for pk, turned_off in extended.items()]
+            DeviceRaport.objects.bulk_update(survivors, ["turned_off"], batch_size=batch_size)
+            if open_raport_id in removed:
+                device.update(open_raport_id=removed[open_raport_id])
+            removed_ids = list(removed)
+            for start in range(0, len(removed_ids), batch_size):
+                # plain DELETE: rows are dropped from the search index in bulk below, not one signal at a time
+                delete_rows(DeviceRaport, removed_ids[start:start + batch_size])
+
+            backend = get_search_backend()
+            backend.remove([DeviceRaport(pk=pk, device_id=device_id) for pk in removed_ids])
+            backend.index(DeviceRaport.objects.filter(pk__in=list(extended)))
+            bump_data_version(device.values("building_id"))
+        return len(removed)
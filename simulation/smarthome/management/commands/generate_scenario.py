@@ -0,0 +1,56 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from smarthome.scenario import load_scenario
+from synthetic import SyntheticDataGenerator
+from synthetic.scenario import DATE_FORMAT, Scenario
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a seeded synthetic scenario: users, buildings with rooms and typed devices, device sessions and "
+        "5-minute weather. It is written as a manifest, one raports file per building in the first_scenario_raports.json "
+        "schema and a weather file (load them with populate_db_from_file.py --scenario-dir), or loaded straight into "
+        "the database. Rows are streamed in chunks, so the size of a scenario is bounded by disk, not memory."
+    )
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument("--output-dir", help="directory for the scenario files")
+        target.add_argument("--load", action="store_true", default=False, help="write into the database instead")
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--buildings-per-user", type=int, default=1)
+        parser.add_argument("--receivers-per-building", type=int, default=10)
+        parser.add_argument("--sessions-per-device", type=int, default=1000)
+        parser.add_argument("--weather-days", type=float, default=30.0)
+        parser.add_argument("--start-date", type=parse_date, default=datetime(2022, 1, 1), help=f"format {DATE_FORMAT!r}")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=10000, help="rows per write or bulk insert")
+
+    def handle(self, *args, **options):
+        if min(options["users"], options["buildings_per_user"], options["chunk_size"]) < 1 \
+                or min(options["receivers_per_building"], options["sessions_per_device"], options["weather_days"]) < 0:
+            raise CommandError("Counts must not be negative and users, buildings per user and chunk size at least 1.")
+        generator = SyntheticDataGenerator(seed=options["seed"], start=options["start_date"],
+                                           receivers_per_building=options["receivers_per_building"])
+        scenario = Scenario(generator, options["users"], options["buildings_per_user"], options["sessions_per_device"],
+                            options["weather_days"], options["chunk_size"])
+
+        started = time.perf_counter()
+        if options["load"]:
+            counts = load_scenario(scenario, options["chunk_size"])
+            target = "the database"
+        else:
+            counts = scenario.write(options["output_dir"])
+            target = options["output_dir"]
+        elapsed = time.perf_counter() - started
+        rate = counts["device_raports"] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['users']} users, {counts['buildings']} buildings, {counts['device_raports']} device raports and "
+            f"{counts['weather_raports']} weather raports written to {target} in {elapsed:.1f} s ({rate:.0f} raports/s)."
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+from smarthome.copy_loader import FORMATS, LOADERS, load_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load device, weather or charge state raports from CSV (with header), NDJSON or a JSON array "
+        "with COPY FROM STDIN and a staging table. Rows already stored are skipped and the new rows are indexed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(LOADERS))
+        parser.add_argument("paths", nargs="+", metavar="path")
+        parser.add_argument("--format", choices=FORMATS, help="file format, by default taken from the extension")
+
+    def handle(self, *args, **options):
+        for path in options["paths"]:
+            started = time.perf_counter()
+            try:
+                counts = load_file(options["kind"], path, options["format"])
+            except (OSError, ValueError, NotSupportedError) as error:
+                raise CommandError(str(error))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{path}: {counts['inserted']} inserted, {counts['skipped']} skipped of {counts['read']} "
+                f"in {elapsed:.1f} s ({counts['read'] / elapsed if elapsed else 0:.0f} rows/s)"
+            )
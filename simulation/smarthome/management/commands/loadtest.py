@@ -0,0 +1,89 @@
+import json
+from datetime import datetime
+
+from benchmarks.load import format_report, transport_factory
+from benchmarks.loadtest import (DEFAULT_MIX, DEFAULT_WINDOWS_HOURS, WORKLOADS,
+                                 LoadTest, discover_targets)
+from django.core.management.base import BaseCommand, CommandError
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def parse_mix(value: str):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise ValueError(f"unknown workload {name!r}, expected one of {', '.join(WORKLOADS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_hours(value: str):
+    return [float(hours) for hours in value.split(",") if hours]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test a running instance (--base-url) or this process with a mix of device toggles, bulk raport posts, "
+        "energy queries over several window sizes and building listings, and report p50/p95/p99 latency, throughput "
+        "and error rate per endpoint. Toggles and posts write to the target's database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", help="e.g. http://localhost:8000; in process by default")
+        parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                            help="weights, e.g. toggle=50,bulk_raports=5,energy=35,buildings=10")
+        parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+        parser.add_argument("--rate", type=float,
+                            help="open loop: requests arriving per second; closed loop without it")
+        parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+        parser.add_argument("--requests", type=int, help="stop after this many requests")
+        parser.add_argument("--windows-hours", type=parse_hours, default=list(DEFAULT_WINDOWS_HOURS),
+                            help="energy query window sizes, e.g. 1,24,168,720")
+        parser.add_argument("--end-date", type=parse_date, help=f"end of the energy windows, format {DATE_FORMAT!r}")
+        parser.add_argument("--batch-size", type=int, default=100, help="raports per bulk post")
+        parser.add_argument("--buildings", type=int, default=10, help="buildings (and their receivers) to target")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="write the JSON report to this file")
+        parser.add_argument("--format", choices=("text", "json"), default="text")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1 or options["duration"] <= 0 or (options["rate"] is not None and options["rate"] <= 0):
+            raise CommandError("Concurrency, duration and rate must be positive.")
+        if not options["windows_hours"]:
+            raise CommandError("At least one energy window is needed.")
+        factory = transport_factory(options["base_url"])
+        transport = factory()
+        try:
+            targets = discover_targets(transport, options["buildings"])
+        except OSError as error:
+            raise CommandError(f"Cannot reach {options['base_url']}: {error}")
+        finally:
+            transport.close()
+        try:
+            load_test = LoadTest(
+                targets, factory, options["mix"], options["concurrency"], options["rate"], options["duration"],
+                options["requests"], options["windows_hours"], options["end_date"], options["batch_size"], options["seed"],
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+        report = load_test.run()
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+        if options["format"] == "json":
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for line in format_report(report["endpoints"]):
+            self.stdout.write(line)
+        mode = f"open loop at {report['offered_rate']:g}/s" if report["mode"] == "open" else "closed loop"
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['requests']} requests in {report['seconds']:.1f} s ({mode}, {report['concurrency']} clients): "
+            f"{report['throughput']:.1f}/s, {report['error_rate']:.2%} errors."
+        ))
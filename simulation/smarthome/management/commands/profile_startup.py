@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SETUP_SCRIPT = (
+    "import time; started = time.perf_counter(); import django; django.setup(); "
+    "print(time.perf_counter() - started)"
+)
+
+
+def summarize_importtime(lines: Iterable[str], groups: Dict[str, str]) -> List[Tuple[str, int, int]]:
+    """(group, self time in us, modules) per group of `python -X importtime` output, slowest first.
+
+    `groups` maps packages (Django app modules) to the name shown; a module belongs to the
+    longest of them it is part of, otherwise to its top-level package.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, module = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        parts = module.strip().split(".")
+        packages = (".".join(parts[:end]) for end in range(len(parts), 0, -1))
+        total = totals[next((groups[package] for package in packages if package in groups), parts[0])]
+        total[0] += int(self_us)
+        total[1] += 1
+    return sorted(((name, us, count) for name, (us, count) in totals.items()), key=lambda row: -row[1])
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the start of a fresh process: django.setup() time and the import time "
+        "(python -X importtime) spent in every app and top-level package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=15, help="number of packages listed")
+
+    def handle(self, *args, **options):
+        environment = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        environment.setdefault("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", SETUP_SCRIPT],
+            capture_output=True, text=True, env=environment, cwd=settings.BASE_DIR,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        groups = {config.name: config.label for config in apps.get_app_configs()}
+        rows = summarize_importtime(result.stderr.splitlines(), groups)
+        imports_us = sum(us for _, us, _ in rows)
+        setup_s = float(result.stdout.strip().splitlines()[-1])
+        self.stdout.write(f"django.setup(): {setup_s * 1000:.0f} ms, imports: {imports_us / 1000:.0f} ms "
+                          f"in {sum(count for _, _, count in rows)} modules")
+        self.stdout.write(f"{'package':<32}{'self ms':>10}{'share':>8}{'modules':>9}")
+        for name, us, count in rows[:options["top"]]:
+            self.stdout.write(f"{name:<32}{us / 1000:>10.1f}{us / imports_us:>8.1%}{count:>9}")
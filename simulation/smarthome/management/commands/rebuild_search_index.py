@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+from smarthome.search_backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Index every raport of the database again. On Elasticsearch this puts the index templates, "
+        "drops the monthly raport indices (and the single indices of the old layout) and fills them."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt in {time.perf_counter() - started:.1f} s."))
@@ -0,0 +1,59 @@
+import json
+
+from benchmarks.load import transport_factory
+from benchmarks.replay import ScenarioReplay, read_toggles, scenario_files
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the device toggles of scenario raports files through the device endpoint, faster than recorded, "
+        "with concurrent clients, and report ingest throughput and latency percentiles. Raports get the recorded "
+        "times through the X-Virtual-Time header: against --base-url the server needs VIRTUAL_TIME_ENABLED=true; "
+        "without it requests run in this process against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", metavar="path",
+                            help="raports files or generate_scenario directories (devices must exist)")
+        parser.add_argument("--speedup", type=float, default=10000.0, help="scenario seconds per wall second")
+        parser.add_argument("--clients", type=int, default=8)
+        parser.add_argument("--base-url", help="e.g. http://localhost:8000; in process by default")
+        parser.add_argument("--limit", type=int, help="replay only the first toggles")
+        parser.add_argument("--format", choices=("text", "json"), default="text")
+
+    def handle(self, *args, **options):
+        if options["speedup"] <= 0 or options["clients"] < 1:
+            raise CommandError("The speed-up and the number of clients must be positive.")
+        try:
+            toggles = read_toggles([path for argument in options["paths"] for path in scenario_files(argument)])
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error))
+        except ObjectDoesNotExist as error:
+            raise CommandError(f"{error or 'Unknown user or building'} (load the scenario first)")
+        toggles = toggles[:options["limit"]]
+
+        replay = ScenarioReplay(toggles, transport_factory(options["base_url"]), options["speedup"], options["clients"])
+        if options["base_url"]:
+            result = replay.run()
+        else:
+            with override_settings(VIRTUAL_TIME_ENABLED=True):
+                result = replay.run()
+
+        if options["format"] == "json":
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+        if not result["toggles"]:
+            self.stdout.write(self.style.WARNING("No toggles to replay."))
+            return
+        for name in ("request_latency", "end_to_end_latency"):
+            summary = result[name]
+            self.stdout.write(f"{name.replace('_', ' ')}: p50 {summary['p50_ms']:.1f} ms, p95 {summary['p95_ms']:.1f} ms, "
+                              f"p99 {summary['p99_ms']:.1f} ms, max {summary['max_ms']:.1f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {result['toggles']} toggles ({result['errors']} errors) with {result['clients']} clients in "
+            f"{result['seconds']:.1f} s: {result['throughput']:.0f} toggles/s, {result['achieved_speedup']:.0f}x real time "
+            f"({result['requested_speedup']:.0f}x requested)."
+        ))
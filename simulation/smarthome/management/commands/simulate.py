@@ -0,0 +1,95 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from smarthome.costs import photovoltaic_factors
+from smarthome.models import Building
+from smarthome.models_calculators import EnergyStorageCalculator
+from smarthome.simulator import simulate_buildings
+from synthetic import SyntheticDataGenerator
+from synthetic.engine import Fleet, SimulationSink, TickSimulator
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def synthetic_fleet(generator: SyntheticDataGenerator, buildings: int) -> Fleet:
+    specifications = []
+    for index in range(buildings):
+        devices = list(generator.devices(index))
+        specifications.append({
+            "receivers": [(device["name"], device["device_power"]) for device in devices if device["type"] == "EnergyReceiver"],
+            "generation_power": sum(device["generation_power"] for device in devices if device["type"] == "EnergyGenerator"),
+            "storage_capacity_kwh": sum(device["capacity"] * device["battery_voltage"] / 1000
+                                        for device in devices if device["type"] == "EnergyStorage"),
+        })
+    return Fleet.from_specifications(specifications)
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate buildings in fixed time steps: receivers switch on and off following the schedules of their kind, "
+        "PV follows the weather raports and batteries store the surplus. Sessions are written as device raports "
+        "and battery levels as charge state raports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start-date", type=parse_date, required=True, help=f"format {DATE_FORMAT!r}")
+        parser.add_argument("--days", type=float, default=1.0)
+        parser.add_argument("--building", type=int, action="append", help="building id (repeatable), all by default")
+        parser.add_argument("--step-minutes", type=float, default=5.0)
+        parser.add_argument("--checkpoint-minutes", type=float, default=60.0, help="spacing of charge state raports")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--dry-run", action="store_true", default=False, help="simulate without writing raports")
+        parser.add_argument("--synthetic-buildings", type=int,
+                            help="simulate this many generated buildings with generated weather instead of the "
+                                 "database ones (implies --dry-run)")
+
+    def handle(self, *args, **options):
+        start_date = options["start_date"]
+        end_date = start_date + timedelta(days=options["days"])
+        step = timedelta(minutes=options["step_minutes"])
+        if step <= timedelta(0) or end_date <= start_date:
+            raise CommandError("The step and the number of days must be positive.")
+
+        started = time.perf_counter()
+        if options["synthetic_buildings"]:
+            result = self.simulate_synthetic(options["synthetic_buildings"], start_date, end_date, step, options["seed"])
+            buildings_count = options["synthetic_buildings"]
+        else:
+            buildings = Building.objects.order_by("pk")
+            if options["building"]:
+                buildings = buildings.filter(pk__in=options["building"])
+            buildings = list(buildings)
+            if not buildings:
+                raise CommandError("No buildings to simulate.")
+            result = simulate_buildings(buildings, start_date, end_date, step, options["seed"],
+                                        timedelta(minutes=options["checkpoint_minutes"]), write=not options["dry_run"])
+            buildings_count = len(buildings)
+        elapsed = time.perf_counter() - started
+
+        totals = result["totals"]
+        self.stdout.write(f"{buildings_count} buildings x {result['ticks']} ticks of {step}: "
+                          f"{result['sessions']} sessions, {result['charge_states']} charge states")
+        self.stdout.write(f"per building (kWh): load {totals['load'].mean():.2f}, generation {totals['generation'].mean():.2f}, "
+                          f"import {totals['import'].mean():.2f}, export {totals['export'].mean():.2f}")
+        speed = (end_date - start_date).total_seconds() / elapsed if elapsed else float("inf")
+        self.stdout.write(self.style.SUCCESS(f"Simulated {end_date - start_date} in {elapsed:.2f} s ({speed:,.0f}x real time)."))
+
+    @staticmethod
+    def simulate_synthetic(buildings: int, start_date: datetime, end_date: datetime, step: timedelta, seed: int):
+        generator = SyntheticDataGenerator(seed=seed, start=start_date)
+        simulator = TickSimulator(synthetic_fleet(generator, buildings), start_date, step, seed,
+                                  EnergyStorageCalculator.charging_current_factor,
+                                  EnergyStorageCalculator.charging_loss_factor)
+        ticks = int((end_date - start_date) / step)
+        rng = random.Random(seed)
+        radiation = np.array([generator.solar_radiation(simulator.tick_date(tick), rng) for tick in range(ticks)])
+        sink = SimulationSink()
+        totals = simulator.run(photovoltaic_factors(radiation), sink)
+        return {"ticks": ticks, "sessions": sink.sessions, "charge_states": sink.charge_states, "totals": totals}
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from smarthome import clock
+from smarthome.models import EnergyStorage
+from smarthome.soc import ChargeStateSimulator, write_checkpoints
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate the stored energy of energy storages from their charging and usage raports "
+        "and replace their charge states in the window with compacted checkpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start-date", type=parse_date, required=True, help=f"format {DATE_FORMAT!r}")
+        parser.add_argument("--end-date", type=parse_date, help="defaults to now")
+        parser.add_argument("--device", type=int, action="append", help="storage id (repeatable), all by default")
+        parser.add_argument("--resolution-minutes", type=int, default=15, help="checkpoint spacing")
+        parser.add_argument("--tolerance-kwh", type=float, default=0.01,
+                            help="smallest change of the stored energy written as a new checkpoint")
+
+    def handle(self, *args, **options):
+        end_date = options["end_date"] or clock.now()
+        if end_date <= options["start_date"]:
+            raise CommandError("The end date must be after the start date.")
+        storages = EnergyStorage.objects.order_by("pk")
+        if options["device"]:
+            storages = storages.filter(pk__in=options["device"])
+
+        simulator = ChargeStateSimulator()
+        step = timedelta(minutes=options["resolution_minutes"])
+        written_total, devices_total = 0, 0
+        for storage in storages:
+            if storage.capacity_kwh is None:
+                self.stdout.write(f"{storage.name} ({storage.id}): battery voltage unknown, skipped")
+                continue
+            series = simulator.simulate(storage, options["start_date"], end_date, step)
+            written = write_checkpoints(storage, series, options["tolerance_kwh"])
+            self.stdout.write(f"{storage.name} ({storage.id}): {written} checkpoints of {len(series.charge_kwh)} steps")
+            written_total += written
+            devices_total += 1
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written_total} charge states of {devices_total} storages."))
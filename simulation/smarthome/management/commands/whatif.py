@@ -0,0 +1,83 @@
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from django.core.management.base import BaseCommand, CommandError
+from smarthome.models import Building
+from smarthome.models_calculators import EnergyStorageCalculator
+from smarthome.simulator import whatif_inputs
+from smarthome.whatif import RANK_KEYS, parameter_grid, run_variants
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def parse_grid(values: List[str]) -> Dict[str, List[float]]:
+    grid = {}
+    for value in values or []:
+        name, separator, numbers = value.partition("=")
+        try:
+            grid[name.strip()] = [float(number) for number in numbers.split(",")]
+        except ValueError:
+            separator = ""
+        if not separator or not name.strip():
+            raise CommandError(f"Invalid --grid {value!r}, expected name=value,value,...")
+    return grid
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the recorded window of a building with other generation power, battery capacity or device powers "
+        "and rank the variants by cost or net grid energy. Variants are evaluated in parallel processes that share "
+        "the recorded arrays."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("building_id", type=int)
+        parser.add_argument("--start-date", type=parse_date, required=True, help=f"format {DATE_FORMAT!r}")
+        parser.add_argument("--end-date", type=parse_date, required=True, help=f"format {DATE_FORMAT!r}")
+        parser.add_argument("--grid", action="append",
+                            help="values of one parameter (repeatable): generation_power=W,..., capacity=Ah,... "
+                                 "or device_power:<receiver name>=W,...")
+        parser.add_argument("--step-minutes", type=float, default=15.0)
+        parser.add_argument("--workers", type=int, help="processes evaluating variants, all cores by default")
+        parser.add_argument("--rank", choices=RANK_KEYS, default="cost")
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--format", choices=("text", "json"), default="text")
+
+    def handle(self, *args, **options):
+        step = timedelta(minutes=options["step_minutes"])
+        if step <= timedelta(0) or options["end_date"] - options["start_date"] < step:
+            raise CommandError("The step must be positive and the window at least one step long.")
+        try:
+            building = Building.objects.get(pk=options["building_id"])
+        except Building.DoesNotExist:
+            raise CommandError(f"Building {options['building_id']} does not exist.")
+
+        started = time.perf_counter()
+        base, arrays = whatif_inputs(building, options["start_date"], options["end_date"], step)
+        try:
+            variants = parameter_grid(base, parse_grid(options["grid"]))
+        except ValueError as error:
+            raise CommandError(error)
+        results = run_variants(arrays, variants, step.total_seconds() / 3600,
+                               EnergyStorageCalculator.charging_current_factor,
+                               EnergyStorageCalculator.charging_loss_factor,
+                               workers=options["workers"], rank_by=options["rank"])
+        elapsed = time.perf_counter() - started
+        top = results[:options["top"]]
+
+        if options["format"] == "json":
+            self.stdout.write(json.dumps({"building": building.id, "variants": len(results), "rank": options["rank"],
+                                          "seconds": elapsed, "results": top}, indent=2))
+            return
+        for position, row in enumerate(top, 1):
+            parameters = ", ".join(f"{name}={row[name]:g}" for name in variants[0].parameters) or "base"
+            self.stdout.write(f"{position:>3}. {parameters}: cost {row['cost']:.2f}, net {row['net_energy']:.2f} kWh "
+                              f"(import {row['import']:.2f}, export {row['export']:.2f})")
+        self.stdout.write(self.style.SUCCESS(f"Evaluated {len(results)} variants of building {building.id} "
+                                             f"in {elapsed:.2f} s."))
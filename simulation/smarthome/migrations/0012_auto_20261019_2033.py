@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smarthome', '0011_auto_20220614_0835'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deviceraport',
+            index=models.Index(fields=['turned_on', 'id'], name='smarthome_d_turned__637d54_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='weatherraport',
+            index=models.Index(fields=['datetime_from', 'id'], name='smarthome_w_datetim_9b9544_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smarthome', '0012_auto_20261019_2033'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='building',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-19 20:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def point_devices_at_open_raports(apps, schema_editor):
+    Device = apps.get_model('smarthome', 'Device')
+    DeviceRaport = apps.get_model('smarthome', 'DeviceRaport')
+    for device in Device.objects.filter(state=True).iterator():
+        device.open_raport = DeviceRaport.objects.filter(device=device, turned_off__isnull=True).order_by('turned_on').last()
+        if device.open_raport is not None:
+            device.save(update_fields=['open_raport'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smarthome', '0013_building_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='open_raport',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='smarthome.deviceraport'),
+        ),
+        migrations.RunPython(point_devices_at_open_raports, migrations.RunPython.noop),
+    ]
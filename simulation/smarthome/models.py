@@ -1,9 +1,32 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Sequence
 
-from django.db import models
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Subquery
 from polymorphic.models import PolymorphicModel
 from users.models import User
 
+from . import clock
+
+
+def debounce_window(device_type: str) -> timedelta:
+    """Off-to-on gap below which two sessions of a device of this type are merged into one."""
+    windows = {name.lower(): seconds for name, seconds in settings.DEVICE_DEBOUNCE_SECONDS.items()}
+    return timedelta(seconds=windows.get(device_type.lower(), 0))
+
+
+def delete_rows(model, ids: Sequence[int]) -> int:
+    """DELETE rows by primary key in one statement, without signals: callers update the search index in bulk."""
+    if not ids:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(ids))})", list(ids))
+        return cursor.rowcount
+
 
 class Building(models.Model):
     name = models.CharField(max_length=100, null=True)
@@ -11,10 +34,19 @@ class Building(models.Model):
     user = models.ForeignKey(
         User, related_name="user_buildings", null=False, on_delete=models.CASCADE
     )
+    # bumped on every write that can change the energy of the building, see smarthome.caching
+    data_version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"Building: {str(self.id)} | name: {self.name}"
 
+    def save(self, *args, **kwargs):
+        # the version only moves forward in the database; a stale copy of the building must not write it back
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != "data_version"]
+        super().save(*args, **kwargs)
+
 class Room(models.Model):
     name = models.CharField(max_length=100, null=True)
     area = models.DecimalField(max_digits=4, decimal_places=1, null=False, blank=False)
@@ -34,11 +66,58 @@ class Device(PolymorphicModel):
     building = models.ForeignKey(
         Building, related_name="building_devices", on_delete=models.CASCADE
     )
+    # raport of the session started by the last switch on, set while the device is on
+    open_raport = models.OneToOneField(
+        "DeviceRaport", related_name="+", null=True, blank=True, editable=False, on_delete=models.SET_NULL
+    )
 
     @property
     def type(self):
         return self.__class__.__name__
 
+    def switch(self, state: bool, timestamp: datetime = None) -> bool:
+        """Turn the device on or off, opening or closing its session raport.
+
+        The state flips with a single conditional UPDATE, which also takes the row lock, so
+        concurrent toggles cannot both open or both close a session. Returns False when the
+        device already was in `state`. Switching on within the debounce window after the
+        last session ended reopens that session instead of starting a new one.
+        """
+        timestamp = timestamp or clock.now()
+        devices = Device.objects.non_polymorphic().filter(pk=self.pk)
+        with transaction.atomic():
+            if not devices.exclude(state=state).update(state=state):
+                self.state = state
+                return False
+            if state:
+                raport = self.debounced_raport(timestamp)
+                if raport is not None:
+                    raport.turned_off = None
+                    raport.save(update_fields=["turned_off"])
+                else:
+                    raport = DeviceRaport.objects.create(device_id=self.pk, turned_on=timestamp)
+                devices.update(open_raport=raport)
+                self.open_raport = raport
+            else:
+                raport = DeviceRaport.objects.filter(pk=Subquery(devices.values("open_raport_id"))).first()
+                if raport is not None:
+                    raport.turned_off = timestamp
+                    raport.save(update_fields=["turned_off"])
+                    devices.update(open_raport=None)
+                self.open_raport = None
+        self.state = state
+        return True
+
+    def debounced_raport(self, timestamp: datetime):
+        """Last session of the device if it ended less than the debounce window before `timestamp`."""
+        window = debounce_window(self.type)
+        if not window:
+            return None
+        raport = DeviceRaport.objects.filter(device_id=self.pk, turned_on__lte=timestamp).order_by("-turned_on").first()
+        if raport is not None and raport.turned_off is not None and timestamp - raport.turned_off < window:
+            return raport
+        return None
+
 
 class EnergyReceiver(Device):
     device_power = models.FloatField() 
@@ -62,9 +141,16 @@ class EnergyStorage(Device):
     def __str__(self):
         return f"Energy storing device: {str(self.id)} | name: {self.name}"
 
+    @property
+    def capacity_kwh(self):
+        """Energy of the full battery, None while the voltage is unknown."""
+        if not self.battery_voltage:
+            return None
+        return self.capacity * self.battery_voltage / 1000
+
     def save(self, *args, **kwargs):
         super(EnergyStorage, self).save(*args, **kwargs)
-        ChargeStateRaport.objects.create(device = self, charge_value = 0.0, date = datetime.now())
+        ChargeStateRaport.objects.create(device = self, charge_value = 0.0, date = clock.now())
 
 class DeviceRaport(models.Model):
     turned_on = models.DateTimeField()
@@ -75,6 +161,9 @@ class DeviceRaport(models.Model):
 
     class Meta:
         unique_together = ('device', 'turned_on',)
+        indexes = [
+            models.Index(fields=['turned_on', 'id']),
+        ]
 
 
     def __str__(self):
@@ -87,6 +176,11 @@ class WeatherRaport(models.Model):
     temperature = models.FloatField(null=True, blank=True)
     wind_speed = models.FloatField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['datetime_from', 'id']),
+        ]
+
     def __str__(self):
         return f"Weather raport: {str(self.id)}"
         
@@ -113,23 +207,30 @@ class StorageChargingAndUsageRaport(models.Model):
         return f"Storage charging and usage raport: {str(self.id)} | device: {self.device.name}"
 
     def save(self, *args, **kwargs):
-        try:
-            current_charge_value = ChargeStateRaport.objects.filter(device=self.device).last().charge_value
-        except AttributeError:
-            current_charge_value = 0
-        
+        last_state = ChargeStateRaport.objects.filter(
+            device=self.device, date__lte=self.date_time_from
+        ).order_by("date").last()
+        current_charge_value = last_state.charge_value if last_state is not None else 0.0
+
         if self.job_type == self.CHARGING:
             current_charge_value += self.energy_use
-            if current_charge_value > self.device.capacity:
+            capacity = self.device.capacity_kwh
+            if capacity is not None and current_charge_value > capacity:
                 raise ValueError("Energy in storage can't exceed 100%!")
 
-        if self.usage_type == self.USAGE:
+        if self.job_type == self.USAGE:
             current_charge_value -= self.energy_use
             if current_charge_value < 0:
                 raise ValueError("Energy in storage can't be less than 0!")
-        
-        ChargeStateRaport.objects.create(date=self.date_time_to, device=self.device, charge_valueme=self.current_state_value)
-        return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # a running job has no charge state yet
+            if self.date_time_to is not None:
+                ChargeStateRaport.objects.update_or_create(
+                    device=self.device, date=self.date_time_to,
+                    defaults={"charge_value": current_charge_value},
+                )
 
 class ChargeStateRaport(models.Model):
     date = models.DateTimeField()
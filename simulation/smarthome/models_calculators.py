@@ -1,16 +1,13 @@
 
 from abc import ABC
-from builtins import IndexError
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 
 from django.forms.models import model_to_dict
-from elasticsearch_dsl import Search
-from elasticsearch_dsl.query import Q
 
-from .documents import (ChargeStateDocument, DeviceRaportDocument,
-                        StorageChargingAndUsageDocument, WeatherDocument)
-from .models import ChargeStateRaport, Device
+from . import clock
+from .models import Device, StorageChargingAndUsageRaport
+from .search_backends import get_search_backend
 
 
 class DeviceCalculateManager():
@@ -27,69 +24,35 @@ class DeviceCalculateManager():
 class EnergyCalculator(ABC):
     """Abstract class that provides interface with methods for concrete energy calculators"""
 
-    # @staticmethod
-    # def filter_storage_raports_by_device_and_date(device: Device, start_date: datetime=None, end_date: datetime=None) -> Search:
-    #     if not end_date:
-    #         end_date = datetime.now()
-    #     raports = StorageChargingAndUsageDocument.search().query(Q('match', device__id=device.id) & Q('match', device__name=device.name))
-    #     query_filter = raports.filter(
-    #             Q("range", date_time_from={"gte": start_date, "lte": end_date}) |
-    #             Q("range", date_time_to={"gte": start_date, "lte": end_date}) |
-    #             Q(
-    #                 Q("range", date_time_from={"lt": start_date}) &
-    #                 Q("range",  date_time_to = {"gt": end_date})
-
-    #             ) |
-    #             Q(
-    #                 Q("range", date_time_from={"lt": end_date}) &
-    #                 ~Q("exists", field='date_time_to')
-    #             )
-    #     )
-    #     response = query_filter.execute()
-        
-    #     for raport in response:
-    #         if raport.date_time_to:
-    #             raport.date_time_to = end_date if raport.date_time_to > end_date else raport.date_time_to
-    #         else:
-    #             raport.date_time_to = end_date
-    #         raport.date_time_from = start_date if raport.date_time_from < start_date else raport.date_time_from
-    #     return response
+    @staticmethod
+    def filter_storage_raports_by_device_and_date(device: Device, start_date: datetime=None, end_date: datetime=None) -> List:
+        if not end_date:
+            end_date = clock.now()
+        response = list(get_search_backend().storage_raports(device, start_date, end_date))
+        for raport in response:
+            if raport.date_time_to:
+                raport.date_time_to = end_date if raport.date_time_to > end_date else raport.date_time_to
+            else:
+                raport.date_time_to = end_date
+            if start_date:
+                raport.date_time_from = start_date if raport.date_time_from < start_date else raport.date_time_from
+        return response
 
     @staticmethod
     def filter_charge_state_raports_by_device_and_get_last_charge_state(device: Device, end_date: datetime=None) -> float:
         if not end_date:
-            end_date = datetime.now()
-        raports = ChargeStateDocument.search().query(Q('match', device__id=device.id) & Q('match', device__name=device.name))
-        raports = raports.filter(
-                Q("range", date={"lt": end_date})
-        )
-        raports = raports.sort({"date" : {"order" : "asc"}})
-        try:
-            last_charge_state = raports.execute()[-1].charge_value #kwh
-        except IndexError:
+            end_date = clock.now()
+        last_raport = get_search_backend().last_charge_state(device, end_date)
+        if last_raport is None:
             raise ValueError('There were not any energy storage in the building at selected time.')
             # moze sie zdazyc, ze storage stworzono 15go maja, wiec dla zapytania o stan z 14go maja nie ma wynikow.
-        return last_charge_state
+        return last_raport.charge_value #kwh
 
     @staticmethod
-    def filter_raports_by_device_and_date(device: Device, start_date: datetime, end_date: datetime = None) -> Search:
+    def filter_raports_by_device_and_date(device: Device, start_date: datetime, end_date: datetime = None) -> List:
         if not end_date:
-            end_date = datetime.now()
-        raports = DeviceRaportDocument.search().query(Q('match', device__id=device.id) & Q('match', device__name=device.name))
-        query_filter = raports.filter(
-                Q("range", turned_on={"gte": start_date, "lte": end_date}) |
-                Q("range", turned_off={"gte": start_date, "lte": end_date}) |
-                Q(
-                    Q("range", turned_on={"lt": start_date}) &
-                    Q("range",  turned_off = {"gt": end_date})
-
-                ) |
-                Q(
-                    Q("range", turned_on={"lt": end_date}) &
-                    ~Q("exists", field='turned_off')
-                )
-        )
-        response = query_filter.execute()
+            end_date = clock.now()
+        response = list(get_search_backend().device_raports(device, start_date, end_date))
         for raport in response:
             if raport.turned_off:
                 raport.turned_off = end_date if raport.turned_off > end_date else raport.turned_off
@@ -98,24 +61,10 @@ class EnergyCalculator(ABC):
             raport.turned_on = start_date if raport.turned_on < start_date else raport.turned_on
         return response
     
-    def _filter_weather_raports_by_date(self, start_date: datetime=None, end_date: datetime = None) -> Search:
+    def _filter_weather_raports_by_date(self, start_date: datetime=None, end_date: datetime = None) -> List:
         if not end_date:
-            end_date = datetime.now()
-        raports = WeatherDocument.search().extra(size=9999)
-        query_filter = raports.filter(
-                Q("range", datetime_from={"gte": start_date, "lte": end_date}) |
-                Q("range", datetime_to={"gte": start_date, "lte": end_date}) |
-                Q(
-                    Q("range", datetime_from={"lt": start_date}) &
-                    Q("range",  datetime_to = {"gt": end_date})
-
-                ) |
-                Q(
-                    Q("range", datetime_from={"lt": end_date}) &
-                    ~Q("exists", field='datetime_to')
-                )
-        )
-        response = query_filter.execute()
+            end_date = clock.now()
+        response = list(get_search_backend().weather_raports(start_date, end_date))
         for raport in response:
             if raport.datetime_to:
                 raport.datetime_to = end_date if raport.datetime_to > end_date else raport.datetime_to
@@ -139,12 +88,12 @@ class EnergyReceiverCalculator(EnergyCalculator):
             **self._calculate_energy_data(device, device_raports),
         }
 
-    def _calculate_energy_data(self, device: Device, device_raports: Search) -> Dict[str, float]:
+    def _calculate_energy_data(self, device: Device, device_raports: List) -> Dict[str, float]:
         """Calculate energy consumptioned by the device in a given time.
 
         Arguments:
         device -- instance of a device for calculating energy consumption for
-        device_raports -- device power raports filtered by elasticsearch 
+        device_raports -- device power raports filtered by the search backend 
         """
         sum_of_hours = 0.0
 
@@ -181,12 +130,12 @@ class EnergyGeneratorCalculator(EnergyCalculator):
             raise ValueError('Output power cannot be lower or greater than generator power.')
         return output_power
 
-    def _calculate_energy_data(self, device: Device, weather_raports: Search) -> Dict[str, float]:
+    def _calculate_energy_data(self, device: Device, weather_raports: List) -> Dict[str, float]:
         """Calculate energy generated by the device in a given time.
 
         Arguments:
         device -- instance of a device for calculating energy generation for
-        device_raports -- device power raports filtered by elasticsearch 
+        device_raports -- device power raports filtered by the search backend 
         """
         # TODO: Add rounding calculated values
         sum_of_energy_in_kwh = 0.0
@@ -208,14 +157,43 @@ class EnergyStorageCalculator(EnergyCalculator):
     charging_loss_factor = 0.05
 
     def get_device_energy_calculation(self, device: Device, start_date: datetime=None, end_date: datetime=None) -> dict:
-        # storage_raports = self.filter_storage_raports_by_device_and_date(device, start_date, end_date)
-        storage_raports = []
-        last_charge_state = self.filter_charge_state_raports_by_device_and_get_last_charge_state(device, end_date)
-        return {
+        return self.get_devices_energy_calculation([device], start_date, end_date)[0]
+
+    def get_devices_energy_calculation(self, devices: List[Device], start_date: datetime=None, end_date: datetime=None) -> List[dict]:
+        """Energy data of several storages with their charging and usage totals from one aggregation."""
+        if not end_date:
+            end_date = clock.now()
+        flows = self.calculate_flows(devices, [start_date, end_date])[0] if start_date else {}
+        return [{
             **model_to_dict(device),
-            **self._calculate_energy_data(device, storage_raports, last_charge_state, end_date),
+            **self._calculate_energy_data(
+                device, flows.get(device.id),
+                self.filter_charge_state_raports_by_device_and_get_last_charge_state(device, end_date), end_date
+            ),
+        } for device in devices]
+
+    @staticmethod
+    def calculate_flows(devices: List[Device], boundaries: List[datetime]) -> List[Dict[int, Dict[str, float]]]:
+        """Charging and usage energy (kWh) of every storage in each window between consecutive `boundaries`."""
+        return get_search_backend().storage_flows(devices, boundaries)
+
+    @staticmethod
+    def summarize_flows(device: Device, flows: Dict[str, float]) -> Dict[str, float]:
+        """Charged and discharged energy, throughput and equivalent full cycles (throughput / 2 x capacity)."""
+        charged = flows.get(StorageChargingAndUsageRaport.CHARGING, 0.0)
+        discharged = flows.get(StorageChargingAndUsageRaport.USAGE, 0.0)
+        throughput = charged + discharged
+        capacity = device.capacity_kwh
+        return {
+            "charged_energy": charged,
+            "discharged_energy": discharged,
+            "throughput": throughput,
+            "cycles": throughput / (2 * capacity) if capacity else None,
         }
 
-    def _calculate_energy_data(self, device: Device, storage_charging_and_usage_raport: Search, last_charge_state: float, end_date: datetime=None) -> Dict[str, float]:
+    def _calculate_energy_data(self, device: Device, flows: Dict[str, float], last_charge_state: float, end_date: datetime=None) -> Dict[str, float]:
         #simplified because management center calculates it anyway 
-        return {"energy": last_charge_state}
+        energy_data = {"energy": last_charge_state}
+        if flows is not None:
+            energy_data.update(self.summarize_flows(device, flows))
+        return energy_data
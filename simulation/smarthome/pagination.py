@@ -0,0 +1,125 @@
+import base64
+import json
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_ORDERING = ("id",)
+
+
+def encode_cursor(values: Sequence) -> str:
+    payload = [{"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def cursor_type(field: str) -> type:
+    """Type of the cursor value of an ordering field: ids are integers, the other keyset fields datetimes."""
+    return int if field == "id" or field.endswith("_id") else datetime
+
+
+def decode_cursor(cursor: str, ordering: Sequence[str]) -> Tuple:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError(cursor)
+        values = tuple(datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value for value in values)
+        if not all(isinstance(value, cursor_type(field)) and not isinstance(value, bool)
+                   for field, value in zip(ordering, values)):
+            raise ValueError(cursor)
+        return values
+    except (ValueError, TypeError, KeyError):
+        raise NotFound("Invalid cursor")
+
+
+def keyset_filter(ordering: Sequence[str], values: Sequence) -> Q:
+    """Rows strictly after `values` in ascending `ordering`: (a, b) > (va, vb).
+
+    The leading `a >= va` term lets the database start an index range scan at the cursor.
+    """
+    after = Q()
+    for position in reversed(range(len(ordering))):
+        equal = Q(**{field: value for field, value in zip(ordering[:position], values[:position])})
+        after = Q(**{f"{ordering[position]}__gt": values[position]}) & equal | after
+    return Q(**{f"{ordering[0]}__gte": values[0]}) & after
+
+
+class KeysetPagination(BasePagination):
+    """Keyset (seek) pagination with opaque cursors, so a page costs the same at any depth.
+
+    Lists stay unpaginated unless `page_size` or `cursor` is given. Views choose a unique,
+    indexed ordering with `keyset_ordering` (default: id).
+    """
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    cursor_query_param = "cursor"
+
+    def get_page_size(self, request) -> Optional[int]:
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except ValueError:
+                page_size = self.page_size
+            return max(1, min(page_size, self.max_page_size))
+        if self.cursor_query_param in request.query_params:
+            return self.page_size
+        return None
+
+    def get_cursor(self, request, ordering: Sequence[str]) -> Optional[Tuple]:
+        cursor = request.query_params.get(self.cursor_query_param)
+        return decode_cursor(cursor, ordering) if cursor else None
+
+    def _paginate(self, fetch: Callable[[Optional[Tuple], int], List], request, ordering: Sequence[str]) -> Optional[List]:
+        page_size = self.get_page_size(request)
+        if page_size is None:
+            return None
+        self.request = request
+        rows = list(fetch(self.get_cursor(request, ordering), page_size + 1))
+        self.page = rows[:page_size]
+        self.next_cursor = None
+        if len(rows) > page_size:
+            last = self.page[-1]
+            self.next_cursor = encode_cursor([getattr(last, field) for field in ordering])
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not isinstance(queryset, QuerySet):
+            return None
+        ordering = getattr(view, "keyset_ordering", DEFAULT_ORDERING)
+
+        def fetch(after, size):
+            page_queryset = queryset.order_by(*ordering)
+            if after:
+                page_queryset = page_queryset.filter(keyset_filter(ordering, after))
+            return page_queryset[:size]
+        return self._paginate(fetch, request, ordering)
+
+    def paginate_search(self, fetch: Callable[[Optional[Tuple], int], List], request, ordering: Sequence[str]):
+        """Paginate a search backend query; `fetch(after, size)` returns hits sorted by `ordering` after the cursor."""
+        return self._paginate(fetch, request, ordering)
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.next_cursor:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
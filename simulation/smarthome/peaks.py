@@ -0,0 +1,105 @@
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+from django.forms.models import model_to_dict
+
+from . import clock
+from .balance import Timeline, sweep
+from .costs import HOUR, Intervals, from_seconds, to_seconds
+from .models import Building, EnergyReceiver, Room
+from .models_calculators import EnergyCalculator
+
+
+def compress(timeline: Timeline) -> Timeline:
+    """Join consecutive segments of the same load."""
+    if not len(timeline.load_kw):
+        return timeline
+    keep = np.append(0, np.flatnonzero(np.diff(timeline.load_kw)) + 1)
+    return Timeline(np.append(timeline.times[keep], timeline.times[-1]), timeline.load_kw[keep], timeline.supply_kw[keep])
+
+
+def top_peaks(timeline: Timeline, count: int) -> List[Dict]:
+    """The `count` highest local maxima of the load, highest first (earliest first among equal ones)."""
+    timeline = compress(timeline)
+    load = timeline.load_kw
+    if not len(load):
+        return []
+    padded = np.concatenate(([-np.inf], load, [-np.inf]))
+    maxima = np.flatnonzero((load > padded[:-2]) & (load > padded[2:]) & (load > 0))
+    if len(maxima) > count:
+        maxima = maxima[np.argpartition(-load[maxima], count - 1)[:count]]
+    maxima = maxima[np.lexsort((maxima, -load[maxima]))]
+    return [{"start_date": from_seconds(timeline.times[index]), "end_date": from_seconds(timeline.times[index + 1]),
+             "power_kw": float(load[index])} for index in maxima]
+
+
+def load_duration_curve(timeline: Timeline, points: int) -> Dict[str, List[float]]:
+    """Load exceeded for a given number of hours of the window, at `points` evenly spaced durations."""
+    hours = timeline.hours
+    if not len(hours):
+        return {"hours": [], "power_kw": []}
+    order = np.argsort(-timeline.load_kw)
+    cumulative = np.cumsum(hours[order])
+    durations = np.linspace(0.0, cumulative[-1], points)
+    positions = np.minimum(np.searchsorted(cumulative, durations, side="right"), len(order) - 1)
+    return {"hours": durations.tolist(), "power_kw": timeline.load_kw[order][positions].tolist()}
+
+
+class PeakDemandCalculator:
+    """Coincident receiver power of a building: its peaks, load-duration curve and per-room share.
+
+    Sessions come from the search backend clipped to the window as for the energy endpoint;
+    sessions still running last until the end of the window.
+    """
+
+    def calculate(self, building: Building, start_date: datetime, end_date: datetime = None,
+                  top: int = 5, points: int = 100) -> Dict:
+        end_date = end_date or clock.now()
+        rooms = {room.id: room for room in Room.objects.filter(building=building)}
+        groups = [None, *rooms]
+        positions = {room_id: position for position, room_id in enumerate(groups)}
+        receivers = Intervals()
+        for device in building.building_devices.all():
+            if isinstance(device, EnergyReceiver):
+                for raport in EnergyCalculator.filter_raports_by_device_and_date(device, start_date, end_date):
+                    receivers.add(raport.turned_on, raport.turned_off, device.device_power / 1000,
+                                  positions[device.room_id])
+
+        starts, ends, power, owners = receivers.arrays()
+        window_start, window_end = to_seconds([start_date, end_date])
+        timeline = sweep([(starts, ends, power)], [], window_start, window_end)
+        peaks = top_peaks(timeline, top)
+        result = {
+            **model_to_dict(building),
+            "peak_power_kw": peaks[0]["power_kw"] if peaks else 0.0,
+            "peaks": peaks,
+            "average_power_kw": float((timeline.load_kw * timeline.hours).sum() / ((window_end - window_start) / HOUR))
+            if window_end > window_start else 0.0,
+            "load_duration_curve": load_duration_curve(timeline, points),
+            "rooms": [],
+        }
+
+        if peaks:
+            peak_time = to_seconds([peaks[0]["start_date"]])[0]
+            running = (starts <= peak_time) & (ends > peak_time)
+            at_peak = np.bincount(owners[running], power[running], minlength=len(groups))
+        else:
+            at_peak = np.zeros(len(groups))
+        # one stable sort groups the sessions by room; each room is swept on its own slice
+        order = np.argsort(owners, kind="stable")
+        bounds = np.searchsorted(owners[order], np.arange(len(groups) + 1))
+        for position, room_id in enumerate(groups):
+            selected = order[bounds[position]:bounds[position + 1]]
+            if not len(selected) and room_id is None:
+                continue
+            room_peaks = top_peaks(sweep([(starts[selected], ends[selected], power[selected])], [],
+                                         window_start, window_end), 1)
+            result["rooms"].append({
+                "id": room_id,
+                "name": rooms[room_id].name if room_id is not None else None,
+                "peak_power_kw": room_peaks[0]["power_kw"] if room_peaks else 0.0,
+                "peak_start_date": room_peaks[0]["start_date"] if room_peaks else None,
+                "power_at_building_peak_kw": float(at_peak[position]),
+            })
+        return result
@@ -0,0 +1,36 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline delimited JSON. Raport exports bypass it with a streaming response; it renders errors and small lists."""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        items = data if isinstance(data, list) else [data]
+        return "".join(json.dumps(item, cls=JSONEncoder) + "\n" for item in items).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """Comma separated values with a header built from the keys of the first row."""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        items = data if isinstance(data, list) else [data]
+        if not items:
+            return b""
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(items[0]), extrasaction="ignore")
+        writer.writeheader()
+        for item in items:
+            writer.writerow({key: JSONRenderer().render(value).decode() if isinstance(value, (dict, list)) else value
+                             for key, value in item.items()})
+        return output.getvalue().encode(self.charset)
@@ -0,0 +1,131 @@
+from typing import Callable, Dict, Iterable, List
+
+from django.db import transaction
+from synthetic.scenario import Scenario
+from users.models import User
+
+from .caching import bump_data_version
+from .models import (Building, DeviceRaport, EnergyGenerator, EnergyReceiver,
+                     EnergyStorage, Room, WeatherRaport)
+from .search_backends import get_search_backend
+
+DEVICE_MODELS = {
+    "EnergyReceiver": (EnergyReceiver, ("device_power", "supply_voltage")),
+    "EnergyGenerator": (EnergyGenerator, ("generation_power",)),
+    "EnergyStorage": (EnergyStorage, ("capacity", "battery_voltage")),
+}
+
+
+def get_or_create_user(email: str, name: str) -> User:
+    user = User.objects.filter(email=email).first()
+    if user is None:
+        # generated users do not log in
+        user = User(email=email, name=name)
+        user.set_unusable_password()
+        user.save()
+    return user
+
+
+def create_building(user: User, building: Dict, devices: Iterable[Dict]) -> Building:
+    """Building with the rooms and devices of generator (or scenario manifest) specifications."""
+    with transaction.atomic():
+        instance = Building.objects.create(user=user, name=building["name"], icon=building.get("icon", 0))
+        complete_building(instance, building, devices)
+    return instance
+
+
+def complete_building(instance: Building, building: Dict, devices: Iterable[Dict]):
+    """Create the rooms and devices of the specifications that `instance` does not have yet (by name)."""
+    rooms = {room.name: room for room in instance.building_rooms.all()}
+    for room in building.get("rooms", []):
+        if room["name"] not in rooms:
+            rooms[room["name"]] = Room.objects.create(building=instance, name=room["name"], area=room["area"])
+    existing = set(instance.building_devices.values_list("name", flat=True))
+    for device in devices:
+        if device["name"] in existing:
+            continue
+        model, fields = DEVICE_MODELS[device["type"]]
+        model.objects.create(building=instance, room=rooms.get(device.get("room")), name=device["name"],
+                             **{field: device[field] for field in fields})
+
+
+def get_or_create_building(user: User, building: Dict, devices: Iterable[Dict]) -> Building:
+    """The user's building of that name, completed with missing rooms and devices, or a new one.
+
+    The user's email and the building name are what identifies a building of a manifest, so loading
+    a manifest again (or after a load that stopped half way) creates no duplicates.
+    """
+    with transaction.atomic():
+        instance = Building.objects.select_for_update().filter(user=user, name=building["name"]).first()
+        if instance is None:
+            return create_building(user, building, devices)
+        complete_building(instance, building, devices)
+    return instance
+
+
+def create_from_manifest(users: List[Dict]) -> List[Building]:
+    """Users, buildings, rooms and devices of the "users" list of a scenario manifest.
+
+    Buildings the user already has are reused (see `get_or_create_building`), so a manifest can be loaded again.
+    """
+    buildings = []
+    for user in users:
+        owner = get_or_create_user(user["email"], user["name"])
+        for building in user["buildings"]:
+            buildings.append(get_or_create_building(owner, building, building["devices"]))
+    return buildings
+
+
+def bulk_create_stream(model, objects: Iterable, batch_size: int, progress: Callable[[int], None] = None) -> int:
+    """bulk_create `objects` in batches of `batch_size` as they are generated; `progress` gets the running count."""
+    written, batch = 0, []
+    for instance in objects:
+        batch.append(instance)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            written, batch = written + len(batch), []
+            if progress is not None:
+                progress(written)
+    model.objects.bulk_create(batch, ignore_conflicts=True)
+    return written + len(batch)
+
+
+def load_scenario(scenario: Scenario, batch_size: int = 5000) -> Dict[str, int]:
+    """Write a scenario straight into the database in batches, then index it and drop cached answers."""
+    generator = scenario.generator
+    buildings = []
+    for building_index in range(scenario.buildings):
+        user = scenario.user(building_index)
+        buildings.append(get_or_create_building(get_or_create_user(user["email"], user["name"]),
+                                                generator.building(building_index), generator.devices(building_index)))
+
+    def device_raports():
+        for building_index, building in enumerate(buildings):
+            devices = dict(building.building_devices.values_list("name", "id"))
+            for device in scenario.receivers(building_index):
+                for turned_on, turned_off in generator.sessions(building_index, device, scenario.sessions_per_device):
+                    yield DeviceRaport(device_id=devices[device["name"]], turned_on=turned_on, turned_off=turned_off)
+
+    # weather raports have no unique key, device raports skip conflicts on (device, turned_on)
+    loaded = set(WeatherRaport.objects.filter(datetime_from__gte=generator.start, datetime_from__lt=scenario.weather_end)
+                 .values_list("datetime_from", flat=True))
+    weather_raports = (
+        WeatherRaport(datetime_from=datetime_from, datetime_to=datetime_to, solar_radiation=solar_radiation,
+                      temperature=temperature, wind_speed=wind_speed)
+        for datetime_from, datetime_to, solar_radiation, temperature, wind_speed in generator.weather(scenario.weather_end)
+        if datetime_from not in loaded
+    )
+    counts = {
+        "users": scenario.users,
+        "buildings": len(buildings),
+        "device_raports": bulk_create_stream(DeviceRaport, device_raports(), batch_size),
+        "weather_raports": bulk_create_stream(WeatherRaport, weather_raports, batch_size),
+    }
+    # bulk inserts send no signals
+    building_ids = [building.id for building in buildings]
+    backend = get_search_backend()
+    backend.index(DeviceRaport.objects.filter(device__building_id__in=building_ids))
+    backend.index(WeatherRaport.objects.filter(datetime_from__gte=generator.start,
+                                               datetime_from__lt=scenario.weather_end))
+    bump_data_version()
+    return counts
@@ -0,0 +1,363 @@
+import threading
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import models
+from elasticsearch_dsl import A, MultiSearch, connections
+from elasticsearch_dsl.query import Q
+
+from .documents import (ChargeStateDocument, DeviceRaportDocument,
+                        StorageChargingAndUsageDocument, WeatherDocument)
+from .interval_tree import IntervalTree
+from .models import (ChargeStateRaport, Device, DeviceRaport,
+                     StorageChargingAndUsageRaport, WeatherRaport)
+
+EPOCH = datetime(1970, 1, 1)
+# windows of one storage flows query; on Elasticsearch every window is one search of a multi search
+MAX_FLOW_WINDOWS = 1000
+
+# energy_use of a storage job spread evenly over it, share within [params.start, params.end)
+STORAGE_FLOW_SCRIPT = """
+    long from = doc['date_time_from'].value.getMillis();
+    long to = doc['date_time_to'].size() == 0 ? params.open_end : doc['date_time_to'].value.getMillis();
+    long overlap = Math.min(to, params.end) - Math.max(from, params.start);
+    if (to <= from || overlap <= 0) { return 0; }
+    return doc['energy_use'].value * overlap / (to - from);
+"""
+
+
+def _millis(value: datetime) -> int:
+    return int((value - EPOCH).total_seconds() * 1000)
+
+
+def empty_storage_flows(device_ids: Iterable[int]) -> Dict[int, Dict[str, float]]:
+    return {device_id: {job_type: 0.0 for job_type, _ in StorageChargingAndUsageRaport.job_types}
+            for device_id in device_ids}
+
+
+class SearchBackend:
+    """Interface of the read path used by the energy calculators.
+
+    Overlap queries return every raport having any common point with [start_date, end_date];
+    raports without an end are treated as still lasting. Returned hits are fresh objects
+    the caller may modify. Given `after` (a (start, id) tuple) or `size`, device and storage
+    raports come sorted by (start, id), strictly after `after` and at most `size` of them.
+    """
+    sync_with_signals = False
+
+    def device_raports(self, device: Device, start_date: datetime, end_date: datetime,
+                       after: Tuple = None, size: int = None) -> Iterable:
+        raise NotImplementedError
+
+    def storage_raports(self, device: Device, start_date: datetime, end_date: datetime,
+                        after: Tuple = None, size: int = None) -> Iterable:
+        raise NotImplementedError
+
+    def weather_raports(self, start_date: datetime, end_date: datetime) -> Iterable:
+        raise NotImplementedError
+
+    def last_charge_state(self, device: Device, end_date: datetime) -> Optional[object]:
+        raise NotImplementedError
+
+    def storage_flows(self, devices: Iterable[Device], boundaries: List[datetime]) -> List[Dict[int, Dict[str, float]]]:
+        """kWh of the charging and usage jobs of the storages per window between consecutive `boundaries`.
+
+        Returns one {device id: {job type: kWh}} per window. The energy of a job is spread evenly
+        over it; jobs still running end at the last boundary. This default sums the raports
+        returned by `storage_raports`.
+        """
+        edges = np.array([(boundary - EPOCH).total_seconds() for boundary in boundaries])
+        open_end = boundaries[-1]
+        windows = [empty_storage_flows([device.id for device in devices]) for _ in boundaries[1:]]
+        for device in devices:
+            for raport in self.storage_raports(device, boundaries[0], open_end):
+                start = (raport.date_time_from - EPOCH).total_seconds()
+                end = ((raport.date_time_to or open_end) - EPOCH).total_seconds()
+                if end <= start:
+                    continue
+                overlaps = np.clip(np.minimum(end, edges[1:]) - np.maximum(start, edges[:-1]), 0, None)
+                for window, overlap in zip(windows, overlaps):
+                    if overlap:
+                        window[device.id][raport.job_type] += raport.energy_use * overlap / (end - start)
+        return windows
+
+    def index(self, instances: Iterable[models.Model]):
+        """Index rows changed without sending model signals (bulk statements)."""
+        raise NotImplementedError
+
+    def remove(self, instances: Iterable[models.Model]):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Index every row of every indexed model from the database."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Drop state kept by this process."""
+
+
+def _overlap_query(search, from_field: str, to_field: str, start_date: datetime, end_date: datetime):
+    return search.filter(
+            Q("range", **{from_field: {"gte": start_date, "lte": end_date}}) |
+            Q("range", **{to_field: {"gte": start_date, "lte": end_date}}) |
+            Q(
+                Q("range", **{from_field: {"lt": start_date}}) &
+                Q("range", **{to_field: {"gt": end_date}})
+
+            ) |
+            Q(
+                Q("range", **{from_field: {"lt": end_date}}) &
+                ~Q("exists", field=to_field)
+            )
+    )
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Queries the django-elasticsearch-dsl documents; the index is kept in sync by its signal processor.
+
+    Lookups are `term`/`range` filters (filter context, no scoring) over the monthly indices
+    covering the window, see `RaportDocument`.
+    """
+
+    DOCUMENTS = {
+        DeviceRaport: DeviceRaportDocument,
+        WeatherRaport: WeatherDocument,
+        StorageChargingAndUsageRaport: StorageChargingAndUsageDocument,
+        ChargeStateRaport: ChargeStateDocument,
+    }
+    REMOVE_BATCH_SIZE = 1000
+
+    @staticmethod
+    def _device_search(document, device: Device, start_date: datetime, end_date: datetime):
+        return document.search_window(start_date, end_date).filter("term", device__id=device.id)
+
+    @staticmethod
+    def _execute(search, from_field: str, after: Tuple = None, size: int = None):
+        if after is None and size is None:
+            return search.scan()
+        search = search.sort(from_field, "id").extra(size=size or 10000)
+        if after is not None:
+            start, pk = after
+            search = search.extra(search_after=[int((start - EPOCH).total_seconds() * 1000), pk])
+        return search.execute()
+
+    def device_raports(self, device, start_date, end_date, after=None, size=None):
+        search = self._device_search(DeviceRaportDocument, device, start_date, end_date)
+        search = _overlap_query(search, "turned_on", "turned_off", start_date, end_date)
+        return self._execute(search, "turned_on", after, size)
+
+    def storage_raports(self, device, start_date, end_date, after=None, size=None):
+        search = self._device_search(StorageChargingAndUsageDocument, device, start_date, end_date)
+        search = _overlap_query(search, "date_time_from", "date_time_to", start_date, end_date)
+        return self._execute(search, "date_time_from", after, size)
+
+    def weather_raports(self, start_date, end_date):
+        search = WeatherDocument.search_window(start_date, end_date)
+        return _overlap_query(search, "datetime_from", "datetime_to", start_date, end_date).scan()
+
+    def last_charge_state(self, device, end_date):
+        search = self._device_search(ChargeStateDocument, device, None, end_date)
+        search = search.filter(Q("range", date={"lt": end_date})).sort({"date": {"order": "desc"}})[:1]
+        response = search.execute()
+        return response[0] if response else None
+
+    def storage_flows(self, devices, boundaries):
+        """One aggregation (device id > job type > clipped energy sum) per window, sent as one multi search."""
+        device_ids = [device.id for device in devices]
+        if not device_ids:
+            return [{} for _ in boundaries[1:]]
+        multi_search = MultiSearch()
+        for start_date, end_date in zip(boundaries[:-1], boundaries[1:]):
+            search = StorageChargingAndUsageDocument.search_window(start_date, end_date).filter("terms", device__id=device_ids)
+            search = _overlap_query(search, "date_time_from", "date_time_to", start_date, end_date).extra(size=0)
+            energy = A("sum", script={"source": STORAGE_FLOW_SCRIPT, "params": {
+                "start": _millis(start_date), "end": _millis(end_date), "open_end": _millis(boundaries[-1]),
+            }})
+            search.aggs.bucket("devices", "terms", field="device.id", size=max(len(device_ids), 1)) \
+                .bucket("job_types", "terms", field="job_type", size=len(StorageChargingAndUsageRaport.job_types)) \
+                .metric("energy", energy)
+            multi_search = multi_search.add(search)
+
+        windows = []
+        for response in (multi_search.execute() if len(boundaries) > 1 else []):
+            flows = empty_storage_flows(device_ids)
+            for device_bucket in response.aggregations.devices.buckets:
+                for job_bucket in device_bucket.job_types.buckets:
+                    flows[device_bucket.key][job_bucket.key] = job_bucket.energy.value
+            windows.append(flows)
+        return windows
+
+    def _group_by_document(self, instances):
+        grouped = defaultdict(list)
+        for instance in instances:
+            document = self.DOCUMENTS.get(type(instance))
+            if document:
+                grouped[document].append(instance)
+        return grouped
+
+    def index(self, instances):
+        if isinstance(instances, models.QuerySet):
+            # stream large querysets (bulk loads) into a single bulk request
+            self.DOCUMENTS[instances.model]().update(instances.iterator())
+            return
+        for document, objects in self._group_by_document(instances).items():
+            document().update(objects)
+
+    def remove(self, instances):
+        # by id over all indices: callers may pass bare (pk only) instances whose index is unknown
+        for document, objects in self._group_by_document(instances).items():
+            ids = [instance.pk for instance in objects]
+            for start in range(0, len(ids), self.REMOVE_BATCH_SIZE):
+                document.search(index=document.index_name("*")).filter("terms", id=ids[start:start + self.REMOVE_BATCH_SIZE]).delete()
+
+    def rebuild(self):
+        connection = connections.get_connection()
+        for document in self.DOCUMENTS.values():
+            name = document._index._name
+            if connection.indices.exists(index=name) and not connection.indices.exists_alias(name=name):
+                # single index of the layout before monthly indices
+                connection.indices.delete(index=name)
+            connection.indices.delete(index=document.index_name("*"), ignore=[404])
+            document.save_template()
+            document().update(document().get_indexing_queryset())
+
+
+class MemoryBackend(SearchBackend):
+    """In-process index: one interval tree per device for device, storage and charge state raports and one for weather.
+
+    Loaded lazily from the database on first query and kept in sync through post_save/post_delete
+    signals, so it only sees writes made by this process. Meant for tests, benchmarks and
+    single-node deployments.
+    """
+    sync_with_signals = True
+
+    FIELDS = {
+        DeviceRaport: ("device_id", "turned_on", "turned_off", ("id", "device_id", "turned_on", "turned_off")),
+        StorageChargingAndUsageRaport: ("device_id", "date_time_from", "date_time_to",
+                                        ("id", "device_id", "job_type", "date_time_from", "date_time_to", "energy_use")),
+        ChargeStateRaport: ("device_id", "date", "date", ("id", "device_id", "date", "charge_value")),
+        WeatherRaport: (None, "datetime_from", "datetime_to",
+                        ("id", "datetime_from", "datetime_to", "solar_radiation", "temperature", "wind_speed")),
+    }
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._trees: Dict = {}
+        self._locations: Dict = {}
+
+    def _tree(self, model, group) -> IntervalTree:
+        key = (model, group)
+        if key not in self._trees:
+            self._trees[key] = IntervalTree()
+        return self._trees[key]
+
+    def _add(self, model, row: Dict):
+        group_field, from_field, to_field, _ = self.FIELDS[model]
+        group = row[group_field] if group_field else None
+        location = (model, row["id"])
+        previous = self._locations.get(location)
+        if previous is not None and previous != group:
+            self._tree(model, previous).remove(row["id"])
+        self._tree(model, group).add(row[from_field], row[to_field], row["id"], row)
+        self._locations[location] = group
+
+    def _discard(self, model, pk):
+        group = self._locations.pop((model, pk), None)
+        if (model, group) in self._trees:
+            self._trees[(model, group)].remove(pk)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._trees, self._locations = {}, {}
+            for model, (group_field, from_field, to_field, fields) in self.FIELDS.items():
+                rows = defaultdict(list)
+                for row in model.objects.values(*fields).iterator():
+                    group = row[group_field] if group_field else None
+                    rows[group].append((row[from_field], row[to_field], row["id"], row))
+                    self._locations[(model, row["id"])] = group
+                for group, items in rows.items():
+                    self._trees[(model, group)] = IntervalTree(items)
+            self._loaded = True
+
+    def _overlap(self, model, group, start_date, end_date, after=None, size=None) -> List[SimpleNamespace]:
+        self._ensure_loaded()
+        with self._lock:
+            tree = self._trees.get((model, group))
+            rows = tree.overlap(start_date or datetime.min, end_date, after, size) if tree else []
+        return [SimpleNamespace(**row) for row in rows]
+
+    def device_raports(self, device, start_date, end_date, after=None, size=None):
+        return self._overlap(DeviceRaport, device.id, start_date, end_date, after, size)
+
+    def storage_raports(self, device, start_date, end_date, after=None, size=None):
+        return self._overlap(StorageChargingAndUsageRaport, device.id, start_date, end_date, after, size)
+
+    def weather_raports(self, start_date, end_date):
+        return self._overlap(WeatherRaport, None, start_date, end_date)
+
+    def last_charge_state(self, device, end_date):
+        self._ensure_loaded()
+        with self._lock:
+            tree = self._trees.get((ChargeStateRaport, device.id))
+            row = tree.last_before(end_date) if tree else None
+        return SimpleNamespace(**row) if row else None
+
+    def index(self, instances):
+        with self._lock:
+            # not loaded yet: the rows are read with the rest on the first query
+            if not self._loaded:
+                return
+            for instance in instances:
+                model = type(instance)
+                if model in self.FIELDS:
+                    fields = self.FIELDS[model][3]
+                    self._add(model, {field: getattr(instance, field) for field in fields})
+
+    def remove(self, instances):
+        with self._lock:
+            if not self._loaded:
+                return
+            for instance in instances:
+                if type(instance) in self.FIELDS:
+                    self._discard(type(instance), instance.pk)
+
+    def rebuild(self):
+        with self._lock:
+            self.reset()
+            self._ensure_loaded()
+
+    def reset(self):
+        """Forget the index; it is loaded again from the database on the next query.
+
+        Writes rolled back after their post_save signal stay indexed until then.
+        """
+        with self._lock:
+            self._loaded = False
+            self._trees, self._locations = {}, {}
+
+
+BACKENDS = {
+    "elasticsearch": ElasticsearchBackend,
+    "memory": MemoryBackend,
+}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_search_backend() -> SearchBackend:
+    """Return the process-wide instance of the backend selected by `settings.SEARCH_BACKEND`."""
+    name = settings.SEARCH_BACKEND
+    if name not in _instances:
+        with _instances_lock:
+            if name not in _instances:
+                _instances[name] = BACKENDS[name]()
+    return _instances[name]
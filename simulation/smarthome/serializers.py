@@ -1,8 +1,20 @@
+import math
+from datetime import timedelta
+
 from rest_framework import serializers
 from rest_polymorphic.serializers import PolymorphicSerializer
 
+from . import clock
+from .costs import MAX_COST_WINDOWS
+from .search_backends import MAX_FLOW_WINDOWS
 from .models import (Building, Device, DeviceRaport, EnergyGenerator, ChargeStateRaport,
                      EnergyReceiver, EnergyStorage, Room, StorageChargingAndUsageRaport, WeatherRaport)
+from .storage_optimizer import MAX_SCHEDULE_CELLS, MAX_SCHEDULE_STEPS, StorageScheduleCalculator
+
+# the charge-state endpoint simulates at this base step, up to a leap year per request
+CHARGE_STATE_BASE_STEP = timedelta(minutes=1)
+MAX_CHARGE_STATE_STEPS = 366 * 24 * 60
+MAX_CHARGE_STATE_RESOLUTION_MINUTES = 7 * 24 * 60
 
 
 class EnergyGeneratorSerializer(serializers.ModelSerializer):
@@ -102,5 +114,66 @@ class DatesRangeSerializer(serializers.Serializer):
     end_date = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", input_formats=['%Y-%m-%d %H:%M:%S'], required=False)
 
 
+class CostQuerySerializer(DatesRangeSerializer):
+    step_hours = serializers.IntegerField(min_value=1, required=False)
+    max_windows = MAX_COST_WINDOWS
+
+    def validate(self, attrs):
+        step_hours = attrs.get("step_hours")
+        if step_hours:
+            window = (attrs.get("end_date") or clock.now()) - attrs["start_date"]
+            windows = math.ceil(window / timedelta(hours=step_hours))
+            if windows > self.max_windows:
+                raise serializers.ValidationError(
+                    f"The window splits into {windows} windows of {step_hours} h; at most {self.max_windows} are "
+                    f"allowed. Shorten the window or use longer steps."
+                )
+        return attrs
+
+
+class StorageFlowsQuerySerializer(CostQuerySerializer):
+    max_windows = MAX_FLOW_WINDOWS
+
+
+class StorageScheduleQuerySerializer(DatesRangeSerializer):
+    step_minutes = serializers.IntegerField(min_value=1, default=15)
+    levels = serializers.IntegerField(min_value=2, max_value=1000, default=40)
+
+    def validate(self, attrs):
+        steps, levels = StorageScheduleCalculator.schedule_size(
+            attrs["start_date"], attrs.get("end_date") or clock.now(), timedelta(minutes=attrs["step_minutes"]),
+            attrs["levels"],
+        )
+        if steps > MAX_SCHEDULE_STEPS or steps * levels > MAX_SCHEDULE_CELLS:
+            raise serializers.ValidationError(
+                f"The schedule would have {steps} steps of {levels} levels; at most {MAX_SCHEDULE_STEPS} steps and "
+                f"{MAX_SCHEDULE_CELLS} steps x levels are allowed. Shorten the window or use longer steps."
+            )
+        return attrs
+
+
+class PeakQuerySerializer(DatesRangeSerializer):
+    top = serializers.IntegerField(min_value=1, max_value=100, default=5)
+    points = serializers.IntegerField(min_value=2, max_value=1000, default=100)
+
+
+class ChargeStateQuerySerializer(DatesRangeSerializer):
+    resolution_minutes = serializers.IntegerField(min_value=1, max_value=MAX_CHARGE_STATE_RESOLUTION_MINUTES, default=60)
+
+    def validate(self, attrs):
+        steps = ((attrs.get("end_date") or clock.now()) - attrs["start_date"]) / CHARGE_STATE_BASE_STEP
+        if steps > MAX_CHARGE_STATE_STEPS:
+            raise serializers.ValidationError(
+                f"The window covers {steps:.0f} simulation steps of {CHARGE_STATE_BASE_STEP}; at most "
+                f"{MAX_CHARGE_STATE_STEPS} are allowed. Shorten the window."
+            )
+        return attrs
+
+
+class DeviceSwitchSerializer(serializers.Serializer):
+    state = serializers.BooleanField()
+    type = serializers.ChoiceField(choices=[model.__name__ for model in DeviceSerializer.model_serializer_mapping], required=False)
+
+
 class EndDateSerializer(serializers.Serializer):
     end_date = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", input_formats=['%Y-%m-%d %H:%M:%S'])
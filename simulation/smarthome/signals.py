@@ -1,66 +1,60 @@
-# signals.py
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-
-from django_elasticsearch_dsl.registries import registry
-
-
-@receiver(post_save)
-def update_document(sender, **kwargs):
-    app_label = sender._meta.app_label
-    model_name = sender._meta.model_name
-    instance = kwargs['instance']
-
-    if app_label == 'device_raports':
-        if model_name == 'DeviceRaport':
-            instances = instance.device_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-    if app_label == 'weather_raports':
-        if model_name == 'WeatherRaport':
-            instances = instance.weather_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-    if app_label == 'storage_charging_and_usage_raports':
-        if model_name == 'StorageChargingAndUsageRaport':
-            instances = instance.storage_charging_and_usage_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-    if app_label == 'charge_state_raports':
-        if model_name == 'ChargeStateRaport':
-            instances = instance.charge_state_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-@receiver(post_delete)
-def delete_document(sender, **kwargs):
-    app_label = sender._meta.app_label
-    model_name = sender._meta.model_name
-    instance = kwargs['instance']
-
-    if app_label == 'device_raports':
-        if model_name == 'DeviceRaport':
-            instances = instance.device_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-    if app_label == 'weather_raports':
-        if model_name == 'WeatherRaport':
-            instances = instance.weather_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-    if app_label == 'storage_charging_and_usage_raports':
-        if model_name == 'StorageChargingAndUsageRaport':
-            instances = instance.storage_charging_and_usage_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
-
-    if app_label == 'charge_state_raports':
-        if model_name == 'ChargeStateRaport':
-            instances = instance.charge_state_raport.all()
-            for _instance in instances:
-                registry.update(_instance)
+from django.db.models.signals import post_delete, post_save
+
+from .caching import bump_data_version, bump_device_data_version
+from .models import (Building, ChargeStateRaport, DeviceRaport,
+                     EnergyGenerator, EnergyReceiver, EnergyStorage, Room,
+                     StorageChargingAndUsageRaport, WeatherRaport)
+from .search_backends import get_search_backend
+
+INDEXED_MODELS = (DeviceRaport, WeatherRaport, StorageChargingAndUsageRaport, ChargeStateRaport)
+DEVICE_MODELS = (EnergyReceiver, EnergyGenerator, EnergyStorage)
+DEVICE_RAPORT_MODELS = (DeviceRaport, StorageChargingAndUsageRaport, ChargeStateRaport)
+
+
+def update_document(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend.sync_with_signals:
+        backend.index([instance])
+
+
+def delete_document(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend.sync_with_signals:
+        backend.remove([instance])
+
+
+def bump_device_building(sender, instance, **kwargs):
+    bump_device_data_version(instance.device_id)
+
+
+def bump_building(sender, instance, **kwargs):
+    bump_data_version([instance.building_id])
+
+
+def bump_saved_building(sender, instance, **kwargs):
+    bump_data_version([instance.pk])
+
+
+def bump_all_buildings(sender, instance, **kwargs):
+    bump_data_version()
+
+
+for model in INDEXED_MODELS:
+    post_save.connect(update_document, sender=model, dispatch_uid=f"search_update_{model.__name__}")
+    post_delete.connect(delete_document, sender=model, dispatch_uid=f"search_delete_{model.__name__}")
+
+for model in DEVICE_RAPORT_MODELS:
+    post_save.connect(bump_device_building, sender=model, dispatch_uid=f"data_version_save_{model.__name__}")
+    post_delete.connect(bump_device_building, sender=model, dispatch_uid=f"data_version_delete_{model.__name__}")
+
+for model in DEVICE_MODELS:
+    post_save.connect(bump_building, sender=model, dispatch_uid=f"data_version_save_{model.__name__}")
+    post_delete.connect(bump_building, sender=model, dispatch_uid=f"data_version_delete_{model.__name__}")
+
+# cached answers include the building and the names of its rooms
+post_save.connect(bump_saved_building, sender=Building, dispatch_uid="data_version_save_Building")
+post_save.connect(bump_building, sender=Room, dispatch_uid="data_version_save_Room")
+post_delete.connect(bump_building, sender=Room, dispatch_uid="data_version_delete_Room")
+
+post_save.connect(bump_all_buildings, sender=WeatherRaport, dispatch_uid="data_version_save_WeatherRaport")
+post_delete.connect(bump_all_buildings, sender=WeatherRaport, dispatch_uid="data_version_delete_WeatherRaport")
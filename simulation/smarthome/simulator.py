@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+from synthetic.engine import Fleet, SimulationSink, TickSimulator
+
+from .caching import bump_data_version
+from .costs import (Intervals, load_price_series, photovoltaic_factors,
+                    to_seconds, window_integrals)
+from .models import (Building, ChargeStateRaport, DeviceRaport,
+                     EnergyGenerator, EnergyReceiver, EnergyStorage)
+from .models_calculators import (EnergyCalculator, EnergyGeneratorCalculator,
+                                 EnergyStorageCalculator)
+from .search_backends import get_search_backend
+from .whatif import BaseBuilding
+
+# voltage of the what-if batteries of a building that has none
+DEFAULT_BATTERY_VOLTAGE = 48.0
+
+
+class FleetLayout:
+    """Maps the rows and columns of a fleet back to the devices of the buildings."""
+
+    def __init__(self, buildings: List[Building]):
+        self.buildings = buildings
+        self.receiver_ids: List[List[int]] = []
+        # (storage id, share of the building's capacity) per building
+        self.storages: List[List[Tuple[int, float]]] = []
+
+    def fleet(self, start_date: datetime) -> Fleet:
+        specifications = []
+        for building in self.buildings:
+            devices = list(building.building_devices.all())
+            receivers = [device for device in devices if isinstance(device, EnergyReceiver)]
+            storages = [device for device in devices if isinstance(device, EnergyStorage) and device.capacity_kwh]
+            capacity = sum(storage.capacity_kwh for storage in storages)
+            initial = 0.0
+            for storage in storages:
+                last_state = get_search_backend().last_charge_state(storage, start_date)
+                if last_state is not None:
+                    initial += min(last_state.charge_value, storage.capacity_kwh)
+            self.receiver_ids.append([receiver.id for receiver in receivers])
+            self.storages.append([(storage.id, storage.capacity_kwh / capacity) for storage in storages])
+            specifications.append({
+                "receivers": [(receiver.name, receiver.device_power) for receiver in receivers],
+                "generation_power": sum(device.generation_power for device in devices if isinstance(device, EnergyGenerator)),
+                "storage_capacity_kwh": capacity,
+                "storage_initial_kwh": initial,
+            })
+        return Fleet.from_specifications(specifications)
+
+
+def weather_factors(start_date: datetime, step: timedelta, ticks: int) -> np.ndarray:
+    """kW per W of generation power at the start of every tick from the weather raports (0 without weather)."""
+    end_date = start_date + step * ticks
+    raports = sorted(get_search_backend().weather_raports(start_date, end_date), key=lambda raport: raport.datetime_from)
+    if not raports:
+        return np.zeros(ticks)
+    times = to_seconds([start_date])[0] + np.arange(ticks) * step.total_seconds()
+    starts = to_seconds([raport.datetime_from for raport in raports])
+    ends = to_seconds([raport.datetime_to or end_date for raport in raports])
+    radiation = np.array([raport.solar_radiation for raport in raports], dtype=float)
+    index = np.maximum(np.searchsorted(starts, times, side="right") - 1, 0)
+    covered = (starts[index] <= times) & (ends[index] > times)
+    return np.where(covered, photovoltaic_factors(radiation[index]), 0.0)
+
+
+class DatabaseSink(SimulationSink):
+    """Writes simulated sessions as DeviceRaports and battery levels as ChargeStateRaports in batches."""
+
+    def __init__(self, simulator: TickSimulator, layout: FleetLayout, batch_size: int = 5000):
+        super().__init__()
+        self.simulator = simulator
+        self.layout = layout
+        self.batch_size = batch_size
+        self.pending_raports: List[DeviceRaport] = []
+        self.pending_states: List[ChargeStateRaport] = []
+
+    def add_sessions(self, buildings, receivers, on_ticks, off_ticks):
+        super().add_sessions(buildings, receivers, on_ticks, off_ticks)
+        tick_date = self.simulator.tick_date
+        self.pending_raports.extend(
+            DeviceRaport(device_id=self.layout.receiver_ids[building][receiver],
+                         turned_on=tick_date(int(on_tick)), turned_off=tick_date(int(off_tick)))
+            for building, receiver, on_tick, off_tick in zip(buildings, receivers, on_ticks, off_ticks)
+        )
+        if len(self.pending_raports) >= self.batch_size:
+            self.flush()
+
+    def add_charge_states(self, tick, stored_kwh):
+        date = self.simulator.tick_date(tick)
+        states = [ChargeStateRaport(device_id=storage_id, date=date, charge_value=float(stored_kwh[building] * share))
+                  for building, storages in enumerate(self.layout.storages) for storage_id, share in storages]
+        self.charge_states += len(states)
+        self.pending_states.extend(states)
+        if len(self.pending_states) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        DeviceRaport.objects.bulk_create(self.pending_raports, batch_size=self.batch_size, ignore_conflicts=True)
+        ChargeStateRaport.objects.bulk_create(self.pending_states, batch_size=self.batch_size, ignore_conflicts=True)
+        self.pending_raports, self.pending_states = [], []
+
+    def close(self):
+        self.flush()
+
+
+def simulate_buildings(buildings: List[Building], start_date: datetime, end_date: datetime,
+                       step: timedelta = timedelta(minutes=5), seed: int = 0, checkpoint: timedelta = timedelta(hours=1),
+                       write: bool = True) -> Dict:
+    """Simulate the buildings from their devices and the recorded weather; optionally store the raports."""
+    layout = FleetLayout(buildings)
+    simulator = TickSimulator(layout.fleet(start_date), start_date, step, seed,
+                              EnergyStorageCalculator.charging_current_factor, EnergyStorageCalculator.charging_loss_factor)
+    ticks = int((end_date - start_date) / step)
+    sink = DatabaseSink(simulator, layout) if write else SimulationSink()
+    totals = simulator.run(weather_factors(start_date, step, ticks), sink, max(1, int(checkpoint / step)))
+    if write:
+        # bulk inserts send no signals: index the window of the simulated devices and drop cached answers
+        window_end = simulator.tick_date(ticks)
+        building_ids = [building.id for building in buildings]
+        backend = get_search_backend()
+        backend.index(DeviceRaport.objects.filter(device__building_id__in=building_ids, turned_on__gte=start_date,
+                                                  turned_on__lte=window_end))
+        backend.index(ChargeStateRaport.objects.filter(device__building_id__in=building_ids, date__gte=start_date,
+                                                       date__lte=window_end))
+        bump_data_version(building_ids)
+    return {"ticks": ticks, "sessions": sink.sessions, "charge_states": sink.charge_states, "totals": totals}
+
+
+def whatif_inputs(building: Building, start_date: datetime, end_date: datetime,
+                  step: timedelta) -> Tuple[BaseBuilding, Dict[str, np.ndarray]]:
+    """The building and its recorded window as the per step arrays of `whatif.evaluate_variant`.
+
+    Receiver sessions become hours on per step and receiver, the weather kWh per W of generation
+    power; prices are the mean market prices per step, zeros when the market file is unusable.
+    """
+    boundaries = to_seconds([start_date])[0] + np.arange(int((end_date - start_date) / step) + 1) * step.total_seconds()
+    devices = list(building.building_devices.all())
+    receivers = [device for device in devices if isinstance(device, EnergyReceiver)]
+    storages = [device for device in devices if isinstance(device, EnergyStorage)]
+    window_end = start_date + step * (len(boundaries) - 1)
+
+    on_hours = np.zeros((len(boundaries) - 1, len(receivers)))
+    for column, receiver in enumerate(receivers):
+        sessions = Intervals()
+        for raport in EnergyCalculator.filter_raports_by_device_and_date(receiver, start_date, window_end):
+            sessions.add(raport.turned_on, raport.turned_off, 1.0, receiver.id)
+        starts, ends, ones, _ = sessions.arrays()
+        on_hours[:, column] = window_integrals(starts, ends, ones, boundaries)
+
+    weather = Intervals()
+    for raport in EnergyGeneratorCalculator()._filter_weather_raports_by_date(start_date, window_end):
+        weather.add(max(raport.datetime_from, start_date), raport.datetime_to, raport.solar_radiation, 0)
+    starts, ends, radiation, _ = weather.arrays()
+    covered = ends > starts
+    pv_kwh_per_watt = window_integrals(starts[covered], ends[covered], photovoltaic_factors(radiation[covered]), boundaries)
+
+    try:
+        prices = load_price_series()
+        buy, sell = prices.window_prices(boundaries), prices.window_prices(boundaries, feed_in=True)
+    except (OSError, ValueError):
+        buy = sell = np.zeros(len(boundaries) - 1)
+
+    voltage = next((storage.battery_voltage for storage in storages if storage.capacity_kwh), DEFAULT_BATTERY_VOLTAGE)
+    base = BaseBuilding(
+        generation_power=sum(device.generation_power for device in devices if isinstance(device, EnergyGenerator)),
+        # batteries of other voltages count as the Ah of the same energy at the first one's voltage
+        capacity=sum(storage.capacity_kwh or 0.0 for storage in storages) * 1000 / voltage,
+        battery_voltage=voltage,
+        receiver_names=[receiver.name for receiver in receivers],
+        receiver_power=[receiver.device_power for receiver in receivers],
+    )
+    return base, {"on_hours": on_hours, "pv_kwh_per_watt": pv_kwh_per_watt, "buy": buy, "sell": sell}
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from typing import List, NamedTuple
+
+import numpy as np
+from django.db import transaction
+
+from .arrays import clamped_cumsum
+from .caching import bump_device_data_version
+from .costs import Intervals, from_seconds, to_seconds, window_integrals
+from .models import (ChargeStateRaport, EnergyStorage,
+                     StorageChargingAndUsageRaport, delete_rows)
+from .models_calculators import EnergyStorageCalculator
+from .search_backends import get_search_backend
+
+
+class ChargeStateSeries(NamedTuple):
+    start_date: datetime
+    step: timedelta
+    # stored energy (kWh) at the end of every step
+    charge_kwh: np.ndarray
+
+    def dates(self) -> List[datetime]:
+        return [self.start_date + self.step * (index + 1) for index in range(len(self.charge_kwh))]
+
+
+class ChargeStateSimulator:
+    """Rebuilds the stored energy of a battery from its charging and usage raports.
+
+    `energy_use` of a raport is spread evenly over [date_time_from, date_time_to); charging stores
+    `1 - charging_loss_factor` of it. The series starts from the last charge state before the
+    window and is simulated at `base_step` and clamped at 0 and the capacity (Ah x V).
+    """
+
+    def __init__(self, base_step: timedelta = timedelta(minutes=1),
+                 loss_factor: float = EnergyStorageCalculator.charging_loss_factor):
+        self.base_step = base_step
+        self.loss_factor = loss_factor
+
+    def flows(self, device: EnergyStorage, boundaries: np.ndarray, start_date: datetime, end_date: datetime) -> np.ndarray:
+        """Energy stored (+) or taken (-) in every step."""
+        charging, usage = Intervals(), Intervals()
+        for raport in get_search_backend().storage_raports(device, start_date, end_date):
+            raport_start = max(raport.date_time_from, start_date)
+            raport_end = min(raport.date_time_to or end_date, end_date)
+            full_end = raport.date_time_to or end_date
+            hours = (full_end - raport.date_time_from).total_seconds() / 3600
+            if hours <= 0 or raport_end <= raport_start:
+                continue
+            power = raport.energy_use / hours
+            if raport.job_type == StorageChargingAndUsageRaport.CHARGING:
+                charging.add(raport_start, raport_end, power * (1 - self.loss_factor), 0)
+            else:
+                usage.add(raport_start, raport_end, power, 0)
+        starts, ends, power, _ = charging.arrays()
+        stored = window_integrals(starts, ends, power, boundaries)
+        starts, ends, power, _ = usage.arrays()
+        return stored - window_integrals(starts, ends, power, boundaries)
+
+    def simulate(self, device: EnergyStorage, start_date: datetime, end_date: datetime,
+                 step: timedelta = None) -> ChargeStateSeries:
+        """Series at `step` (a multiple of the base step), sampled at the end of every step."""
+        capacity = device.capacity_kwh
+        if capacity is None:
+            raise ValueError(f"Battery voltage of device {device.id} is unknown.")
+        step = step or self.base_step
+        ratio = step / self.base_step
+        if ratio != int(ratio) or ratio < 1:
+            raise ValueError(f"The step must be a multiple of {self.base_step}.")
+        base_steps = int((end_date - start_date) / step) * int(ratio)
+        if base_steps == 0:
+            return ChargeStateSeries(start_date, step, np.empty(0))
+
+        boundaries = to_seconds([start_date])[0] + np.arange(base_steps + 1) * self.base_step.total_seconds()
+        last_state = get_search_backend().last_charge_state(device, start_date)
+        initial = last_state.charge_value if last_state is not None else 0.0
+        charge = clamped_cumsum(self.flows(device, boundaries, start_date, from_seconds(boundaries[-1])),
+                                initial, capacity)
+        return ChargeStateSeries(start_date, step, charge[int(ratio) - 1::int(ratio)])
+
+
+def compact_checkpoints(series: ChargeStateSeries, tolerance_kwh: float) -> List[int]:
+    """Indexes of the steps to keep as checkpoints: every change of more than `tolerance_kwh` and the last step."""
+    kept, last = [], None
+    for index, value in enumerate(series.charge_kwh):
+        if last is None or abs(value - last) > tolerance_kwh:
+            kept.append(index)
+            last = value
+    if len(series.charge_kwh) and (not kept or kept[-1] != len(series.charge_kwh) - 1):
+        kept.append(len(series.charge_kwh) - 1)
+    return kept
+
+
+@transaction.atomic
+def write_checkpoints(device: EnergyStorage, series: ChargeStateSeries, tolerance_kwh: float,
+                      batch_size: int = 5000) -> int:
+    """Replace the charge states of the device within the series window with compacted checkpoints."""
+    dates = series.dates()
+    if not dates:
+        return 0
+    stale = ChargeStateRaport.objects.filter(device=device, date__gt=series.start_date, date__lte=dates[-1])
+    removed = list(stale.only("pk", "device_id", "date"))
+    # plain DELETE: removed rows leave the search index in one call below
+    for start in range(0, len(removed), batch_size):
+        delete_rows(ChargeStateRaport, [raport.pk for raport in removed[start:start + batch_size]])
+    ChargeStateRaport.objects.bulk_create([
+        ChargeStateRaport(device=device, date=dates[index], charge_value=float(series.charge_kwh[index]))
+        for index in compact_checkpoints(series, tolerance_kwh)
+    ], batch_size=batch_size)
+    written = ChargeStateRaport.objects.filter(device=device, date__gt=series.start_date, date__lte=dates[-1])
+    backend = get_search_backend()
+    backend.remove(removed)
+    backend.index(written)
+    bump_device_data_version(device.id)
+    return written.count()
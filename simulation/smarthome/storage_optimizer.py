@@ -0,0 +1,192 @@
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from django.forms.models import model_to_dict
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import clock
+from .costs import (BuildingCostCalculator, Intervals, PriceSeries,
+                    from_seconds, photovoltaic_factors, to_seconds,
+                    window_integrals)
+from .models import Building, EnergyGenerator, EnergyReceiver, EnergyStorage
+from .models_calculators import EnergyCalculator, EnergyStorageCalculator
+from .search_backends import get_search_backend
+
+MAX_LEVELS = 1000
+# bounds of one schedule request: a leap year at 15-minute steps, and time steps x levels (the int64 choices table)
+MAX_SCHEDULE_STEPS = 366 * 24 * 4
+MAX_SCHEDULE_CELLS = 5_000_000
+
+
+class Battery(NamedTuple):
+    capacity_kwh: float
+    # grid side limit of charging and discharging
+    max_power_kw: float
+    loss_factor: float
+    initial_kwh: float = 0.0
+
+
+class Dispatch(NamedTuple):
+    """Optimal schedule: stored energy at every step boundary and energy per step (kWh)."""
+    soc_kwh: np.ndarray
+    battery_kwh: np.ndarray  # drawn from (+) or given to (-) the building
+    grid_kwh: np.ndarray  # bought (+) or sold (-)
+    cost: float
+    cost_without_storage: float
+
+
+def grid_cost(grid_kwh: np.ndarray, buy: np.ndarray, sell: np.ndarray) -> np.ndarray:
+    return np.where(grid_kwh > 0, grid_kwh * buy, grid_kwh * sell)
+
+
+def level_count(battery: Battery, step_hours: float, levels: int = 40) -> int:
+    """Levels the stored energy is split into: at least `levels`, fine enough to move one level per step."""
+    max_stored = battery.max_power_kw * step_hours * (1 - battery.loss_factor)
+    return min(MAX_LEVELS, max(levels, math.ceil(battery.capacity_kwh / max_stored) if max_stored > 0 else levels))
+
+
+def optimize_dispatch(net_load_kwh: np.ndarray, buy: np.ndarray, sell: np.ndarray, battery: Battery,
+                      step_hours: float, levels: int = 40) -> Dispatch:
+    """Charge/discharge schedule minimizing the grid cost of `net_load_kwh` (consumption minus PV per step).
+
+    Dynamic programming over the stored energy discretized into at least `levels` steps, fine
+    enough for the battery to move at least one level per time step. Charging stores
+    `1 - loss_factor` of the energy drawn. Stage costs of every (time step, move) are computed
+    at once; the backward pass is one vectorized min-plus step over all levels per time step.
+    """
+    steps = len(net_load_kwh)
+    max_stored = battery.max_power_kw * step_hours * (1 - battery.loss_factor)
+    count = level_count(battery, step_hours, levels)
+    quantum = battery.capacity_kwh / count
+    charge_moves = int(max_stored / quantum + 1e-9)
+    discharge_moves = min(count, int(battery.max_power_kw * step_hours / quantum + 1e-9))
+    charge_moves = min(count, charge_moves)
+    moves = np.arange(-discharge_moves, charge_moves + 1)
+
+    stored = moves * quantum
+    battery_side = np.where(stored > 0, stored / (1 - battery.loss_factor), stored)
+    stage = grid_cost(net_load_kwh[:, None] + battery_side[None, :], buy[:, None], sell[:, None])
+
+    values = np.zeros(count + 1)
+    # window[i] holds the values of the levels reachable from level i, padded with inf past the limits
+    padded = np.full(count + len(moves), np.inf)
+    window = sliding_window_view(padded, len(moves))
+    totals = np.empty((count + 1, len(moves)))
+    choices = np.empty((steps, count + 1), dtype=np.intp)
+    for step in range(steps - 1, -1, -1):
+        padded[discharge_moves:discharge_moves + count + 1] = values
+        np.add(window, stage[step], out=totals)
+        np.argmin(totals, axis=1, out=choices[step])
+        np.min(totals, axis=1, out=values)
+
+    level = min(count, max(0, round(battery.initial_kwh / quantum)))
+    path = np.empty(steps + 1, dtype=np.intp)
+    path[0] = level
+    for step in range(steps):
+        level += choices[step, level] - discharge_moves
+        path[step + 1] = level
+
+    battery_kwh = battery_side[np.diff(path) + discharge_moves]
+    grid_kwh = net_load_kwh + battery_kwh
+    return Dispatch(
+        soc_kwh=path * quantum,
+        battery_kwh=battery_kwh,
+        grid_kwh=grid_kwh,
+        cost=float(grid_cost(grid_kwh, buy, sell).sum()),
+        cost_without_storage=float(grid_cost(net_load_kwh, buy, sell).sum()),
+    )
+
+
+class StorageScheduleCalculator:
+    """Schedules the energy storages of a building against its consumption, PV output and prices.
+
+    The storages are optimized as one battery (capacities and charging powers summed) and the
+    schedule is shared between them by capacity. Recorded weather stands in for the PV forecast.
+    """
+
+    def __init__(self, prices: PriceSeries = None):
+        self.costs = BuildingCostCalculator(prices)
+        self.prices = self.costs.prices
+
+    @staticmethod
+    def schedule_size(start_date: datetime, end_date: datetime, step: timedelta, levels: int = 40) -> Tuple[int, int]:
+        """Time steps and levels of a schedule; the charging power grows with the capacity, so neither depends on it."""
+        steps = max(0, math.ceil((end_date - start_date) / step))
+        unit = Battery(1.0, EnergyStorageCalculator.charging_current_factor, EnergyStorageCalculator.charging_loss_factor)
+        return steps, level_count(unit, step.total_seconds() / 3600, levels) + 1
+
+    @staticmethod
+    def battery(storages: List[EnergyStorage], start_date: datetime) -> Battery:
+        capacity = sum(storage.capacity_kwh for storage in storages)
+        initial = 0.0
+        for storage in storages:
+            last_state = get_search_backend().last_charge_state(storage, start_date)
+            if last_state is not None:
+                initial += min(last_state.charge_value, storage.capacity_kwh)
+        return Battery(
+            capacity_kwh=capacity,
+            max_power_kw=capacity * EnergyStorageCalculator.charging_current_factor,
+            loss_factor=EnergyStorageCalculator.charging_loss_factor,
+            initial_kwh=initial,
+        )
+
+    def net_load(self, devices, boundaries: np.ndarray, start_date: datetime, end_date: datetime) -> np.ndarray:
+        """Consumption minus PV output (kWh) in every step."""
+        receivers = Intervals()
+        for device in devices:
+            if isinstance(device, EnergyReceiver):
+                for raport in EnergyCalculator.filter_raports_by_device_and_date(device, start_date, end_date):
+                    receivers.add(raport.turned_on, raport.turned_off, device.device_power / 1000, device.id)
+        starts, ends, power, _ = receivers.arrays()
+        consumption = window_integrals(starts, ends, power, boundaries)
+
+        generation_power = sum(device.generation_power for device in devices if isinstance(device, EnergyGenerator))
+        if not generation_power:
+            return consumption
+        weather = Intervals()
+        for raport in self.costs.generator_calculator._filter_weather_raports_by_date(start_date, end_date):
+            weather.add(raport.datetime_from, raport.datetime_to, raport.solar_radiation, 0)
+        starts, ends, radiation, _ = weather.arrays()
+        factors = photovoltaic_factors(radiation) * generation_power
+        return consumption - window_integrals(starts, ends, factors, boundaries)
+
+    def calculate(self, building: Building, start_date: datetime, end_date: datetime = None,
+                  step: timedelta = timedelta(minutes=15), levels: int = 40) -> Dict:
+        end_date = end_date or clock.now()
+        devices = list(building.building_devices.all())
+        storages = [device for device in devices if isinstance(device, EnergyStorage) and device.capacity_kwh]
+        result = {
+            **model_to_dict(building),
+            "currency": self.prices.currency,
+            "storages": [],
+            "skipped_storages": [device.id for device in devices
+                                 if isinstance(device, EnergyStorage) and not device.capacity_kwh],
+        }
+        if not storages:
+            return result
+
+        boundaries = np.append(np.arange(to_seconds([start_date])[0], to_seconds([end_date])[0], step.total_seconds()),
+                               to_seconds([end_date]))
+        net_load = self.net_load(devices, boundaries, start_date, end_date)
+        battery = self.battery(storages, start_date)
+        dispatch = optimize_dispatch(net_load, self.prices.window_prices(boundaries),
+                                     self.prices.window_prices(boundaries, feed_in=True),
+                                     battery, step.total_seconds() / 3600, levels)
+        result.update({
+            "capacity_kwh": battery.capacity_kwh,
+            "cost": dispatch.cost,
+            "cost_without_storage": dispatch.cost_without_storage,
+            "savings": dispatch.cost_without_storage - dispatch.cost,
+            "storages": [{"id": storage.id, "name": storage.name, "capacity_kwh": storage.capacity_kwh,
+                          "share": storage.capacity_kwh / battery.capacity_kwh} for storage in storages],
+            "schedule": {
+                "start_date": from_seconds(boundaries[0]),
+                "step_minutes": step.total_seconds() / 60,
+                "soc_kwh": dispatch.soc_kwh[1:].tolist(),
+                "battery_kwh": dispatch.battery_kwh.tolist(),
+                "grid_kwh": dispatch.grid_kwh.tolist(),
+            },
+        })
+        return result
@@ -1,15 +1,57 @@
-from datetime import datetime
+import base64
+import io
+import json
+import os
+import random
+from datetime import datetime, timedelta
 
+import numpy as np
 import pytest
+from benchmarks.load import Transport, latency_summary
+from config.db_router import (PIN_COOKIE, PrimaryPinningMiddleware,
+                              ReplicaHealth, ReplicaRouter, read_from_replica,
+                              replica_health)
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
 from django.urls import reverse_lazy
+from elasticsearch_dsl.utils import AttrDict
+from file_readers import RaportsFileReader
 from mock import patch
 from rest_framework.test import APIClient
+from synthetic import SyntheticDataGenerator
+from synthetic.engine import Fleet, SimulationSink, TickSimulator
+from synthetic.scenario import MANIFEST_FILENAME, Scenario
 from users.models import User
 
-from .models import (Building, ChargeStateRaport, DeviceRaport,
-                     EnergyGenerator, EnergyReceiver, EnergyStorage,
+from .arrays import SharedArrays
+from .balance import sweep
+from .clock import FixedClock, use_clock
+from .costs import load_price_series
+from .documents import DeviceRaportDocument
+from .ingest import (MAX_EVENTS_PER_REQUEST, DeviceHistory, StateEvent,
+                     coalesce_sessions, plan_device_events)
+from .interval_tree import IntervalTree
+from .management.commands.profile_startup import summarize_importtime
+from .models import (Building, ChargeStateRaport, Device, DeviceRaport,
+                     EnergyGenerator, EnergyReceiver, EnergyStorage, Room,
                      StorageChargingAndUsageRaport, WeatherRaport)
+from .models_calculators import EnergyCalculator
+from .scenario import create_from_manifest
+from .search_backends import (ElasticsearchBackend, MemoryBackend,
+                              get_search_backend)
+from .simulator import simulate_buildings
+from .soc import clamped_cumsum
+from .storage_optimizer import Battery, optimize_dispatch
 from .views import BuildingEnergyView, BuildingStorageEnergyView
+from .whatif import (BaseBuilding, evaluate_variant, parameter_grid,
+                     run_variants)
+
+requires_postgresql = pytest.mark.skipif(connection.vendor != "postgresql", reason="COPY needs PostgreSQL")
+
 
 @pytest.mark.django_db
 class TestEnergy:
@@ -252,3 +294,1130 @@ class TestEnergy:
 
 
 
+
+
+class TestIntervalTree:
+
+    def test_overlap_matches_brute_force(self):
+        rng = random.Random(7)
+        intervals = {}
+        tree = IntervalTree()
+        minute = lambda value: datetime(2022, 3, 30) + timedelta(minutes=value)
+        for key in range(300):
+            start = minute(rng.randint(0, 1000))
+            end = None if rng.random() < 0.05 else start + timedelta(minutes=rng.randint(0, 50))
+            intervals[key] = (start, end)
+            tree.add(start, end, key, key)
+        for key in rng.sample(sorted(intervals), 100):
+            assert tree.remove(key)
+            del intervals[key]
+        for _ in range(200):
+            low = minute(rng.randint(0, 1000))
+            high = low + timedelta(minutes=rng.randint(0, 100))
+            expected = sorted(
+                key for key, (start, end) in intervals.items() if start <= high and (end is None or end >= low)
+            )
+            assert sorted(tree.overlap(low, high)) == expected
+            pages, after = [], None
+            while True:
+                page = tree.overlap(low, high, after=after, limit=7)
+                if not page:
+                    break
+                pages.extend(page)
+                after = (intervals[page[-1]][0], page[-1])
+            assert pages == tree.overlap(low, high)
+        assert len(tree) == 200
+
+    def test_last_before(self):
+        tree = IntervalTree([(10, 10, 1, "a"), (20, 20, 2, "b"), (30, 30, 3, "c")])
+        assert tree.last_before(10) is None
+        assert tree.last_before(25) == "b"
+        assert tree.last_before(31) == "c"
+
+
+@pytest.mark.django_db
+class TestMemorySearchBackend:
+
+    def test_backend_follows_model_signals(self):
+        backend = MemoryBackend()
+        user = User.objects.create(email="memory@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        device = EnergyReceiver.objects.create(building=building, name="bulb", state=False, device_power=60, supply_voltage=8)
+        hour_10 = datetime(2022, 3, 30, 10)
+        hour_12 = datetime(2022, 3, 30, 12)
+        DeviceRaport.objects.create(device=device, turned_on=hour_10, turned_off=hour_12)
+        assert len(backend.device_raports(device, hour_12, datetime(2022, 3, 30, 13))) == 1  # loaded from the database
+
+        with patch("smarthome.signals.get_search_backend", return_value=backend):
+            open_raport = DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, 14))
+            assert [raport.id for raport in backend.device_raports(device, datetime(2022, 3, 31), datetime(2022, 4, 1))] == [open_raport.id]
+            open_raport.delete()
+        assert backend.device_raports(device, datetime(2022, 3, 31), datetime(2022, 4, 1)) == []
+        assert backend.device_raports(device, datetime(2022, 3, 29), datetime(2022, 3, 30, 9)) == []
+
+
+
+class TestMonthlyIndices:
+
+    def actions(self, raport, action="index"):
+        return [(item["_op_type"], item["_index"]) for item in DeviceRaportDocument()._get_actions([raport], action)]
+
+    def test_raports_are_routed_by_start_month(self):
+        device = Device(pk=1, name="bulb")
+        raport = DeviceRaport(pk=7, device=device, turned_on=datetime(2021, 3, 30), turned_off=datetime(2021, 4, 2))
+        assert self.actions(raport) == [
+            ("delete", "device_raports-open"), ("delete", "device_raports-long"), ("index", "device_raports-2021.03"),
+        ]
+        raport.turned_off = None
+        assert self.actions(raport)[-1] == ("index", "device_raports-open")
+        raport.turned_off = datetime(2021, 6, 1)
+        assert self.actions(raport)[-1] == ("index", "device_raports-long")
+        assert [index for _, index in self.actions(raport, "delete")] == [
+            "device_raports-2021.03", "device_raports-open", "device_raports-long",
+        ]
+
+    def test_window_searches_only_covering_indices(self):
+        assert DeviceRaportDocument.window_indices(datetime(2021, 3, 5), datetime(2021, 4, 1)) == [
+            "device_raports-2021.02", "device_raports-2021.03", "device_raports-2021.04",
+            "device_raports-open", "device_raports-long",
+        ]
+        assert DeviceRaportDocument.window_indices(datetime(2010, 1, 1), datetime(2021, 1, 1)) == ["device_raports-*"]
+
+        search = ElasticsearchBackend._device_search(DeviceRaportDocument, Device(pk=3, name="bulb"), None, datetime(2021, 1, 1))
+        assert search.to_dict() == {"query": {"bool": {"filter": [{"term": {"device.id": 3}}]}}}
+
+
+class TestStartupProfile:
+
+    def test_import_times_are_grouped_by_app(self):
+        lines = [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 |   django.db",
+            "import time:        40 |        140 |     django.contrib.admin.sites",
+            "import time:        10 |         10 | smarthome.documents",
+            "import time:         5 |         15 | smarthome",
+            "some other stderr line",
+        ]
+        groups = {"django.contrib.admin": "admin", "smarthome": "smarthome"}
+        assert summarize_importtime(lines, groups) == [("django", 100, 1), ("admin", 40, 1), ("smarthome", 15, 2)]
+
+
+class TestReplicaRouting:
+    router = ReplicaRouter()
+
+    def handler(self, view, request):
+        return HttpResponse(self.router.db_for_read(DeviceRaport) or "default")
+
+    @patch.object(replica_health, "is_healthy", return_value=True)
+    def test_decorated_reads_go_to_healthy_replica(self, is_healthy):
+        handler = read_from_replica(self.handler)
+        assert handler(None, RequestFactory().get("/")).content == b"replica"
+        assert self.router.db_for_read(DeviceRaport) is None
+        assert self.router.db_for_write(DeviceRaport) == "default"
+
+        streamed = read_from_replica(lambda view, request: StreamingHttpResponse(
+            self.router.db_for_read(DeviceRaport) or "default" for _ in range(2)
+        ))
+        assert b"".join(streamed(None, RequestFactory().get("/")).streaming_content) == b"replicareplica"
+
+        pinned = RequestFactory().get("/")
+        pinned.COOKIES[PIN_COOKIE] = "1"
+        assert handler(None, pinned).content == b"default"
+        is_healthy.return_value = False
+        assert handler(None, RequestFactory().get("/")).content == b"default"
+
+    def test_lagging_replica_is_not_used(self, settings):
+        settings.REPLICA_LAG_CHECK_SECONDS = 0
+        health = ReplicaHealth()
+        with patch.dict(settings.DATABASES, {"replica": {}}):
+            with patch.object(ReplicaHealth, "lag", return_value=settings.REPLICA_MAX_LAG_SECONDS + 1):
+                assert not health.is_healthy()
+            with patch.object(ReplicaHealth, "lag", return_value=0.0):
+                assert health.is_healthy()
+            with patch.object(ReplicaHealth, "lag", return_value=None):
+                assert not health.is_healthy()
+
+    def test_writes_pin_client_to_primary(self, settings):
+        middleware = PrimaryPinningMiddleware(lambda request: HttpResponse(status=201))
+        with patch.dict(settings.DATABASES, {"replica": {}}):
+            assert PIN_COOKIE in middleware(RequestFactory().post("/")).cookies
+            assert PIN_COOKIE not in middleware(RequestFactory().get("/")).cookies
+
+@pytest.mark.django_db
+class TestRaportExport:
+    client = APIClient()
+
+    def setUpDeviceWithRaports(self):
+        user = User.objects.create(email="export@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        device = EnergyReceiver.objects.create(building=building, name="bulb", state=False, device_power=60, supply_voltage=8)
+        for hour in range(8, 12):
+            DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, hour), turned_off=datetime(2022, 3, 30, hour, 30))
+        return building, device
+
+    def test_device_raports_ndjson_export_is_streamed(self):
+        _, device = self.setUpDeviceWithRaports()
+        url = reverse_lazy('smarthome:device-raports', kwargs={'pk': device.id})
+        response = self.client.get(url, data={"start_date": "2022-03-30 09:15:00", "end_date": "2022-03-30 10:10:00", "format": "ndjson"})
+        assert response.status_code == 200
+        assert response.streaming
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        assert [row["turned_on"] for row in rows] == ["2022-03-30T09:00:00", "2022-03-30T10:00:00"]
+        assert rows[0]["device"] == device.id
+
+    def test_building_raports_csv_export(self):
+        building, device = self.setUpDeviceWithRaports()
+        url = reverse_lazy('smarthome:building-device-raports', kwargs={'pk': building.id})
+        response = self.client.get(url, data={"start_date": "2022-03-30 00:00:00", "end_date": "2022-03-31 00:00:00", "format": "csv"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        assert response["Content-Type"] == "text/csv"
+        assert lines[0] == "id,device,device__name,turned_on,turned_off"
+        assert len(lines) == 5
+        assert lines[1].split(",")[2:] == ["bulb", "2022-03-30 08:00:00", "2022-03-30 08:30:00"]
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+    client = APIClient()
+
+    def collect_pages(self, url, params):
+        response = self.client.get(url, data=params)
+        pages = [response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            pages.append(response.data["results"])
+        return pages
+
+    def test_devices_are_paginated_by_id(self):
+        user = User.objects.create(email="pages@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        devices = [
+            EnergyReceiver.objects.create(building=building, name=f"bulb{index}", device_power=60, supply_voltage=8)
+            for index in range(5)
+        ]
+        pages = self.collect_pages(reverse_lazy('smarthome:device-list'), {"page_size": 2})
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [device["id"] for page in pages for device in page] == [device.id for device in devices]
+
+    def test_device_raports_are_paginated_through_search_backend(self):
+        user = User.objects.create(email="pages@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        device = EnergyReceiver.objects.create(building=building, name="bulb", device_power=60, supply_voltage=8)
+        raports = [
+            DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, hour), turned_off=datetime(2022, 3, 30, hour, 30))
+            for hour in range(7)
+        ]
+        url = reverse_lazy('smarthome:device-raports', kwargs={'pk': device.id})
+        pages = self.collect_pages(url, {"start_date": "2022-03-30 01:10:00", "end_date": "2022-03-30 23:00:00", "page_size": 3})
+        assert [len(page) for page in pages] == [3, 3]
+        assert [raport["id"] for page in pages for raport in page] == [raport.id for raport in raports[1:]]
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse_lazy('smarthome:building-list'), data={"cursor": "not-a-cursor"})
+        assert response.status_code == 404
+        url = reverse_lazy('smarthome:weather-raports')
+        for values in (["x", 1], [{"dt": "2022-03-30T10:00:00"}, "1"], [{"dt": "2022-03-30T10:00:00"}, True]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            response = self.client.get(url, data={"start_date": "2022-03-30 00:00:00", "cursor": cursor})
+            assert response.status_code == 404
+
+
+@pytest.mark.django_db
+class TestConditionalCaching:
+    client = APIClient()
+    closed_window = {"start_date": "2022-03-30 00:00:00", "end_date": "2022-03-31 00:00:00"}
+
+    def setUpBuilding(self):
+        user = User.objects.create(email="cache@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        device = EnergyReceiver.objects.create(building=building, name="bulb", device_power=60, supply_voltage=8)
+        DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, 8), turned_off=datetime(2022, 3, 30, 9))
+        return building, device
+
+    def test_closed_window_is_answered_with_304_before_computation(self):
+        building, _ = self.setUpBuilding()
+        url = reverse_lazy('smarthome:energy', kwargs={'pk': building.id})
+        response = self.client.get(url, data=self.closed_window)
+        assert response.status_code == 200
+        assert "max-age=" in response["Cache-Control"]
+
+        with patch("smarthome.views.DeviceCalculateManager.get_device_energy") as get_device_energy:
+            response = self.client.get(url, data=self.closed_window, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+        get_device_energy.assert_not_called()
+
+    def test_raport_write_changes_etag(self):
+        building, device = self.setUpBuilding()
+        url = reverse_lazy('smarthome:device-raports', kwargs={'pk': device.id})
+        etag = self.client.get(url, data=self.closed_window)["ETag"]
+        DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, 10), turned_off=datetime(2022, 3, 30, 11))
+        response = self.client.get(url, data=self.closed_window, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        assert len(response.data) == 2
+
+    def test_building_and_room_changes_change_etag(self):
+        building, _ = self.setUpBuilding()
+        url = reverse_lazy('smarthome:energy', kwargs={'pk': building.id})
+        etag = self.client.get(url, data=self.closed_window)["ETag"]
+        stale = Building.objects.get(pk=building.pk)
+        building.name = "cottage"
+        building.save()
+        response = self.client.get(url, data=self.closed_window, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200 and response.data["name"] == "cottage"
+
+        stale.save()
+        room = Room.objects.create(building=building, name="kitchen", area=12)
+        etags = {etag, response["ETag"], self.client.get(url, data=self.closed_window)["ETag"]}
+        room.name = "hall"
+        room.save()
+        etags.add(self.client.get(url, data=self.closed_window)["ETag"])
+        assert len(etags) == 4
+
+    def test_open_window_is_not_cached(self):
+        building, _ = self.setUpBuilding()
+        url = reverse_lazy('smarthome:energy', kwargs={'pk': building.id})
+        response = self.client.get(url, data={"start_date": "2022-03-30 00:00:00"})
+        assert response.status_code == 200
+        assert not response.has_header("ETag")
+
+
+
+@pytest.mark.django_db
+class TestBuildingCost:
+    client = APIClient()
+    prices = {"currency": "PLN", "prices": [
+        {"datetime_from": "2022-03-30 10:00:00", "price": 1.0},
+        {"datetime_from": "2022-03-30 11:00:00", "price": 2.0, "feed_in_price": 0.5},
+        {"datetime_from": "2022-03-30 12:00:00", "price": 4.0},
+    ]}
+
+    def setUpPrices(self, tmp_path, settings):
+        path = tmp_path / "energy_market.json"
+        path.write_text(json.dumps(self.prices))
+        settings.ENERGY_MARKET_FILE = str(path)
+        return path
+
+    def setUpBuilding(self):
+        user = User.objects.create(email="cost@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        receiver = EnergyReceiver.objects.create(building=building, name="kettle", device_power=1000, supply_voltage=230)
+        generator = EnergyGenerator.objects.create(building=building, name="photovoltaics", generation_power=1000)
+        DeviceRaport.objects.create(device=receiver, turned_on=datetime(2022, 3, 30, 10, 30), turned_off=datetime(2022, 3, 30, 11, 30))
+        WeatherRaport.objects.create(datetime_from=datetime(2022, 3, 30, 11), datetime_to=datetime(2022, 3, 30, 12),
+                                     solar_radiation=500.0, temperature=10.0, wind_speed=3.0)
+        return building, receiver, generator
+
+    def test_cost_and_revenue_per_device_and_window(self, tmp_path, settings):
+        self.setUpPrices(tmp_path, settings)
+        building, receiver, generator = self.setUpBuilding()
+        url = reverse_lazy("smarthome:building-cost", kwargs={"pk": building.id})
+        response = self.client.get(url, data={"start_date": "2022-03-30 10:00:00", "end_date": "2022-03-30 12:00:00",
+                                              "step_hours": 1})
+        assert response.status_code == 200
+        devices = {device["id"]: device for device in response.data["building_devices"]}
+        assert devices[receiver.id]["energy"] == pytest.approx(1.0)
+        assert devices[receiver.id]["cost"] == pytest.approx(1.5)  # 0.5 h at 1.0 + 0.5 h at 2.0
+        assert devices[generator.id]["revenue"] == pytest.approx(0.2375)  # 0.475 kW for 1 h at 0.5
+        assert response.data["net"] == pytest.approx(0.2375 - 1.5)
+        assert response.data["currency"] == "PLN"
+        assert [(window["cost"], window["revenue"]) for window in response.data["windows"]] == [
+            pytest.approx((0.5, 0.0)), pytest.approx((1.0, 0.2375)),
+        ]
+
+    def test_prices_are_parsed_again_only_after_the_file_changed(self, tmp_path, settings):
+        path = self.setUpPrices(tmp_path, settings)
+        series = load_price_series()
+        assert load_price_series() is series
+        os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+        assert load_price_series() is not series
+
+    def test_too_many_windows_are_rejected(self):
+        building, _, _ = self.setUpBuilding()
+        response = self.client.get(reverse_lazy("smarthome:building-cost", kwargs={"pk": building.id}),
+                                   data={"start_date": "0001-01-01 00:00:00", "end_date": "2022-03-30 10:00:00",
+                                         "step_hours": 1})
+        assert response.status_code == 400
+
+    def test_missing_prices_file(self, tmp_path, settings):
+        settings.ENERGY_MARKET_FILE = str(tmp_path / "missing.json")
+        building, _, _ = self.setUpBuilding()
+        response = self.client.get(reverse_lazy("smarthome:building-cost", kwargs={"pk": building.id}),
+                                   data={"start_date": "2022-03-30 10:00:00"})
+        assert response.status_code == 503
+
+    def test_storage_schedule_moves_cheap_energy_to_expensive_hours(self, tmp_path, settings):
+        self.setUpPrices(tmp_path, settings)
+        building, _, _ = self.setUpBuilding()
+        # 10 Ah at 100 V = 1 kWh, charged with at most 0.1 kW
+        storage = EnergyStorage.objects.create(building=building, name="battery", capacity=10, battery_voltage=100)
+        url = reverse_lazy("smarthome:storage-schedule", kwargs={"pk": building.id})
+        response = self.client.get(url, data={"start_date": "2022-03-30 10:00:00", "end_date": "2022-03-30 13:00:00",
+                                              "step_minutes": 60})
+        assert response.status_code == 200
+        assert response.data["storages"][0]["id"] == storage.id
+        schedule = response.data["schedule"]
+        assert len(schedule["soc_kwh"]) == 3
+        assert schedule["battery_kwh"][0] > 0 and schedule["battery_kwh"][2] < 0  # bought at 1.0, used at 4.0
+        assert response.data["savings"] > 0
+
+    def test_storage_schedule_rejects_oversized_windows(self):
+        building, _, _ = self.setUpBuilding()
+        url = reverse_lazy("smarthome:storage-schedule", kwargs={"pk": building.id})
+        response = self.client.get(url, data={"start_date": "2022-01-01 00:00:00", "end_date": "2023-01-01 00:00:00",
+                                              "step_minutes": 1})
+        assert response.status_code == 400
+
+
+class TestStorageDispatch:
+
+    def test_dispatch_matches_hand_optimum(self):
+        net_load = np.array([1, 1, -2, -2, 3, 3.0]) * 0.25
+        buy = np.array([1, 1, 0.1, 0.1, 5, 5.0])
+        dispatch = optimize_dispatch(net_load, buy, buy * 0.5, Battery(1.0, 2.0, 0.0), step_hours=0.25, levels=4)
+        # surplus is stored while it is cheap and used in the two expensive steps
+        assert dispatch.soc_kwh.tolist() == [0, 0, 0, 0.5, 1.0, 0.5, 0]
+        assert dispatch.cost == pytest.approx(3.0)
+        assert dispatch.cost_without_storage == pytest.approx(7.95)
+
+    def test_limits_are_kept(self):
+        rng = np.random.default_rng(1)
+        net_load, buy = rng.normal(0, 1, 500), rng.random(500)
+        battery = Battery(capacity_kwh=5.0, max_power_kw=2.0, loss_factor=0.1, initial_kwh=2.5)
+        dispatch = optimize_dispatch(net_load, buy, buy * 0.5, battery, step_hours=0.5)
+        assert dispatch.soc_kwh[0] == pytest.approx(2.5)
+        assert dispatch.soc_kwh.min() >= 0 and dispatch.soc_kwh.max() <= 5.0 + 1e-9
+        assert np.abs(dispatch.battery_kwh).max() <= 2.0 * 0.5 + 1e-9
+        stored = np.diff(dispatch.soc_kwh)
+        assert np.allclose(np.where(stored > 0, stored / 0.9, stored), dispatch.battery_kwh)
+        assert dispatch.cost <= dispatch.cost_without_storage
+
+@pytest.mark.django_db
+class TestBuildingBalance:
+    client = APIClient()
+
+    def test_sweep_merges_overlapping_edges(self):
+        load = [(np.array([0.0, 1800.0]), np.array([3600.0, 3600.0]), np.array([1.0, 2.0]))]
+        supply = [(np.array([1800.0]), np.array([7200.0]), np.array([0.5]))]
+        timeline = sweep(load, supply, 0.0, 7200.0)
+        assert timeline.times.tolist() == [0.0, 1800.0, 3600.0, 7200.0]
+        assert timeline.load_kw.tolist() == [1.0, 3.0, 0.0]
+        assert timeline.net_kw.tolist() == [1.0, 2.5, -0.5]
+
+    def test_balance_endpoint(self):
+        user = User.objects.create(email="balance@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        receiver = EnergyReceiver.objects.create(building=building, name="heater", device_power=1000, supply_voltage=230)
+        DeviceRaport.objects.create(device=receiver, turned_on=datetime(2022, 3, 30, 8), turned_off=datetime(2022, 3, 30, 10))
+        EnergyGenerator.objects.create(building=building, name="pv", generation_power=1000)
+        WeatherRaport.objects.create(datetime_from=datetime(2022, 3, 30, 9), datetime_to=datetime(2022, 3, 30, 11),
+                                     solar_radiation=1000.0, temperature=10.0, wind_speed=2.0)
+        storage = EnergyStorage.objects.create(building=building, name="battery", capacity=10, battery_voltage=100)
+        ChargeStateRaport.objects.create(device=storage, date=datetime(2022, 3, 30, 7), charge_value=1.0)
+        StorageChargingAndUsageRaport.objects.create(
+            device=storage, job_type=StorageChargingAndUsageRaport.USAGE, energy_use=0.5,
+            date_time_from=datetime(2022, 3, 30, 10), date_time_to=datetime(2022, 3, 30, 10, 30),
+        )
+
+        url = reverse_lazy('smarthome:building-balance', kwargs={'pk': building.id})
+        response = self.client.get(url, {"start_date": "2022-03-30 08:00:00", "end_date": "2022-03-30 12:00:00"})
+        assert response.status_code == 200
+        data = response.data
+        # PV makes 0.95 kW from 9 to 11, the battery gives 1 kW from 10 to 10:30
+        assert data["generation"] == pytest.approx(1.9)
+        assert data["import"] == pytest.approx(1.05)
+        assert data["export"] == pytest.approx(1.45)
+        assert data["self_consumption"] == pytest.approx(0.95 / 2.4)
+        assert data["autarky"] == pytest.approx(0.95 / 2.0)
+        assert data["net_power"]["power_kw"] == pytest.approx([1.0, 0.05, -1.95, -0.95, 0.0])
+        assert data["net_power"]["dates"][2] == datetime(2022, 3, 30, 10)
+
+@pytest.mark.django_db
+class TestPeakDemand:
+    client = APIClient()
+
+    def test_peaks_curve_and_rooms(self):
+        user = User.objects.create(email="peaks@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        kitchen = Room.objects.create(building=building, name="kitchen", area=12)
+        living_room = Room.objects.create(building=building, name="living room", area=30)
+        kettle = EnergyReceiver.objects.create(building=building, room=kitchen, name="kettle", device_power=2000, supply_voltage=230)
+        lamp = EnergyReceiver.objects.create(building=building, room=living_room, name="lamp", device_power=100, supply_voltage=230)
+        tv = EnergyReceiver.objects.create(building=building, name="tv", device_power=200, supply_voltage=230)
+        for device, hours in ((kettle, [(8, 0, 8, 10), (18, 0, 18, 5)]), (lamp, [(7, 0, 23, 0)]), (tv, [(18, 0, 20, 0)])):
+            for on_hour, on_minute, off_hour, off_minute in hours:
+                DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, on_hour, on_minute),
+                                            turned_off=datetime(2022, 3, 30, off_hour, off_minute))
+
+        url = reverse_lazy('smarthome:building-peaks', kwargs={'pk': building.id})
+        response = self.client.get(url, {"start_date": "2022-03-30 00:00:00", "end_date": "2022-03-31 00:00:00",
+                                         "top": 3, "points": 3})
+        assert response.status_code == 200
+        data = response.data
+        assert [(peak["start_date"].hour, peak["power_kw"]) for peak in data["peaks"]] == \
+            [(18, pytest.approx(2.3)), (8, pytest.approx(2.1))]
+        assert data["load_duration_curve"]["hours"] == [0.0, 12.0, 24.0]
+        assert data["load_duration_curve"]["power_kw"] == pytest.approx([2.3, 0.1, 0.0])
+        rooms = {room["name"]: room for room in data["rooms"]}
+        assert rooms["kitchen"]["peak_power_kw"] == pytest.approx(2.0)
+        assert rooms["kitchen"]["power_at_building_peak_kw"] == pytest.approx(2.0)
+        assert rooms["living room"]["power_at_building_peak_kw"] == pytest.approx(0.1)
+        assert rooms[None]["power_at_building_peak_kw"] == pytest.approx(0.2)
+
+@pytest.mark.django_db
+class TestStorageFlows:
+    client = APIClient()
+    window = {"start_date": "2022-03-30 01:00:00", "end_date": "2022-03-30 04:00:00"}
+
+    def setUpStorage(self):
+        user = User.objects.create(email="flows@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        storage = EnergyStorage.objects.create(building=building, name="battery", capacity=10, battery_voltage=100)
+        StorageChargingAndUsageRaport.objects.create(
+            device=storage, job_type=StorageChargingAndUsageRaport.CHARGING, energy_use=0.4,
+            date_time_from=datetime(2022, 3, 30, 0), date_time_to=datetime(2022, 3, 30, 2),
+        )
+        StorageChargingAndUsageRaport.objects.create(
+            device=storage, job_type=StorageChargingAndUsageRaport.USAGE, energy_use=0.3,
+            date_time_from=datetime(2022, 3, 30, 3), date_time_to=datetime(2022, 3, 30, 4),
+        )
+        return building, storage
+
+    def test_totals_and_windows(self):
+        building, storage = self.setUpStorage()
+        url = reverse_lazy('smarthome:storage-flows', kwargs={'pk': building.id})
+        response = self.client.get(url, data={**self.window, "step_hours": 1})
+        assert response.status_code == 200
+        totals = response.data["building_devices"][0]
+        # half of the charging job falls into the window
+        assert totals["charged_energy"] == pytest.approx(0.2)
+        assert totals["discharged_energy"] == pytest.approx(0.3)
+        assert totals["cycles"] == pytest.approx(0.5 / 2)
+        assert [window["building_devices"][0]["throughput"] for window in response.data["windows"]] == \
+            pytest.approx([0.2, 0.0, 0.3])
+        response = self.client.get(url, data={"start_date": "2022-01-01 00:00:00", "end_date": "2023-01-01 00:00:00",
+                                              "step_hours": 1})
+        assert response.status_code == 400
+
+    def test_storage_energy_and_raports_views(self):
+        building, storage = self.setUpStorage()
+        response = self.client.get(reverse_lazy('smarthome:storage_energy', kwargs={'pk': building.id}), data=self.window)
+        assert response.status_code == 200
+        assert response.data["building_devices"][0]["energy"] == pytest.approx(0.4)
+        assert response.data["building_devices"][0]["discharged_energy"] == pytest.approx(0.3)
+        response = self.client.get(reverse_lazy('smarthome:device-raports', kwargs={'pk': storage.id}), data=self.window)
+        assert response.status_code == 200
+        assert len(response.data) == 2
+
+    def test_elasticsearch_aggregates_each_window(self):
+        _, storage = self.setUpStorage()
+        boundaries = [datetime(2022, 3, 30, 1), datetime(2022, 3, 30, 2), datetime(2022, 3, 30, 4)]
+        buckets = {"devices": {"buckets": [{"key": storage.id, "job_types": {"buckets": [
+            {"key": StorageChargingAndUsageRaport.USAGE, "energy": {"value": 0.3}},
+        ]}}]}}
+        with patch("smarthome.search_backends.MultiSearch.execute", autospec=True) as execute:
+            execute.side_effect = lambda multi_search: [AttrDict({"aggregations": buckets})] * len(multi_search._searches)
+            windows = ElasticsearchBackend().storage_flows([storage], boundaries)
+        body = execute.call_args[0][0]._searches[1].to_dict()
+        assert body["size"] == 0
+        assert body["aggs"]["devices"]["terms"]["field"] == "device.id"
+        assert body["aggs"]["devices"]["aggs"]["job_types"]["aggs"]["energy"]["sum"]["script"]["params"]["start"] == \
+            int((boundaries[1] - datetime(1970, 1, 1)).total_seconds() * 1000)
+        assert windows[1][storage.id] == {StorageChargingAndUsageRaport.CHARGING: 0.0, StorageChargingAndUsageRaport.USAGE: 0.3}
+
+class TestTickSimulator:
+
+    class RecordingSink(SimulationSink):
+        def __init__(self):
+            super().__init__()
+            self.recorded = []
+
+        def add_sessions(self, buildings, receivers, on_ticks, off_ticks):
+            super().add_sessions(buildings, receivers, on_ticks, off_ticks)
+            self.recorded.extend(zip(buildings.tolist(), receivers.tolist(), on_ticks.tolist(), off_ticks.tolist()))
+
+    def fleet(self):
+        return Fleet.from_specifications([
+            {"receivers": [("kettle_0", 2000), ("fridge_1", 150)], "generation_power": 4000, "storage_capacity_kwh": 5.0},
+            {"receivers": [("lamp", 60)]},
+        ])
+
+    def test_sessions_are_consistent_and_seeded(self):
+        runs = []
+        for _ in range(2):
+            sink = self.RecordingSink()
+            simulator = TickSimulator(self.fleet(), datetime(2022, 6, 1), timedelta(minutes=5), seed=7)
+            totals = simulator.run(np.full(288, 0.0005), sink)
+            runs.append((sink.recorded, totals))
+        recorded, totals = runs[0]
+        assert recorded == runs[1][0]
+        assert all(on < off <= 288 for _, _, on, off in recorded)
+        # padding column of the one-receiver building never switches on
+        assert not any(building == 1 and receiver > 0 for building, receiver, _, _ in recorded)
+        assert 0 <= totals["stored"][0] <= 5.0 and totals["stored"][1] == 0
+        energy = sum((off - on) * (2.0, 0.15)[receiver] / 12 for building, receiver, on, off in recorded if building == 0)
+        assert totals["load"][0] == pytest.approx(energy)
+        # the battery only adds its losses and what it kept to the grid balance
+        assert totals["import"][0] - totals["export"][0] >= totals["load"][0] - totals["generation"][0] - 1e-9
+
+
+@pytest.mark.django_db
+class TestSimulateCommand:
+
+    def test_writes_and_indexes_raports(self):
+        user = User.objects.create(email="simulate@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        kettle = EnergyReceiver.objects.create(building=building, name="kettle", device_power=2000, supply_voltage=230)
+        storage = EnergyStorage.objects.create(building=building, name="battery", capacity=100, battery_voltage=48)
+        start_date = datetime(2022, 6, 1)
+        result = simulate_buildings([building], start_date, start_date + timedelta(days=2), seed=1)
+
+        raports = DeviceRaport.objects.filter(device=kettle)
+        assert result["sessions"] == raports.count() > 0
+        assert ChargeStateRaport.objects.filter(device=storage, date__lt=datetime(2022, 6, 4)).count() == 49
+        hits = get_search_backend().device_raports(kettle, start_date, start_date + timedelta(days=2))
+        assert len(list(hits)) == raports.count()
+
+        output = io.StringIO()
+        call_command("simulate", "--start-date", "2022-06-01 00:00:00", "--synthetic-buildings", "3", stdout=output)
+        assert "3 buildings x 288 ticks" in output.getvalue()
+
+
+class TestWhatIf:
+    base = BaseBuilding(generation_power=4000, capacity=100, battery_voltage=50,
+                        receiver_names=["kettle", "fridge"], receiver_power=[2000, 150])
+
+    def arrays(self, steps=96):
+        rng = np.random.default_rng(5)
+        return {
+            "on_hours": rng.uniform(0, 0.25, (steps, 2)),
+            "pv_kwh_per_watt": np.maximum(np.sin(np.linspace(-np.pi, np.pi, steps)), 0) * 0.00025,
+            "buy": np.full(steps, 0.3),
+            "sell": np.full(steps, 0.1),
+        }
+
+    def test_grid_combines_parameters(self):
+        variants = parameter_grid(self.base, {"capacity": [0, 200], "device_power:kettle": [1000, 3000]})
+        assert len(variants) == 4
+        assert variants[3].capacity_kwh == 10.0
+        assert variants[3].receiver_power_kw.tolist() == [3.0, 0.15]
+        assert variants[0].generation_power == 4000
+        with pytest.raises(ValueError):
+            parameter_grid(self.base, {"device_power:oven": [1000]})
+
+    def test_battery_matches_step_loop(self):
+        arrays = self.arrays()
+        variant = parameter_grid(self.base, {})[0]
+        result = evaluate_variant(arrays, variant, 0.25, 0.1, 0.05)
+        stored, imported, exported = 0.0, 0.0, 0.0
+        limit = variant.capacity_kwh * 0.1 * 0.25
+        for on_hours, pv in zip(arrays["on_hours"], arrays["pv_kwh_per_watt"]):
+            net = on_hours @ variant.receiver_power_kw - pv * variant.generation_power
+            charged = min(max(-net, 0.0), limit, (variant.capacity_kwh - stored) / 0.95)
+            discharged = min(max(net, 0.0), limit, stored)
+            stored += charged * 0.95 - discharged
+            grid = net + charged - discharged
+            imported, exported = imported + max(grid, 0.0), exported + max(-grid, 0.0)
+        assert result["import"] == pytest.approx(imported)
+        assert result["export"] == pytest.approx(exported)
+        assert result["cost"] == pytest.approx(imported * 0.3 - exported * 0.1)
+
+    def test_shared_arrays_round_trip(self):
+        arrays = self.arrays(10)
+        shared = SharedArrays.create(arrays)
+        try:
+            attached = SharedArrays.attach(shared.spec)
+            for name, array in arrays.items():
+                assert np.array_equal(attached.arrays[name], array)
+            attached.close()
+        finally:
+            shared.close(unlink=True)
+
+    def test_pool_matches_inline_and_ranks(self):
+        arrays = self.arrays()
+        variants = parameter_grid(self.base, {"generation_power": [0, 4000, 8000], "capacity": [0, 100]})
+        inline = run_variants(arrays, variants, 0.25, 0.1, 0.05, workers=1, rank_by="net_energy")
+        pooled = run_variants(arrays, variants, 0.25, 0.1, 0.05, workers=2, rank_by="net_energy")
+        assert pooled == inline
+        assert [row["net_energy"] for row in inline] == sorted(row["net_energy"] for row in inline)
+        assert inline[0]["generation_power"] == 8000
+
+
+@pytest.mark.django_db
+class TestWhatIfCommand:
+
+    def test_ranks_variants_of_recorded_window(self):
+        user = User.objects.create(email="whatif@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        kettle = EnergyReceiver.objects.create(building=building, name="kettle", device_power=2000, supply_voltage=230)
+        DeviceRaport.objects.create(device=kettle, turned_on=datetime(2022, 6, 1, 12), turned_off=datetime(2022, 6, 1, 13))
+        arguments = [building.id, "--start-date", "2022-06-01 00:00:00", "--end-date", "2022-06-02 00:00:00",
+                     "--grid", "device_power:kettle=1000,2000", "--workers", "1", "--rank", "net_energy"]
+
+        output = io.StringIO()
+        call_command("whatif", *arguments, "--format", "json", stdout=output)
+        report = json.loads(output.getvalue())
+        assert report["variants"] == 2
+        assert [row["device_power:kettle"] for row in report["results"]] == [1000, 2000]
+        assert report["results"][1]["load"] == pytest.approx(2.0)
+
+        with pytest.raises(CommandError):
+            call_command("whatif", *arguments[:-4], "--grid", "device_power:oven=1000", stdout=io.StringIO())
+
+
+@pytest.mark.django_db
+class TestScenarioGenerator:
+
+    def scenario(self, chunk_size=7):
+        generator = SyntheticDataGenerator(seed=3, start=datetime(2022, 5, 1), receivers_per_building=4)
+        return Scenario(generator, users=2, buildings_per_user=2, sessions_per_device=20, weather_days=1,
+                        chunk_size=chunk_size)
+
+    def test_files_are_reproducible_and_readable(self, tmp_path):
+        counts = self.scenario().write(str(tmp_path / "first"))
+        self.scenario(chunk_size=1000).write(str(tmp_path / "second"))
+        assert counts == {"users": 2, "buildings": 4, "device_raports": 320, "weather_raports": 288}
+        for path in sorted((tmp_path / "first").rglob("*.json")):
+            assert path.read_bytes() == (tmp_path / "second" / path.relative_to(tmp_path / "first")).read_bytes()
+
+        reader = RaportsFileReader(tmp_path / "first" / "raports" / "building_3.json", chunk_size=64)
+        with reader:
+            raports = list(reader.iter_raports())
+        assert reader.header == {"building_name": "synthetic_building_3", "user_email": "synthetic_user_1@mail.com"}
+        assert len(raports) == 80 and raports[0][0] == "bulb_0"
+        weather = json.loads((tmp_path / "first" / "weather.json").read_text())
+        assert weather["2022-05-01 12:00:00"]["real"]["solar_radiation"] > 0
+
+        manifest = json.loads((tmp_path / "first" / MANIFEST_FILENAME).read_text())
+        buildings = create_from_manifest(manifest["users"])
+        assert len(buildings) == 4 and User.objects.filter(email__startswith="synthetic_user_").count() == 2
+        assert buildings[0].building_devices.count() == 6 and buildings[0].building_rooms.count() == 4
+        assert create_from_manifest(manifest["users"]) == buildings and Building.objects.count() == 4
+
+    def test_load_command_streams_into_database(self):
+        output = io.StringIO()
+        call_command("generate_scenario", "--load", "--users", "2", "--buildings-per-user", "2",
+                     "--receivers-per-building", "4", "--sessions-per-device", "20", "--weather-days", "1",
+                     "--start-date", "2022-05-01 00:00:00", "--seed", "3", "--chunk-size", "7", stdout=output)
+        assert "2 users, 4 buildings, 320 device raports and 288 weather raports" in output.getvalue()
+        assert DeviceRaport.objects.count() == 320
+        assert WeatherRaport.objects.count() == 288
+        fridge = EnergyReceiver.objects.filter(name="fridge_2").first()
+        assert len(list(get_search_backend().device_raports(fridge, datetime(2022, 5, 1), datetime(2022, 6, 1)))) == 20
+
+    def test_loading_twice_creates_no_duplicates(self):
+        arguments = ["generate_scenario", "--load", "--users", "2", "--receivers-per-building", "3",
+                     "--sessions-per-device", "5", "--weather-days", "1", "--start-date", "2022-05-01 00:00:00"]
+        call_command(*arguments, stdout=io.StringIO())
+        # a building left without some of its devices is completed
+        EnergyReceiver.objects.filter(name="fridge_2").delete()
+        call_command(*arguments, stdout=io.StringIO())
+        assert Building.objects.count() == 2 and Room.objects.count() == 8
+        assert EnergyReceiver.objects.filter(name="fridge_2").count() == 2
+        assert DeviceRaport.objects.count() == 30
+        assert WeatherRaport.objects.count() == 288
+
+
+@pytest.mark.django_db
+class TestVirtualClock:
+    client = APIClient()
+
+    def setUpDevice(self):
+        user = User.objects.create(email="clock@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        return EnergyReceiver.objects.create(building=building, name="kettle", device_power=2000, supply_voltage=230)
+
+    def test_clock_is_injected_into_models(self):
+        device = self.setUpDevice()
+        with use_clock(FixedClock(datetime(2022, 5, 1, 8))):
+            device.switch(True)
+            storage = EnergyStorage.objects.create(building=device.building, name="battery", capacity=10)
+        assert DeviceRaport.objects.get(device=device).turned_on == datetime(2022, 5, 1, 8)
+        assert ChargeStateRaport.objects.get(device=storage).date == datetime(2022, 5, 1, 8)
+
+    def test_header_sets_time_of_request_when_enabled(self):
+        device = self.setUpDevice()
+        url = reverse_lazy("smarthome:device-detail", kwargs={"pk": device.pk})
+        header = {"HTTP_X_VIRTUAL_TIME": "2022-05-01 08:00:00"}
+        self.client.patch(url, {"state": True}, format="json", **header)
+        assert DeviceRaport.objects.get(device=device).turned_on > datetime(2022, 5, 2)
+
+        with override_settings(VIRTUAL_TIME_ENABLED=True):
+            assert self.client.patch(url, {"state": False}, format="json",
+                                     HTTP_X_VIRTUAL_TIME="yesterday").status_code == 400
+            self.client.patch(url, {"state": False}, format="json", HTTP_X_VIRTUAL_TIME="2022-05-01 09:00:00")
+            self.client.patch(url, {"state": True}, format="json", HTTP_X_VIRTUAL_TIME="2022-05-01T10:30:00")
+        assert list(DeviceRaport.objects.filter(device=device, turned_on__lt=datetime(2022, 5, 2))
+                    .values_list("turned_on", "turned_off")) == [(datetime(2022, 5, 1, 10, 30), None)]
+
+
+@pytest.mark.django_db
+class TestScenarioReplay:
+
+    def test_replays_scenario_times_through_device_endpoint(self, tmp_path):
+        generator = SyntheticDataGenerator(seed=4, start=datetime(2022, 5, 1), receivers_per_building=3)
+        Scenario(generator, users=1, sessions_per_device=5, weather_days=0).write(str(tmp_path))
+        manifest = json.loads((tmp_path / MANIFEST_FILENAME).read_text())
+        create_from_manifest(manifest["users"])
+
+        output = io.StringIO()
+        call_command("replay_scenario", str(tmp_path), "--clients", "1", "--speedup", "1e9", "--format", "json",
+                     stdout=output)
+        result = json.loads(output.getvalue())
+        assert result["toggles"] == 30 and result["errors"] == 0
+        assert result["request_latency"]["count"] == 30 and result["end_to_end_latency"]["p99_ms"] >= 0
+
+        reader = RaportsFileReader(tmp_path / "raports" / "building_0.json")
+        with reader:
+            recorded = sorted((raport["turned_on"], raport["turned_off"]) for _, raport in reader.iter_raports())
+        stored = sorted((raport.turned_on.strftime("%Y-%m-%d %H:%M:%S"), raport.turned_off.strftime("%Y-%m-%d %H:%M:%S"))
+                        for raport in DeviceRaport.objects.all())
+        assert stored == recorded
+
+
+@pytest.mark.django_db
+class TestLoadTest:
+
+    def test_latency_summary(self):
+        summary = latency_summary([index / 1000 for index in range(1, 101)])
+        assert summary["count"] == 100 and summary["max_ms"] == pytest.approx(100)
+        assert summary["p50_ms"] == pytest.approx(50.5) and summary["p99_ms"] == pytest.approx(99.01)
+        assert latency_summary([]) == {"count": 0}
+
+    def test_transport_without_request_is_not_created(self):
+        class SilentTransport(Transport):
+            pass
+
+        with pytest.raises(TypeError):
+            SilentTransport()
+
+    def test_mixed_load_in_closed_and_open_loop(self):
+        user = User.objects.create(email="load@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        kettle = EnergyReceiver.objects.create(building=building, name="kettle", device_power=2000, supply_voltage=230)
+        DeviceRaport.objects.create(device=kettle, turned_on=datetime(2022, 5, 1, 8), turned_off=datetime(2022, 5, 1, 9))
+        arguments = ["--concurrency", "1", "--end-date", "2022-05-02 00:00:00", "--batch-size", "3", "--format", "json"]
+
+        output = io.StringIO()
+        call_command("loadtest", *arguments, "--requests", "40", stdout=output)
+        report = json.loads(output.getvalue())
+        assert report["mode"] == "closed" and report["requests"] == 40 and report["error_rate"] == 0
+        assert report["targets"] == {"buildings": 1, "receivers": 1}
+        assert set(report["endpoints"]) <= {"toggle", "bulk_raports", "buildings", "energy 1h", "energy 24h",
+                                            "energy 168h", "energy 720h"}
+        assert all(row["p50_ms"] <= row["p95_ms"] <= row["p99_ms"] for row in report["endpoints"].values())
+        posts = report["endpoints"].get("bulk_raports", {}).get("requests", 0)
+        toggles = report["endpoints"].get("toggle", {}).get("requests", 0)
+        assert DeviceRaport.objects.count() == 1 + 3 * posts + (toggles + 1) // 2
+
+        output = io.StringIO()
+        call_command("loadtest", *arguments, "--mix", "energy=1", "--rate", "500", "--requests", "10", stdout=output)
+        report = json.loads(output.getvalue())
+        assert report["mode"] == "open" and report["requests"] == 10 and report["error_rate"] == 0
+
+
+@pytest.mark.django_db
+class TestChargeStateSimulation:
+    client = APIClient()
+
+    def setUpStorage(self):
+        user = User.objects.create(email="soc@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        # 10 Ah x 100 V = 1 kWh
+        storage = EnergyStorage.objects.create(building=building, name="battery", capacity=10, battery_voltage=100)
+        StorageChargingAndUsageRaport.objects.create(
+            device=storage, job_type=StorageChargingAndUsageRaport.CHARGING, energy_use=0.5,
+            date_time_from=datetime(2022, 3, 30, 0), date_time_to=datetime(2022, 3, 30, 1),
+        )
+        StorageChargingAndUsageRaport.objects.create(
+            device=storage, job_type=StorageChargingAndUsageRaport.USAGE, energy_use=0.4,
+            date_time_from=datetime(2022, 3, 30, 2), date_time_to=datetime(2022, 3, 30, 4),
+        )
+        return storage
+
+    def test_clamped_cumsum_matches_loop(self):
+        rng = np.random.default_rng(3)
+        deltas = rng.normal(0, 1, 1000)
+        expected, level = [], 2.0
+        for delta in deltas:
+            level = min(max(level + delta, 0.0), 5.0)
+            expected.append(level)
+        assert np.allclose(clamped_cumsum(deltas, 2.0, 5.0, block_size=64), expected)
+
+    def test_raport_save_records_charge_state(self):
+        storage = self.setUpStorage()
+        states = ChargeStateRaport.objects.filter(device=storage, date__lt=datetime(2022, 4, 1)).order_by("date")
+        assert [(state.date.hour, state.charge_value) for state in states] == [(1, 0.5), (4, pytest.approx(0.1))]
+        with pytest.raises(ValueError):
+            StorageChargingAndUsageRaport.objects.create(
+                device=storage, job_type=StorageChargingAndUsageRaport.CHARGING, energy_use=2.0,
+                date_time_from=datetime(2022, 3, 30, 5), date_time_to=datetime(2022, 3, 30, 6),
+            )
+
+    def test_series_endpoint(self):
+        storage = self.setUpStorage()
+        url = reverse_lazy('smarthome:charge-state', kwargs={'pk': storage.id})
+        response = self.client.get(url, {"start_date": "2022-03-30 00:00:00", "end_date": "2022-03-30 04:00:00"})
+        assert response.status_code == 200
+        # charging keeps 95% of the energy drawn
+        assert response.data["charge_kwh"] == pytest.approx([0.475, 0.475, 0.275, 0.075])
+
+    def test_series_endpoint_rejects_oversized_windows(self):
+        storage = self.setUpStorage()
+        url = reverse_lazy('smarthome:charge-state', kwargs={'pk': storage.id})
+        response = self.client.get(url, {"start_date": "0001-01-01 00:00:00", "end_date": "2022-03-30 04:00:00"})
+        assert response.status_code == 400
+        response = self.client.get(url, {"start_date": "2022-03-30 00:00:00", "resolution_minutes": 10**9})
+        assert response.status_code == 400
+
+    def test_command_writes_compacted_checkpoints(self):
+        storage = self.setUpStorage()
+        call_command("simulate_charge_states", "--start-date", "2022-03-30 00:00:00",
+                     "--end-date", "2022-03-30 04:00:00", "--resolution-minutes", "60", stdout=io.StringIO())
+        states = ChargeStateRaport.objects.filter(device=storage, date__lt=datetime(2022, 4, 1)).order_by("date")
+        assert [(state.date.hour, state.charge_value) for state in states] == [
+            (1, pytest.approx(0.475)), (3, pytest.approx(0.275)), (4, pytest.approx(0.075)),
+        ]
+        last_state = get_search_backend().last_charge_state(storage, datetime(2022, 3, 30, 5))
+        assert last_state.charge_value == pytest.approx(0.075)
+
+@pytest.mark.django_db
+class TestDeviceSwitch:
+    client = APIClient()
+
+    def setUpDevice(self):
+        user = User.objects.create(email="switch@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        return EnergyReceiver.objects.create(building=building, name="bulb", state=False, device_power=60, supply_voltage=8)
+
+    def test_toggles_open_and_close_the_pointed_session(self):
+        device = self.setUpDevice()
+        url = reverse_lazy('smarthome:device-detail', kwargs={'pk': device.id})
+        for state in (True, False, True):
+            response = self.client.patch(url, data={"resourcetype": "EnergyReceiver", "state": state}, format="json")
+            assert response.status_code == 200
+            assert response.data["state"] == state
+
+        device.refresh_from_db()
+        raports = list(DeviceRaport.objects.filter(device=device).order_by("turned_on"))
+        assert len(raports) == 2
+        assert raports[0].turned_off is not None
+        assert raports[1].turned_off is None
+        assert device.open_raport_id == raports[1].id
+
+    def test_repeated_state_does_not_open_another_session(self):
+        device = self.setUpDevice()
+        assert device.switch(True, datetime(2022, 3, 30, 8))
+        assert not device.switch(True, datetime(2022, 3, 30, 9))
+        assert device.switch(False, datetime(2022, 3, 30, 10))
+        raport = DeviceRaport.objects.get(device=device)
+        assert (raport.turned_on, raport.turned_off) == (datetime(2022, 3, 30, 8), datetime(2022, 3, 30, 10))
+
+    def test_switch_on_within_debounce_window_reopens_session(self, settings):
+        settings.DEVICE_DEBOUNCE_SECONDS = {"EnergyReceiver": 1.0}
+        device = self.setUpDevice()
+        device.switch(True, datetime(2022, 3, 30, 8))
+        device.switch(False, datetime(2022, 3, 30, 9))
+        device.switch(True, datetime(2022, 3, 30, 9, 0, 0, 500000))
+        raport = DeviceRaport.objects.get(device=device)
+        assert raport.turned_off is None
+        assert Device.objects.get(pk=device.pk).open_raport_id == raport.id
+
+    def test_compaction_merges_flapping_raports(self, settings):
+        settings.DEVICE_DEBOUNCE_SECONDS = {"EnergyReceiver": 1.0}
+        device = self.setUpDevice()
+        for second in range(5):
+            DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, 8, 0, second),
+                                        turned_off=datetime(2022, 3, 30, 8, 0, second, 500000))
+        output = io.StringIO()
+        call_command("compact_raports", "--device-type", "EnergyReceiver", stdout=output)
+        assert "Removed 4 raports of 1 devices" in output.getvalue()
+        raport = DeviceRaport.objects.get(device=device)
+        assert raport.turned_off == datetime(2022, 3, 30, 8, 0, 4, 500000)
+
+    def test_other_fields_are_updated_with_the_state(self):
+        device = self.setUpDevice()
+        url = reverse_lazy('smarthome:device-detail', kwargs={'pk': device.id})
+        response = self.client.patch(url, data={"resourcetype": "EnergyReceiver", "state": True, "name": "lamp"}, format="json")
+        assert response.status_code == 200
+        device.refresh_from_db()
+        assert (device.name, device.state) == ("lamp", True)
+        assert device.open_raport is not None
+
+    def test_invalid_fields_leave_the_state_alone(self):
+        device = self.setUpDevice()
+        url = reverse_lazy('smarthome:device-detail', kwargs={'pk': device.id})
+        response = self.client.patch(url, data={"resourcetype": "EnergyReceiver", "state": True, "device_power": "abc"},
+                                     format="json")
+        assert response.status_code == 400
+        device.refresh_from_db()
+        assert not device.state and device.open_raport is None
+        assert not DeviceRaport.objects.filter(device=device).exists()
+
+
+class TestEventPairing:
+    def test_out_of_order_events_and_duplicates_are_reconciled(self):
+        history = DeviceHistory(state=False, open_raport_id=None, last_raport_id=None, last_change=datetime(2022, 3, 30, 7))
+        events = [
+            StateEvent(1, False, datetime(2022, 3, 30, 9)),
+            StateEvent(1, True, datetime(2022, 3, 30, 8)),
+            StateEvent(1, True, datetime(2022, 3, 30, 8)),
+            StateEvent(1, True, datetime(2022, 3, 30, 6)),
+            StateEvent(1, True, datetime(2022, 3, 30, 10)),
+            StateEvent(1, True, datetime(2022, 3, 30, 11)),
+        ]
+        plan = plan_device_events(history, events)
+        assert plan.sessions == [(datetime(2022, 3, 30, 8), datetime(2022, 3, 30, 9)), (datetime(2022, 3, 30, 10), None)]
+        assert (plan.applied, plan.duplicates, plan.stale, plan.state) == (3, 2, 1, True)
+
+    def test_off_event_closes_stored_session(self):
+        history = DeviceHistory(state=True, open_raport_id=7, last_raport_id=7, last_change=datetime(2022, 3, 30, 8))
+        plan = plan_device_events(history, [StateEvent(1, False, datetime(2022, 3, 30, 9))])
+        assert (plan.stored_update, plan.open_raport_id, plan.sessions) == ((7, datetime(2022, 3, 30, 9)), None, [])
+
+    def test_flapping_is_merged_within_debounce_window(self):
+        moment = datetime(2022, 3, 30, 8)
+        history = DeviceHistory(state=False, open_raport_id=None, last_raport_id=3, last_change=moment,
+                                last_off=moment, debounce=timedelta(seconds=1))
+        events = [StateEvent(1, index % 2 == 0, moment + timedelta(milliseconds=200 * (index + 1))) for index in range(9)]
+        events.append(StateEvent(1, False, moment + timedelta(seconds=5)))
+        events.append(StateEvent(1, True, moment + timedelta(seconds=7)))
+        plan = plan_device_events(history, events)
+        assert plan.stored_update == (3, moment + timedelta(seconds=5))
+        assert plan.sessions == [(moment + timedelta(seconds=7), None)]
+        assert plan.merged == 5
+
+    def test_stored_sessions_are_coalesced(self):
+        moment = datetime(2022, 3, 30, 8)
+        rows = [
+            (1, moment, moment + timedelta(seconds=10)),
+            (2, moment + timedelta(seconds=10.5), moment + timedelta(seconds=20)),
+            (3, moment + timedelta(seconds=20.2), None),
+            (4, moment + timedelta(seconds=40), moment + timedelta(seconds=50)),
+        ]
+        assert coalesce_sessions(rows[:2] + rows[3:], timedelta(seconds=1)) == ({1: moment + timedelta(seconds=20)}, {2: 1})
+        assert coalesce_sessions(rows[:3], timedelta(seconds=1)) == ({1: None}, {2: 1, 3: 1})
+
+
+@pytest.mark.django_db
+class TestDeviceEvents:
+    client = APIClient()
+
+    def test_batch_is_paired_into_raports(self):
+        user = User.objects.create(email="events@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        bulb = EnergyReceiver.objects.create(building=building, name="bulb", state=False, device_power=60, supply_voltage=8)
+        lamp = EnergyReceiver.objects.create(building=building, name="lamp", state=False, device_power=60, supply_voltage=8)
+        lamp.switch(True, datetime(2022, 3, 30, 7))
+        events = [
+            {"device": bulb.id, "state": False, "timestamp": "2022-03-30 09:00:00"},
+            {"device": lamp.id, "state": False, "timestamp": "2022-03-30 08:30:00"},
+            {"device": bulb.id, "state": True, "timestamp": "2022-03-30 08:00:00"},
+            {"device": bulb.id, "state": True, "timestamp": "2022-03-30 10:00:00"},
+            {"device": 0, "state": True, "timestamp": "2022-03-30 10:00:00"},
+        ]
+        response = self.client.post(reverse_lazy('smarthome:device-events'), data=events, format="json")
+        assert response.status_code == 200
+        assert response.data["unknown_devices"] == [0]
+        assert (response.data["raports_created"], response.data["raports_updated"]) == (2, 1)
+
+        bulb.refresh_from_db()
+        lamp.refresh_from_db()
+        assert bulb.state and bulb.open_raport.turned_on == datetime(2022, 3, 30, 10)
+        assert not lamp.state and lamp.open_raport is None
+        assert DeviceRaport.objects.get(device=lamp).turned_off == datetime(2022, 3, 30, 8, 30)
+        assert len(EnergyCalculator.filter_raports_by_device_and_date(bulb, datetime(2022, 3, 30), datetime(2022, 3, 31))) == 2
+
+    def test_invalid_event_is_rejected(self):
+        response = self.client.post(reverse_lazy('smarthome:device-events'), data=[{"device": 1, "state": "on"}], format="json")
+        assert response.status_code == 400
+
+    def test_oversized_batch_is_rejected(self):
+        user = User.objects.create(email="events@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        bulb = EnergyReceiver.objects.create(building=building, name="bulb", state=False, device_power=60, supply_voltage=8)
+        events = [{"device": bulb.id, "state": True, "timestamp": "2022-03-30 08:00:00"}] * (MAX_EVENTS_PER_REQUEST + 1)
+        response = self.client.post(reverse_lazy('smarthome:device-events'), data=events, format="json")
+        assert response.status_code == 400
+        assert not DeviceRaport.objects.exists()
+
+
+@pytest.mark.django_db
+class TestBulkSwitch:
+    client = APIClient()
+
+    def setUpRoom(self):
+        user = User.objects.create(email="bulk@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        room = Room.objects.create(building=building, name="kitchen", area=12)
+        bulbs = [
+            EnergyReceiver.objects.create(building=building, room=room, name=f"bulb{index}", device_power=60, supply_voltage=8)
+            for index in range(3)
+        ]
+        panel = EnergyGenerator.objects.create(building=building, name="panel", generation_power=300)
+        return building, room, bulbs, panel
+
+    def test_room_switch_filters_by_type_and_opens_sessions(self):
+        _, room, bulbs, panel = self.setUpRoom()
+        bulbs[0].switch(True, datetime(2022, 3, 30, 8))
+        url = reverse_lazy('smarthome:room-switch', kwargs={'pk': room.id})
+        response = self.client.post(url, data={"state": True, "type": "EnergyReceiver"}, format="json")
+        assert response.status_code == 200
+        assert response.data["switched"] == [bulbs[1].id, bulbs[2].id]
+        for bulb in bulbs:
+            bulb.refresh_from_db()
+            assert bulb.state and bulb.open_raport.turned_off is None
+        panel.refresh_from_db()
+        assert not panel.state
+
+    def test_building_switch_off_closes_open_sessions(self):
+        building, _, bulbs, panel = self.setUpRoom()
+        for device in (*bulbs, panel):
+            device.switch(True, datetime(2022, 3, 30, 8))
+        url = reverse_lazy('smarthome:building-switch', kwargs={'pk': building.id})
+        response = self.client.post(url, data={"state": False}, format="json")
+        assert sorted(response.data["switched"]) == sorted(device.id for device in (*bulbs, panel))
+        assert not DeviceRaport.objects.filter(device__building=building, turned_off__isnull=True).exists()
+        assert not Device.objects.filter(building=building, open_raport__isnull=False).exists()
+        assert len(EnergyCalculator.filter_raports_by_device_and_date(bulbs[0], datetime(2022, 3, 30), datetime.now())) == 1
+
+
+@pytest.mark.django_db
+class TestRaportLoader:
+
+    def test_other_databases_are_refused(self, tmp_path):
+        if connection.vendor == "postgresql":
+            pytest.skip("COPY is available")
+        path = tmp_path / "weather.ndjson"
+        path.write_text(json.dumps({"datetime_from": "2022-03-30T08:00:00", "solar_radiation": 200}))
+        with pytest.raises(CommandError, match="PostgreSQL"):
+            call_command("load_raports", "weather", str(path), stdout=io.StringIO())
+        assert not WeatherRaport.objects.exists()
+
+    @requires_postgresql
+    def test_csv_export_is_loaded_back_without_duplicates(self, tmp_path):
+        user = User.objects.create(email="load@email.com", password="defaultpassword")
+        building = Building.objects.create(user=user, name="house")
+        device = EnergyReceiver.objects.create(building=building, name="bulb", device_power=60, supply_voltage=8)
+        DeviceRaport.objects.create(device=device, turned_on=datetime(2022, 3, 30, 8), turned_off=datetime(2022, 3, 30, 9))
+        path = tmp_path / "raports.csv"
+        path.write_text(
+            "id,device,device__name,turned_on,turned_off\n"
+            f"1,{device.id},bulb,2022-03-30 08:00:00,2022-03-30 09:00:00\n"
+            f"2,{device.id},bulb,2022-03-30 10:00:00,2022-03-30 11:00:00\n"
+            f"3,{device.id},bulb,2022-03-30 12:00:00,\n"
+        )
+        output = io.StringIO()
+        call_command("load_raports", "device", str(path), stdout=output)
+        assert "2 inserted, 1 skipped of 3" in output.getvalue()
+        assert DeviceRaport.objects.get(device=device, turned_on=datetime(2022, 3, 30, 12)).turned_off is None
+        assert len(EnergyCalculator.filter_raports_by_device_and_date(device, datetime(2022, 3, 30), datetime(2022, 3, 31))) == 3
+
+    @requires_postgresql
+    def test_weather_is_deduplicated_by_start(self, tmp_path):
+        WeatherRaport.objects.create(datetime_from=datetime(2022, 3, 30, 8), solar_radiation=100)
+        path = tmp_path / "weather.ndjson"
+        path.write_text("\n".join(json.dumps({"datetime_from": f"2022-03-30T08:0{minute}:00", "solar_radiation": 200})
+                                  for minute in (0, 5, 5)))
+        call_command("load_raports", "weather", str(path), stdout=io.StringIO())
+        assert WeatherRaport.objects.count() == 2
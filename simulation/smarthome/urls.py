@@ -8,8 +8,19 @@ from .views import (
     BuildingDevicesView,
     DeviceRaportsView,
     BuildingStorageEnergyView,
+    BuildingStorageFlowsView,
+    BuildingBalanceView,
+    BuildingPeaksView,
+    BuildingCostView,
+    StorageScheduleView,
     ChargeStateRaportView,
+    ChargeStateSeriesView,
+    BuildingRaportsView,
+    WeatherRaportsView,
+    DeviceEventsView,
+    DeviceSwitchView,
 )
+from .models import Room
 
 app_name = "smarthome"
 
@@ -30,7 +41,22 @@ urlpatterns = [
         BuildingStorageEnergyView.as_view(),
         name="storage_energy"
     ),
+    path("buildings/<int:pk>/storage-flows/", BuildingStorageFlowsView.as_view(), name="storage-flows"),
+    path("buildings/<int:pk>/balance/", BuildingBalanceView.as_view(), name="building-balance"),
+    path("buildings/<int:pk>/peaks/", BuildingPeaksView.as_view(), name="building-peaks"),
+    path("buildings/<int:pk>/cost/", BuildingCostView.as_view(), name="building-cost"),
+    path("buildings/<int:pk>/storage-schedule/", StorageScheduleView.as_view(), name="storage-schedule"),
     path("buildings/<int:pk>/devices/", BuildingDevicesView.as_view(), name="building-devices"),
+    path("buildings/<int:pk>/switch/", DeviceSwitchView.as_view(), name="building-switch"),
+    path(
+        "rooms/<int:pk>/switch/",
+        DeviceSwitchView.as_view(queryset=Room.objects.all(), device_lookup="room"),
+        name="room-switch"
+    ),
+    path("buildings/<int:pk>/device-raports/", BuildingRaportsView.as_view(), name="building-device-raports"),
+    path("weather-raports/", WeatherRaportsView.as_view(), name="weather-raports"),
+    path("device-events/", DeviceEventsView.as_view(), name="device-events"),
     path("devices/<int:pk>/device-raports/", DeviceRaportsView.as_view(), name="device-raports"),
     path("devices/<int:pk>/charge-state-raports/", ChargeStateRaportView.as_view(), name="charge-state-raports"),
+    path("devices/<int:pk>/charge-state/", ChargeStateSeriesView.as_view(), name="charge-state"),
 ]
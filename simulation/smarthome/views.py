@@ -1,20 +1,43 @@
 import json
-from datetime import datetime
+from datetime import timedelta
 
+from config.db_router import read_from_replica
 from django.db import transaction
 from django.forms.models import model_to_dict
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, mixins, status, viewsets
+from rest_framework import generics, mixins, serializers, status, viewsets
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from . import clock
+from .balance import BuildingBalanceCalculator
+from .caching import (building_data_version, cache_closed_windows,
+                      device_building_data_version)
+from .costs import BuildingCostCalculator
+from .exports import EXPORT_FORMATS, export_response, overlap_filter
+from .ingest import ingest_events, parse_events, switch_devices
 from .models import (Building, ChargeStateRaport, Device, DeviceRaport,
-                     EnergyStorage, StorageChargingAndUsageRaport)
-from .models_calculators import DeviceCalculateManager, EnergyCalculator
-from .serializers import (BuildingListSerializer, BuildingSerializer,
-                          ChargeStateRaportSerializer, DatesRangeSerializer,
-                          DeviceRaportSerializer, DeviceSerializer,
-                          StorageChargingAndUsageRaportSerializer)
+                     EnergyStorage, StorageChargingAndUsageRaport,
+                     WeatherRaport)
+from .models_calculators import (DeviceCalculateManager, EnergyCalculator,
+                                 EnergyStorageCalculator)
+from .pagination import KeysetPagination
+from .peaks import PeakDemandCalculator
+from .renderers import CSVRenderer, NDJSONRenderer
+from .search_backends import get_search_backend
+from .serializers import (CHARGE_STATE_BASE_STEP, BuildingListSerializer,
+                          BuildingSerializer, ChargeStateQuerySerializer,
+                          ChargeStateRaportSerializer, CostQuerySerializer,
+                          DatesRangeSerializer, DeviceRaportSerializer,
+                          DeviceSerializer, DeviceSwitchSerializer,
+                          PeakQuerySerializer,
+                          StorageChargingAndUsageRaportSerializer,
+                          StorageFlowsQuerySerializer,
+                          StorageScheduleQuerySerializer,
+                          WeatherRaportSerializer)
+from .soc import ChargeStateSimulator
+from .storage_optimizer import StorageScheduleCalculator
 
 
 class BuildingViewSet(viewsets.ModelViewSet):
@@ -56,18 +79,25 @@ class DeviceViewSet(viewsets.ModelViewSet):
 
     def partial_update(self, request, *args, **kwargs):
         device = self.get_object()
-        cached_state = device.state
-        json_device = super().partial_update(request, *args, **kwargs)
-        if json_device.data.get('state') != cached_state:
-            if json_device.data.get('state') == True:
-                device_raport = DeviceRaport(device=device, turned_on=datetime.now())
-                device_raport.save()
-            elif json_device.data.get('state') == False:
-                device_raport = DeviceRaport.objects.filter(device=device).last()
-                device_raport.turned_off = datetime.now()
-                device_raport.save()
-        return json_device
-        
+        state = request.data.get("state")
+        data = {key: request.data[key] for key in request.data if key != "state"}
+        fields = {}
+        if state is not None:
+            state = serializers.BooleanField().to_internal_value(state)
+        if set(data) - {"resourcetype"}:
+            serializer = self.get_serializer(device, data=data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            fields = {name: value for name, value in serializer.validated_data.items()
+                      if name not in ("id", serializer.resource_type_field_name)}
+        with transaction.atomic():
+            if state is not None:
+                device.switch(state)
+            if fields:
+                # only the sent fields: state and open_raport are written by switch() alone
+                for name, value in fields.items():
+                    setattr(device, name, value)
+                device.save(update_fields=list(fields))
+        return Response(self.get_serializer(device).data)
 
 
 class BuildingEnergyView(mixins.RetrieveModelMixin, generics.GenericAPIView):
@@ -81,6 +111,8 @@ class BuildingEnergyView(mixins.RetrieveModelMixin, generics.GenericAPIView):
         return []
     
     # api/buildings/1/energy?start_date=30-03-2022 10:02:01
+    @read_from_replica
+    @cache_closed_windows(building_data_version)
     def get(self, request, *args, **kwargs):
         building = self.get_object()
         building_dict = model_to_dict(building)
@@ -108,6 +140,8 @@ class BuildingStorageEnergyView(mixins.RetrieveModelMixin, generics.GenericAPIVi
         return []
     
     # api/buildings/1/energy-storage?start_date=30-03-2022 10:02:01
+    @read_from_replica
+    @cache_closed_windows(building_data_version)
     def get(self, request, *args, **kwargs):
         building = self.get_object()
         building_dict = model_to_dict(building)
@@ -115,15 +149,190 @@ class BuildingStorageEnergyView(mixins.RetrieveModelMixin, generics.GenericAPIVi
         if serializer.is_valid():
             start_date = serializer.to_internal_value(serializer.data).get("start_date")
             end_date = serializer.to_internal_value(serializer.data).get("end_date")
-            building_dict["building_devices"] = []
-            for device in building.building_devices.all():
-                if device.type != EnergyStorage.__name__:
-                    continue
-                building_dict["building_devices"].append(DeviceCalculateManager().get_device_energy(device, start_date, end_date))
+            storages = [device for device in building.building_devices.all() if device.type == EnergyStorage.__name__]
+            building_dict["building_devices"] = EnergyStorageCalculator().get_devices_energy_calculation(storages, start_date, end_date)
             return Response(building_dict)
         else:
            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class BuildingStorageFlowsView(mixins.RetrieveModelMixin, generics.GenericAPIView):
+    """Energy charged into and drawn from the storages of the building, in total and per window."""
+    permission_classes = [
+        AllowAny,
+    ]
+    queryset = Building.objects.all()
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    # api/buildings/1/storage-flows/?start_date=2022-03-01 00:00:00&end_date=2022-04-01 00:00:00&step_hours=24
+    @read_from_replica
+    @cache_closed_windows(building_data_version)
+    def get(self, request, *args, **kwargs):
+        building = self.get_object()
+        serializer = StorageFlowsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start_date = serializer.validated_data["start_date"]
+        end_date = serializer.validated_data.get("end_date") or clock.now()
+        step_hours = serializer.validated_data.get("step_hours")
+        boundaries = [start_date]
+        while step_hours and boundaries[-1] + timedelta(hours=step_hours) < end_date:
+            boundaries.append(boundaries[-1] + timedelta(hours=step_hours))
+        boundaries.append(end_date)
+
+        calculator = EnergyStorageCalculator()
+        storages = [device for device in building.building_devices.all() if device.type == EnergyStorage.__name__]
+        windows = calculator.calculate_flows(storages, boundaries)
+        totals = {storage.id: {job_type: sum(window[storage.id][job_type] for window in windows)
+                               for job_type, _ in StorageChargingAndUsageRaport.job_types} for storage in storages}
+        building_dict = model_to_dict(building)
+        building_dict["building_devices"] = [
+            {"id": storage.id, "name": storage.name, "capacity_kwh": storage.capacity_kwh,
+             **calculator.summarize_flows(storage, totals[storage.id])}
+            for storage in storages
+        ]
+        if step_hours:
+            building_dict["windows"] = [
+                {"start_date": window_start, "end_date": window_end, "building_devices": [
+                    {"id": storage.id, **calculator.summarize_flows(storage, window[storage.id])} for storage in storages
+                ]}
+                for window_start, window_end, window in zip(boundaries[:-1], boundaries[1:], windows)
+            ]
+        return Response(building_dict)
+
+class BuildingBalanceView(mixins.RetrieveModelMixin, generics.GenericAPIView):
+    """Grid import and export, self-consumption, autarky and net power curve of the building."""
+    permission_classes = [
+        AllowAny,
+    ]
+    queryset = Building.objects.all()
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    # api/buildings/1/balance/?start_date=2022-03-30 00:00:00&end_date=2022-03-31 00:00:00
+    @read_from_replica
+    @cache_closed_windows(building_data_version)
+    def get(self, request, *args, **kwargs):
+        building = self.get_object()
+        serializer = DatesRangeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(BuildingBalanceCalculator().calculate(
+            building, serializer.validated_data["start_date"], serializer.validated_data.get("end_date"),
+        ))
+
+class BuildingPeaksView(mixins.RetrieveModelMixin, generics.GenericAPIView):
+    """Peak coincident receiver power of the building, its load-duration curve and the share of every room."""
+    permission_classes = [
+        AllowAny,
+    ]
+    queryset = Building.objects.all()
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    # api/buildings/1/peaks/?start_date=2022-03-01 00:00:00&end_date=2022-04-01 00:00:00&top=5&points=100
+    @read_from_replica
+    @cache_closed_windows(building_data_version)
+    def get(self, request, *args, **kwargs):
+        building = self.get_object()
+        serializer = PeakQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(PeakDemandCalculator().calculate(
+            building, serializer.validated_data["start_date"], serializer.validated_data.get("end_date"),
+            serializer.validated_data["top"], serializer.validated_data["points"],
+        ))
+
+class BuildingCostView(mixins.RetrieveModelMixin, generics.GenericAPIView):
+    """Cost, revenue and net of the energy of the building priced with the energy market file."""
+    permission_classes = [
+        AllowAny,
+    ]
+    queryset = Building.objects.all()
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    # api/buildings/1/cost/?start_date=2022-03-30 10:00:00&end_date=2022-03-31 10:00:00&step_hours=24
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        building = self.get_object()
+        serializer = CostQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        step_hours = serializer.validated_data.get("step_hours")
+        try:
+            calculator = BuildingCostCalculator()
+        except (OSError, ValueError) as error:
+            return Response({"detail": f"Energy market prices are not available: {error}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(calculator.calculate(
+            building, serializer.validated_data["start_date"], serializer.validated_data.get("end_date"),
+            timedelta(hours=step_hours) if step_hours else None,
+        ))
+
+class StorageScheduleView(mixins.RetrieveModelMixin, generics.GenericAPIView):
+    """Charge/discharge schedule of the energy storages of the building minimizing its energy cost."""
+    permission_classes = [
+        AllowAny,
+    ]
+    queryset = Building.objects.all()
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    # api/buildings/1/storage-schedule/?start_date=2022-03-30 00:00:00&end_date=2022-03-31 00:00:00&step_minutes=15
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        building = self.get_object()
+        serializer = StorageScheduleQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        try:
+            calculator = StorageScheduleCalculator()
+        except (OSError, ValueError) as error:
+            return Response({"detail": f"Energy market prices are not available: {error}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(calculator.calculate(
+            building, serializer.validated_data["start_date"], serializer.validated_data.get("end_date"),
+            timedelta(minutes=serializer.validated_data["step_minutes"]), serializer.validated_data["levels"],
+        ))
+
+class ChargeStateSeriesView(mixins.RetrieveModelMixin, generics.GenericAPIView):
+    """Stored energy of the storage simulated from its charging and usage raports."""
+    permission_classes = [
+        AllowAny,
+    ]
+    queryset = EnergyStorage.objects.all()
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    # api/devices/1/charge-state/?start_date=2022-03-01 00:00:00&end_date=2022-04-01 00:00:00&resolution_minutes=60
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        device = self.get_object()
+        serializer = ChargeStateQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start_date = serializer.validated_data["start_date"]
+        end_date = serializer.validated_data.get("end_date") or clock.now()
+        step = timedelta(minutes=serializer.validated_data["resolution_minutes"])
+        try:
+            series = ChargeStateSimulator(CHARGE_STATE_BASE_STEP).simulate(device, start_date, end_date, step)
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "id": device.id,
+            "capacity_kwh": device.capacity_kwh,
+            "start_date": series.start_date,
+            "step_minutes": step.total_seconds() / 60,
+            "charge_kwh": series.charge_kwh.tolist(),
+        })
+
 class BuildingDevicesView(generics.ListAPIView):
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
@@ -150,10 +359,28 @@ class BuildingDevicesView(generics.ListAPIView):
 
         return Response(data=serializer.data, status=status.HTTP_200_OK)
         
-class DeviceRaportsView(generics.ListAPIView):
+class RaportExportMixin:
+    """Streams raports as `?format=ndjson` or `?format=csv` instead of serializing the whole list at once."""
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer, CSVRenderer]
+
+    def get_dates(self):
+        date_serializer = DatesRangeSerializer(data=self.request.query_params)
+        date_serializer.is_valid(raise_exception=True)
+        dates = date_serializer.to_internal_value(date_serializer.data)
+        return dates.get("start_date"), dates.get("end_date") or clock.now()
+
+    def is_export(self) -> bool:
+        return self.request.accepted_renderer.format in EXPORT_FORMATS
+
+    def export(self, queryset, fields, filename):
+        return export_response(queryset, fields, self.request.accepted_renderer.format, filename)
+
+
+class DeviceRaportsView(RaportExportMixin, generics.ListAPIView):
     queryset = DeviceRaport.objects.all()
     serializer_class = DeviceRaportSerializer
     storage_serializer_class = StorageChargingAndUsageRaportSerializer
+    pagination_class = KeysetPagination
     permission_classes = [
         AllowAny,
     ]
@@ -179,6 +406,8 @@ class DeviceRaportsView(generics.ListAPIView):
 
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
+    @read_from_replica
+    @cache_closed_windows(device_building_data_version)
     def get(self, request, *args, **kwargs):
         device = get_object_or_404(Device, id=kwargs.get("pk"))
         date_serializer = DatesRangeSerializer(data=request.query_params)
@@ -188,6 +417,14 @@ class DeviceRaportsView(generics.ListAPIView):
         else:
             return Response(serializer.errors)
 
+        if self.is_export():
+            return self.export_device_raports(device, start_date, end_date or clock.now())
+
+        page = self.paginate_device_raports(device, start_date, end_date or clock.now())
+        if page is not None:
+            serializer_class = self.get_serializer_class(device_type=device.type)
+            return self.get_paginated_response(serializer_class(page, many=True).data)
+
         if device.type == EnergyStorage.__name__: 
             raports_docs = EnergyCalculator.filter_storage_raports_by_device_and_date(device, start_date, end_date)
             raports = [StorageChargingAndUsageRaport.objects.get(id=raport.id) for raport in raports_docs]
@@ -198,6 +435,111 @@ class DeviceRaportsView(generics.ListAPIView):
             serializer = DeviceRaportSerializer(raports, many=True)
         return Response(serializer.data)
 
+    def paginate_device_raports(self, device, start_date, end_date):
+        """Page through the search backend with search_after on (start, id) when `page_size` or `cursor` is given."""
+        if device.type == EnergyStorage.__name__:
+            model, search, ordering = StorageChargingAndUsageRaport, get_search_backend().storage_raports, ("date_time_from", "id")
+        else:
+            model, search, ordering = DeviceRaport, get_search_backend().device_raports, ("turned_on", "id")
+
+        def fetch(after, size):
+            hits = list(search(device, start_date, end_date, after=after, size=size))
+            raports = model.objects.in_bulk([hit.id for hit in hits])
+            return [raports[hit.id] for hit in hits if hit.id in raports]
+        return self.paginator.paginate_search(fetch, self.request, ordering)
+
+    def export_device_raports(self, device, start_date, end_date):
+        if device.type == EnergyStorage.__name__:
+            queryset = StorageChargingAndUsageRaport.objects.filter(
+                overlap_filter("date_time_from", "date_time_to", start_date, end_date), device=device,
+            ).order_by("date_time_from", "id")
+            fields = ("id", "device", "job_type", "date_time_from", "date_time_to", "energy_use")
+        else:
+            queryset = DeviceRaport.objects.filter(
+                overlap_filter("turned_on", "turned_off", start_date, end_date), device=device,
+            ).order_by("turned_on", "id")
+            fields = ("id", "device", "turned_on", "turned_off")
+        return self.export(queryset, fields, f"device_{device.id}_raports")
+
+
+class BuildingRaportsView(RaportExportMixin, generics.ListAPIView):
+    """Raports of all devices of the building overlapping the selected dates."""
+    queryset = DeviceRaport.objects.all()
+    serializer_class = DeviceRaportSerializer
+    export_fields = ("id", "device", "device__name", "turned_on", "turned_off")
+    keyset_ordering = ("turned_on", "id")
+    permission_classes = [
+        AllowAny,
+    ]
+
+    def get_queryset(self):
+        start_date, end_date = self.get_dates()
+        return self.queryset.filter(
+            overlap_filter("turned_on", "turned_off", start_date, end_date), device__building__pk=self.kwargs["pk"],
+        ).order_by("turned_on", "id")
+
+    # api/buildings/1/device-raports/?start_date=2022-03-30 10:00:00&format=csv
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        if self.is_export():
+            building = get_object_or_404(Building, id=kwargs.get("pk"))
+            return self.export(self.get_queryset(), self.export_fields, f"building_{building.id}_device_raports")
+        return super().get(request, *args, **kwargs)
+
+
+class WeatherRaportsView(RaportExportMixin, generics.ListAPIView):
+    queryset = WeatherRaport.objects.all()
+    serializer_class = WeatherRaportSerializer
+    export_fields = ("id", "datetime_from", "datetime_to", "solar_radiation", "temperature", "wind_speed")
+    keyset_ordering = ("datetime_from", "id")
+    permission_classes = [
+        AllowAny,
+    ]
+
+    def get_queryset(self):
+        start_date, end_date = self.get_dates()
+        return self.queryset.filter(
+            overlap_filter("datetime_from", "datetime_to", start_date, end_date)
+        ).order_by("datetime_from", "id")
+
+    # api/weather-raports/?start_date=2022-03-30 10:00:00&format=ndjson
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        if self.is_export():
+            return self.export(self.get_queryset(), self.export_fields, "weather_raports")
+        return super().get(request, *args, **kwargs)
+
+class DeviceEventsView(generics.GenericAPIView):
+    """Batch ingestion of gateway state events, paired into device raports with bulk writes."""
+    permission_classes = [
+        AllowAny,
+    ]
+
+    # api/device-events/ [{"device": 1, "state": true, "timestamp": "2022-03-30 10:02:01"}, ...]
+    def post(self, request, *args, **kwargs):
+        return Response(ingest_events(parse_events(request.data)), status=status.HTTP_200_OK)
+
+class DeviceSwitchView(generics.GenericAPIView):
+    """Switch all devices of a building (or of a room with `device_lookup="room"`), optionally of one type."""
+    queryset = Building.objects.all()
+    serializer_class = DeviceSwitchSerializer
+    device_lookup = "building"
+    permission_classes = [
+        AllowAny,
+    ]
+
+    # api/buildings/1/switch/ {"state": false, "type": "EnergyReceiver"}
+    def post(self, request, *args, **kwargs):
+        owner = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        devices = Device.objects.filter(**{self.device_lookup: owner})
+        device_type = serializer.validated_data.get("type")
+        if device_type:
+            devices = devices.filter(polymorphic_ctype__model=device_type.lower())
+        state = serializer.validated_data["state"]
+        return Response({"state": state, "switched": switch_devices(devices, state)}, status=status.HTTP_200_OK)
+
 class ChargeStateRaportView(generics.ListCreateAPIView):
     queryset = ChargeStateRaport.objects.all()
     serializer_class = ChargeStateRaportSerializer
@@ -0,0 +1,119 @@
+# What-if variants of a building; no Django imports, the module is loaded by pool workers
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .arrays import SharedArrays, clamped_cumsum
+
+DEVICE_POWER_PREFIX = "device_power:"
+RANK_KEYS = ("cost", "net_energy")
+
+
+class Variant(NamedTuple):
+    parameters: Dict[str, float]  # the grid values this variant was built from
+    generation_power: float  # W
+    capacity_kwh: float
+    receiver_power_kw: np.ndarray
+
+
+class BaseBuilding(NamedTuple):
+    """Parameters of the recorded building the variants start from."""
+    generation_power: float  # W
+    capacity: float  # Ah
+    battery_voltage: float  # V
+    receiver_names: List[str]
+    receiver_power: List[float]  # W
+
+
+def parameter_grid(base: BaseBuilding, grid: Dict[str, Sequence[float]]) -> List[Variant]:
+    """Every combination of the grid values applied to the base building.
+
+    Keys are `generation_power` (W), `capacity` (Ah at the base battery voltage) and
+    `device_power:<receiver name>` (W); parameters missing from the grid keep the base value.
+    """
+    names = list(grid)
+    unknown = [name for name in names if name not in ("generation_power", "capacity") and not (
+        name.startswith(DEVICE_POWER_PREFIX) and name[len(DEVICE_POWER_PREFIX):] in base.receiver_names)]
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(unknown)}.")
+    columns = {name: position for position, name in enumerate(base.receiver_names)}
+    variants = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        parameters = dict(zip(names, values))
+        power = np.array(base.receiver_power, dtype=float)
+        for name, value in parameters.items():
+            if name.startswith(DEVICE_POWER_PREFIX):
+                power[columns[name[len(DEVICE_POWER_PREFIX):]]] = value
+        variants.append(Variant(
+            parameters=parameters,
+            generation_power=parameters.get("generation_power", base.generation_power),
+            capacity_kwh=parameters.get("capacity", base.capacity) * base.battery_voltage / 1000,
+            receiver_power_kw=power / 1000,
+        ))
+    return variants
+
+
+def evaluate_variant(arrays: Dict[str, np.ndarray], variant: Variant, step_hours: float,
+                     charging_current_factor: float, charging_loss_factor: float) -> Dict[str, float]:
+    """Grid energy and cost of a variant over the recorded window.
+
+    `arrays` holds per step: `on_hours` (steps x receivers), `pv_kwh_per_watt`, `buy` and `sell`.
+    The battery stores the PV surplus and covers the deficit (self-consumption first) within its
+    charging power, keeping `1 - charging_loss_factor` of the energy it draws.
+    """
+    load = arrays["on_hours"] @ variant.receiver_power_kw
+    generation = arrays["pv_kwh_per_watt"] * variant.generation_power
+    grid = load - generation
+    if variant.capacity_kwh > 0:
+        limit = variant.capacity_kwh * charging_current_factor * step_hours
+        flow = np.clip(-grid, -limit, limit)
+        level = clamped_cumsum(np.where(flow > 0, flow * (1 - charging_loss_factor), flow), 0.0, variant.capacity_kwh)
+        stored = np.diff(level, prepend=0.0)
+        grid = grid + np.where(stored > 0, stored / (1 - charging_loss_factor), stored)
+    imported, exported = np.maximum(grid, 0.0), np.maximum(-grid, 0.0)
+    return {
+        **variant.parameters,
+        "load": float(load.sum()),
+        "generation": float(generation.sum()),
+        "import": float(imported.sum()),
+        "export": float(exported.sum()),
+        "net_energy": float(imported.sum() - exported.sum()),
+        "cost": float(imported @ arrays["buy"] - exported @ arrays["sell"]),
+    }
+
+
+# set in every pool worker by _attach
+_shared: Optional[SharedArrays] = None
+_options: Dict = {}
+
+
+def _attach(spec, options: Dict):
+    global _shared, _options
+    _shared, _options = SharedArrays.attach(spec), options
+
+
+def _evaluate(variant: Variant) -> Dict[str, float]:
+    return evaluate_variant(_shared.arrays, variant, **_options)
+
+
+def run_variants(arrays: Dict[str, np.ndarray], variants: Iterable[Variant], step_hours: float,
+                 charging_current_factor: float, charging_loss_factor: float, workers: int = None,
+                 rank_by: str = "cost") -> List[Dict[str, float]]:
+    """Evaluate the variants, in `workers` processes (all cores by default, none when 1) sharing `arrays`."""
+    variants = list(variants)
+    options = {"step_hours": step_hours, "charging_current_factor": charging_current_factor,
+               "charging_loss_factor": charging_loss_factor}
+    workers = min(workers or os.cpu_count() or 1, len(variants) or 1)
+    if workers == 1:
+        results = [evaluate_variant(arrays, variant, **options) for variant in variants]
+    else:
+        shared = SharedArrays.create(arrays)
+        try:
+            with ProcessPoolExecutor(workers, initializer=_attach, initargs=(shared.spec, options)) as executor:
+                results = list(executor.map(_evaluate, variants, chunksize=max(1, len(variants) // (workers * 4))))
+        finally:
+            shared.close(unlink=True)
+    return sorted(results, key=lambda row: row[rank_by])
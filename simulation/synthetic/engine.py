@@ -0,0 +1,188 @@
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Sequence
+
+import numpy as np
+
+from .generator import RECEIVER_TYPES
+
+# (session length range [min], mean gap between sessions [min]) of receivers of unknown kind
+DEFAULT_KIND = ((10, 120), 360)
+# relative chance of switching a device on in each hour of the day (mean 1): quiet nights, morning and evening peaks
+HOURLY_ACTIVITY = np.array([
+    0.2, 0.1, 0.1, 0.1, 0.1, 0.3, 0.9, 1.6, 1.5, 1.0, 0.9, 1.0,
+    1.2, 1.1, 1.0, 1.0, 1.2, 1.6, 2.0, 2.2, 2.0, 1.6, 1.0, 0.5,
+])
+HOURLY_ACTIVITY = HOURLY_ACTIVITY / HOURLY_ACTIVITY.mean()
+# kinds switched by a thermostat rather than by people
+FLAT_KINDS = {"fridge", "heater"}
+# battery charging power per hour as a share of the capacity, and share of the drawn energy lost when charging;
+# defaults for runs without Django, the smarthome app passes the factors of EnergyStorageCalculator
+CHARGING_CURRENT_FACTOR = 0.1
+CHARGING_LOSS_FACTOR = 0.05
+
+
+def kind_of(name: str) -> str:
+    """Receiver kind of a device name (e.g. `kettle_3`), "" when it matches no known kind."""
+    name = name.lower()
+    return next((kind for kind in sorted(RECEIVER_TYPES, key=len, reverse=True) if kind in name), "")
+
+
+def transition_probabilities(kinds: Sequence[str], step: timedelta):
+    """Per tick probabilities of switching on (hour x kind) and off (kind).
+
+    Sessions and gaps are exponential with the means of `RECEIVER_TYPES`; the on rate follows
+    `HOURLY_ACTIVITY` except for thermostat kinds.
+    """
+    minutes = step.total_seconds() / 60
+    switch_on = np.empty((24, len(kinds)), dtype=np.float32)
+    switch_off = np.empty(len(kinds), dtype=np.float32)
+    for column, kind in enumerate(kinds):
+        if kind in RECEIVER_TYPES:
+            _, (min_length, max_length), mean_gap = RECEIVER_TYPES[kind]
+        else:
+            (min_length, max_length), mean_gap = DEFAULT_KIND
+        activity = np.ones(24) if kind in FLAT_KINDS else HOURLY_ACTIVITY
+        switch_on[:, column] = 1 - np.exp(-minutes * activity / mean_gap)
+        switch_off[column] = 1 - math.exp(-minutes / ((min_length + max_length) / 2))
+    return switch_on, switch_off
+
+
+class Fleet(NamedTuple):
+    """Devices of many buildings as arrays; receivers are padded to the largest building (power 0)."""
+    receiver_power_kw: np.ndarray  # buildings x receivers
+    receiver_kind: np.ndarray  # buildings x receivers, index into `kinds`
+    receiver_mask: np.ndarray  # buildings x receivers, False for padding
+    kinds: List[str]
+    generation_power: np.ndarray  # buildings, W
+    storage_capacity_kwh: np.ndarray  # buildings
+    storage_initial_kwh: np.ndarray  # buildings
+
+    @property
+    def buildings(self) -> int:
+        return self.receiver_power_kw.shape[0]
+
+    @classmethod
+    def from_specifications(cls, buildings: List[Dict]) -> "Fleet":
+        """Fleet of building specifications: {"receivers": [(name, power W)], "generation_power",
+        "storage_capacity_kwh", "storage_initial_kwh"}."""
+        width = max([len(building["receivers"]) for building in buildings] + [1])
+        kinds = sorted({kind_of(name) for building in buildings for name, _ in building["receivers"]})
+        columns = {kind: column for column, kind in enumerate(kinds)}
+        power = np.zeros((len(buildings), width), dtype=np.float32)
+        kind = np.zeros((len(buildings), width), dtype=np.intp)
+        mask = np.zeros((len(buildings), width), dtype=bool)
+        for row, building in enumerate(buildings):
+            for column, (name, device_power) in enumerate(building["receivers"]):
+                power[row, column] = device_power / 1000
+                kind[row, column] = columns[kind_of(name)]
+                mask[row, column] = True
+        return cls(
+            receiver_power_kw=power, receiver_kind=kind, receiver_mask=mask, kinds=kinds or [""],
+            generation_power=np.array([building.get("generation_power", 0.0) for building in buildings], dtype=float),
+            storage_capacity_kwh=np.array([building.get("storage_capacity_kwh", 0.0) for building in buildings], dtype=float),
+            storage_initial_kwh=np.array([building.get("storage_initial_kwh", 0.0) for building in buildings], dtype=float),
+        )
+
+
+class SimulationSink:
+    """Receives what the simulator produces; this one only counts it."""
+
+    def __init__(self):
+        self.sessions = 0
+        self.charge_states = 0
+
+    def add_sessions(self, buildings: np.ndarray, receivers: np.ndarray, on_ticks: np.ndarray, off_ticks: np.ndarray):
+        """Finished sessions: receiver (building, column) was on from tick `on` to tick `off`."""
+        self.sessions += len(buildings)
+
+    def add_charge_states(self, tick: int, stored_kwh: np.ndarray):
+        """Stored energy of every building at the start of `tick`."""
+        self.charge_states += len(stored_kwh)
+
+    def close(self):
+        """Called once after the last tick."""
+
+
+class TickSimulator:
+    """Advances all buildings of a fleet together in fixed steps.
+
+    Each tick every receiver switches on or off at random with the probabilities of its kind
+    and hour, the PV makes its power times the factor of the tick, and the battery of every
+    building stores the surplus and covers the deficit up to its charging power
+    (`charging_current_factor` x capacity per hour), keeping `1 - charging_loss_factor` of the
+    energy it draws. State lives in (building x receiver) arrays, so the cost of a tick is a
+    few vector operations whatever the number of buildings.
+    """
+
+    def __init__(self, fleet: Fleet, start: datetime, step: timedelta = timedelta(minutes=5), seed: int = 0,
+                 charging_current_factor: float = CHARGING_CURRENT_FACTOR,
+                 charging_loss_factor: float = CHARGING_LOSS_FACTOR):
+        self.fleet = fleet
+        self.start = start
+        self.step = step
+        self.rng = np.random.default_rng(seed)
+        self.charging_current_factor = charging_current_factor
+        self.charging_loss_factor = charging_loss_factor
+        self.switch_on, self.switch_off = transition_probabilities(fleet.kinds, step)
+
+    def tick_date(self, tick: int) -> datetime:
+        return self.start + self.step * tick
+
+    def run(self, pv_factors: np.ndarray, sink: SimulationSink = None, checkpoint_ticks: int = 12) -> Dict[str, np.ndarray]:
+        """Simulate `len(pv_factors)` ticks and return per building totals (kWh).
+
+        `pv_factors` are the kW made per W of generation power in each tick (from the weather).
+        """
+        fleet, sink = self.fleet, sink or SimulationSink()
+        shape = fleet.receiver_power_kw.shape
+        hours = self.step.total_seconds() / 3600
+        state = np.zeros(shape, dtype=bool)
+        on_since = np.zeros(shape, dtype=np.int64)
+        draws = np.empty(shape, dtype=np.float32)
+        off_probability = self.switch_off[fleet.receiver_kind]
+        on_probability, current_hour = None, None
+        stored = np.minimum(fleet.storage_initial_kwh, fleet.storage_capacity_kwh)
+        power_limit_kwh = fleet.storage_capacity_kwh * self.charging_current_factor * hours
+        totals = {name: np.zeros(fleet.buildings) for name in ("load", "generation", "import", "export")}
+        pv_energy = np.asarray(pv_factors, dtype=float) * hours
+
+        for tick in range(len(pv_energy)):
+            hour = self.tick_date(tick).hour
+            if hour != current_hour:
+                on_probability = np.where(fleet.receiver_mask, self.switch_on[hour][fleet.receiver_kind], 0)
+                current_hour = hour
+            if tick % checkpoint_ticks == 0:
+                sink.add_charge_states(tick, stored)
+
+            self.rng.random(dtype=np.float32, out=draws)
+            changed = np.where(state, draws < off_probability, draws < on_probability)
+            if changed.any():
+                buildings, receivers = np.nonzero(changed)
+                ending = state[buildings, receivers]
+                if ending.any():
+                    sink.add_sessions(buildings[ending], receivers[ending], on_since[buildings[ending], receivers[ending]],
+                                      np.full(np.count_nonzero(ending), tick))
+                on_since[buildings[~ending], receivers[~ending]] = tick
+                state ^= changed
+
+            load = (fleet.receiver_power_kw * state).sum(axis=1) * hours
+            generation = fleet.generation_power * pv_energy[tick]
+            net = load - generation
+            charged = np.minimum(np.minimum(np.maximum(-net, 0.0), power_limit_kwh),
+                                 (fleet.storage_capacity_kwh - stored) / (1 - self.charging_loss_factor))
+            discharged = np.minimum(np.minimum(np.maximum(net, 0.0), power_limit_kwh), stored)
+            stored += charged * (1 - self.charging_loss_factor) - discharged
+            grid = net + charged - discharged
+            totals["load"] += load
+            totals["generation"] += generation
+            totals["import"] += np.maximum(grid, 0.0)
+            totals["export"] += np.maximum(-grid, 0.0)
+
+        # sessions still running end with the simulation
+        buildings, receivers = np.nonzero(state)
+        sink.add_sessions(buildings, receivers, on_since[buildings, receivers], np.full(len(buildings), len(pv_energy)))
+        sink.add_charge_states(len(pv_energy), stored)
+        sink.close()
+        totals["stored"] = stored
+        return totals
@@ -0,0 +1,122 @@
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+
+RECEIVER_TYPES = {
+    # name: (device_power range [W], session length range [min], mean gap between sessions [min])
+    "bulb": ((40, 100), (5, 180), 240),
+    "fridge": ((100, 250), (10, 30), 45),
+    "tv": ((80, 200), (30, 240), 600),
+    "kettle": ((1800, 2400), (2, 5), 300),
+    "oven": ((2000, 3500), (20, 90), 1440),
+    "washing_machine": ((500, 2200), (45, 120), 2880),
+    "computer": ((60, 400), (30, 480), 720),
+    "heater": ((1000, 2000), (30, 240), 480),
+}
+GENERATION_POWER = (2000, 8000)  # W
+STORAGE_CAPACITY = (50, 250)  # Ah
+STORAGE_VOLTAGE = 48.0  # V
+WEATHER_STEP = timedelta(minutes=5)
+
+
+class SyntheticDataGenerator:
+    """Deterministic generator of buildings, devices, device sessions and weather.
+
+    Every building and device has its own random stream derived from the seed, so
+    the data of one device does not depend on how many other devices are generated.
+    """
+
+    def __init__(self, seed: int = 0, start: datetime = datetime(2022, 1, 1), receivers_per_building: int = 10,
+                 generators_per_building: int = 1, storages_per_building: int = 1):
+        self.seed = seed
+        self.start = start
+        self.receivers_per_building = receivers_per_building
+        self.generators_per_building = generators_per_building
+        self.storages_per_building = storages_per_building
+
+    def _random(self, *key) -> random.Random:
+        return random.Random(":".join(str(part) for part in (self.seed,) + key))
+
+    @property
+    def devices_per_building(self) -> int:
+        return self.receivers_per_building + self.generators_per_building + self.storages_per_building
+
+    def user(self, building_index: int) -> Dict:
+        return {"email": f"synthetic_user_{building_index}@mail.com", "name": f"user_{building_index}"}
+
+    def building(self, building_index: int) -> Dict:
+        rng = self._random("building", building_index)
+        return {
+            "name": f"synthetic_building_{building_index}",
+            "icon": rng.randint(0, 5),
+            "rooms": [
+                {"name": room, "area": round(rng.uniform(6, 40), 1)}
+                for room in ("kitchen", "living_room", "bedroom", "bathroom")
+            ],
+        }
+
+    def devices(self, building_index: int) -> Iterator[Dict]:
+        """Yield device specifications of a building, receivers first."""
+        rng = self._random("devices", building_index)
+        receiver_names = sorted(RECEIVER_TYPES)
+        rooms = [room["name"] for room in self.building(building_index)["rooms"]]
+        for index in range(self.receivers_per_building):
+            kind = receiver_names[index % len(receiver_names)]
+            power_range = RECEIVER_TYPES[kind][0]
+            yield {
+                "name": f"{kind}_{index}",
+                "type": "EnergyReceiver",
+                "kind": kind,
+                "room": rooms[index % len(rooms)],
+                "device_power": float(rng.randint(*power_range)),
+                "supply_voltage": 230.0,
+            }
+        for index in range(self.generators_per_building):
+            yield {
+                "name": f"photovoltaics_{index}",
+                "type": "EnergyGenerator",
+                "kind": "photovoltaics",
+                "room": None,
+                "generation_power": float(rng.randint(*GENERATION_POWER)),
+            }
+        for index in range(self.storages_per_building):
+            yield {
+                "name": f"battery_{index}",
+                "type": "EnergyStorage",
+                "kind": "battery",
+                "room": None,
+                "capacity": float(rng.randint(*STORAGE_CAPACITY)),
+                "battery_voltage": STORAGE_VOLTAGE,
+            }
+
+    def sessions(self, building_index: int, device: Dict, count: int) -> Iterator[Tuple[datetime, datetime]]:
+        """Yield `count` consecutive (turned_on, turned_off) sessions of a receiver."""
+        rng = self._random("sessions", building_index, device["name"])
+        _, (min_length, max_length), mean_gap = RECEIVER_TYPES[device["kind"]]
+        moment = self.start + timedelta(minutes=rng.uniform(0, mean_gap))
+        for _ in range(count):
+            turned_on = moment.replace(microsecond=0)
+            turned_off = turned_on + timedelta(minutes=rng.randint(min_length, max_length))
+            yield turned_on, turned_off
+            moment = turned_off + timedelta(minutes=1 + rng.expovariate(1 / mean_gap))
+
+    def solar_radiation(self, moment: datetime, rng: random.Random) -> float:
+        """Clear-sky bell between 6:00 and 20:00 scaled by a season factor and cloud noise [W/m^2]."""
+        hour = moment.hour + moment.minute / 60
+        if not 6 <= hour <= 20:
+            return 0.0
+        season = 0.55 + 0.45 * math.sin(math.pi * (moment.timetuple().tm_yday - 80) / 183)
+        clear_sky = 1000 * math.sin(math.pi * (hour - 6) / 14) * max(season, 0.1)
+        return round(clear_sky * rng.uniform(0.3, 1.0), 1)
+
+    def weather(self, end: datetime, start: Optional[datetime] = None) -> Iterator[Tuple[datetime, datetime, float, float, float]]:
+        """Yield 5-minute (datetime_from, datetime_to, solar_radiation, temperature, wind_speed) rows."""
+        rng = self._random("weather")
+        moment = start or self.start
+        while moment < end:
+            day_fraction = (moment.hour * 60 + moment.minute) / 1440
+            temperature = round(10 + 8 * math.sin(2 * math.pi * (day_fraction - 0.3)) + rng.uniform(-1, 1), 1)
+            wind_speed = round(rng.uniform(0, 12), 1)
+            yield moment, moment + WEATHER_STEP, self.solar_radiation(moment, rng), temperature, wind_speed
+            moment += WEATHER_STEP
@@ -0,0 +1,117 @@
+import json
+import os
+from datetime import timedelta
+from typing import IO, Dict, Iterable, Iterator, List
+
+from .generator import SyntheticDataGenerator
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+MANIFEST_FILENAME = "scenario.json"
+WEATHER_FILENAME = "weather.json"
+RAPORTS_DIRECTORY = "raports"
+
+
+def write_chunked(stream: IO[str], parts: Iterable[str], chunk_size: int) -> int:
+    """Write `parts` joined in chunks of `chunk_size`, so nothing but the current chunk is held in memory."""
+    chunk, written = [], 0
+    for part in parts:
+        chunk.append(part)
+        if len(chunk) >= chunk_size:
+            stream.write("".join(chunk))
+            written += len(chunk)
+            chunk = []
+    stream.write("".join(chunk))
+    return written + len(chunk)
+
+
+class Scenario:
+    """Users, buildings, devices, device sessions and weather of a synthetic scenario.
+
+    `users` users own `buildings_per_user` buildings each; every receiver has `sessions_per_device`
+    sessions and the weather covers `weather_days` in 5-minute steps. Everything comes from the
+    seeded generator, so a scenario is the same whether it is written to files or loaded directly.
+    """
+
+    def __init__(self, generator: SyntheticDataGenerator, users: int, buildings_per_user: int = 1,
+                 sessions_per_device: int = 1000, weather_days: float = 30, chunk_size: int = 10000):
+        self.generator = generator
+        self.users = users
+        self.buildings_per_user = buildings_per_user
+        self.sessions_per_device = sessions_per_device
+        self.weather_end = generator.start + timedelta(days=weather_days)
+        self.chunk_size = chunk_size
+
+    @property
+    def buildings(self) -> int:
+        return self.users * self.buildings_per_user
+
+    def user(self, building_index: int) -> Dict:
+        return self.generator.user(building_index // self.buildings_per_user)
+
+    def receivers(self, building_index: int) -> List[Dict]:
+        return [device for device in self.generator.devices(building_index) if device["type"] == "EnergyReceiver"]
+
+    def raport_rows(self, building_index: int, device: Dict) -> Iterator[str]:
+        """JSON raports of a receiver, comma separated.
+
+        Sessions have whole seconds, so str() gives DATE_FORMAT; it and an f-string are several
+        times faster than strftime and json.dumps, which dominated writing big scenarios.
+        """
+        sessions = self.generator.sessions(building_index, device, self.sessions_per_device)
+        for index, (turned_on, turned_off) in enumerate(sessions):
+            yield f'{"," if index else ""}{{"turned_on": "{turned_on}", "turned_off": "{turned_off}"}}'
+
+    def raports_filename(self, building_index: int) -> str:
+        return os.path.join(RAPORTS_DIRECTORY, f"building_{building_index}.json")
+
+    def write_manifest(self, stream: IO[str]) -> int:
+        """{"seed", "start", "users": [{"email", "name", "buildings": [{"name", "icon", "rooms", "devices", "raports_file"}]}],
+        "weather_file"}, one user at a time."""
+        def parts():
+            yield json.dumps({"seed": self.generator.seed, "start": self.generator.start.strftime(DATE_FORMAT),
+                              "weather_file": WEATHER_FILENAME})[:-1] + ', "users": ['
+            for user_index in range(self.users):
+                first = user_index * self.buildings_per_user
+                buildings = [{**self.generator.building(index), "devices": list(self.generator.devices(index)),
+                              "raports_file": self.raports_filename(index)}
+                             for index in range(first, first + self.buildings_per_user)]
+                yield ("," if user_index else "") + json.dumps({**self.user(first), "buildings": buildings})
+            yield "]}\n"
+        return write_chunked(stream, parts(), self.chunk_size)
+
+    def write_raports(self, stream: IO[str], building_index: int) -> int:
+        """Raports of one building in the schema of `data_json/first_scenario_raports.json`; returns their number."""
+        user, building = self.user(building_index), self.generator.building(building_index)
+        stream.write(json.dumps({"building_name": building["name"], "user_email": user["email"]})[:-1] + ', "devices": [')
+        written = 0
+        for position, device in enumerate(self.receivers(building_index)):
+            stream.write(("," if position else "") + json.dumps({"device_name": device["name"]})[:-1] + ', "raports": [')
+            written += write_chunked(stream, self.raport_rows(building_index, device), self.chunk_size)
+            stream.write("]}")
+        stream.write("]}\n")
+        return written
+
+    def write_weather(self, stream: IO[str]) -> int:
+        """{date: {"real": {"solar_radiation", "temperature", "wind_speed"}}}, as read by populate_db_from_file."""
+        def parts():
+            for index, (datetime_from, _, solar_radiation, temperature, wind_speed) in enumerate(
+                    self.generator.weather(self.weather_end)):
+                yield ("," if index else "") + json.dumps(datetime_from.strftime(DATE_FORMAT)) + ": " + json.dumps(
+                    {"real": {"solar_radiation": solar_radiation, "temperature": temperature, "wind_speed": wind_speed}})
+        stream.write("{")
+        written = write_chunked(stream, parts(), self.chunk_size)
+        stream.write("}\n")
+        return written
+
+    def write(self, directory: str) -> Dict[str, int]:
+        """Write the manifest, one raports file per building and the weather file into `directory`."""
+        os.makedirs(os.path.join(directory, RAPORTS_DIRECTORY), exist_ok=True)
+        counts = {"users": self.users, "buildings": self.buildings, "device_raports": 0}
+        with open(os.path.join(directory, MANIFEST_FILENAME), "w") as stream:
+            self.write_manifest(stream)
+        for building_index in range(self.buildings):
+            with open(os.path.join(directory, self.raports_filename(building_index)), "w") as stream:
+                counts["device_raports"] += self.write_raports(stream, building_index)
+        with open(os.path.join(directory, WEATHER_FILENAME), "w") as stream:
+            counts["weather_raports"] = self.write_weather(stream)
+        return counts